@@ -0,0 +1,35 @@
+"""
+Compare the time needed to render a version of a document, with and without numeric mode.
+
+Usage: python benchmarks/numeric_mode.py [number_of_versions]
+"""
+
+import sys
+import time
+
+from ptyx.config import param
+from ptyx.latex_generator import Compiler
+
+CODE = "#SEED{1}\n" + 40 * (
+    "#{a=randint(2, 9);b=srandint(2, 9);c=randfrac(2, 9);}"
+    r"$#{a}x #+#{b} = #{c}$ so $x = #{x=(c-b)/a}$ #=#[2]{x}, and $x^2=#{x^2}$."
+    "\n"
+)
+
+
+def benchmark(numeric_mode: bool, versions: int) -> float:
+    """Return the mean time needed to render a version of the document, in milliseconds."""
+    param["numeric_mode"] = numeric_mode
+    compiler = Compiler(code=CODE)
+    start = time.perf_counter()
+    for num in range(versions):
+        compiler.get_latex(PTYX_NUM=num)
+    return 1000 * (time.perf_counter() - start) / versions
+
+
+if __name__ == "__main__":
+    versions = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    default = benchmark(False, versions)
+    numeric = benchmark(True, versions)
+    print(f"Default mode: {default:.1f} ms/version")
+    print(f"Numeric mode: {numeric:.1f} ms/version (x{default / numeric:.1f})")
@@ -490,10 +490,9 @@ def generate_latex_file(
             context = {}
 
         context.setdefault("PTYX_NUM", 1)
-        latex = compiler.get_latex(**context)
-
+        # LaTeX code is written progressively, to keep memory usage low for long documents.
         with open(texfile_path, "w") as texfile:
-            texfile.write(latex)
+            compiler.write_latex(texfile, **context)
         return texfile_path
 
 
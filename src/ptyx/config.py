@@ -15,6 +15,34 @@ param: ParamDict = {
     "debug": False,
     "floating_point": ",",
     "win_print_command": "SumatraPDF.exe -print-dialog -silent -print-to-default ",
+    # Preprocess and tokenize included files in parallel, each one in its own process.
+    # Note that extensions are then applied to each included file separately: the code
+    # of the main file they receive contains #INCLUDE_TREE{num} markers in place of included files.
+    # Seeds generated by extensions in included files come after the ones of the main file.
+    "parallel_includes": False,
+    # Maximal number of syntax trees kept in cache, when parsing pTyX code generated at runtime
+    # (i.e. `write(..., parse=True)`). Set it to 0 to disable cache.
+    "parse_cache_size": 256,
+    # Maximal number of LaTeX strings kept in cache, when printing sympy expressions
+    # (see `ptyx.printers.sympy2latex()`). Set it to 0 to disable cache.
+    "latex_cache_size": 1024,
+    # Maximal number of results of python expressions kept in cache, indexed by the values
+    # of the variables they use (see `LatexGenerator._memoized_eval()`). Set it to 0 to disable cache.
+    "expression_cache_size": 4096,
+    # Evaluate numbers using python int, fractions.Fraction and float instead of sympy objects,
+    # which is much faster. Sympy is still used as soon as a symbolic object is needed.
+    # (See `ptyx.numeric`).
+    "numeric_mode": False,
+    # Use an independent random stream for each #SHUFFLE, #PICK and #PYTHON block, derived from
+    # the seed, the document number and the position of the block in the document.
+    # So, editing a part of the document won't change the random content of the other blocks.
+    # Note that enabling this changes the generated documents.
+    "independent_random_streams": False,
+    # When sampling values satisfying a condition (`let ... with <condition>` syntax of the
+    # `extended_python` extension), enumerate small finite domains once and pick one of the
+    # satisfying tuples, instead of drawing values until the condition is satisfied.
+    # This is much faster for restrictive conditions, but changes the generated documents.
+    "enumerate_conditions": False,
 }
 # </default_configuration>
 
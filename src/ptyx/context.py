@@ -2,12 +2,16 @@ import random
 import math
 
 import builtins
+import functools
+from typing import Any
 
+import ptyx.numeric as numeric
 import ptyx.randfunc as randfunc
 from ptyx.printers import sympy2latex
 from ptyx.sys_info import SYMPY_AVAILABLE, NUMPY_AVAILABLE
 from ptyx.utilities import latex_verbatim
 
+
 GLOBAL_CONTEXT = dict()
 
 for fname in [
@@ -60,6 +64,10 @@ if NUMPY_AVAILABLE:
 
     GLOBAL_CONTEXT["numpy"] = numpy
 
+# Helpers used by expressions compiled for numeric mode (see `ptyx.numeric`).
+GLOBAL_CONTEXT[numeric.DIV] = numeric.div
+GLOBAL_CONTEXT[numeric.POW] = numeric.power
+
 GLOBAL_CONTEXT["sign"] = lambda x: ("+" if x > 0 else "-")
 GLOBAL_CONTEXT["round"] = round
 GLOBAL_CONTEXT["min"] = min
@@ -85,9 +93,15 @@ for fname in (
     "srandchoice",
     "randsample",
     "randmatrix",
+    "randmatrices",
     "randpop",
     "shuffle",
     "many",
+    "many_with",
+    "randints",
+    "srandints",
+    "randfracs",
+    "randfloats",
     "distinct",
     "_print_state",
     "randmaketrans",
@@ -99,3 +113,37 @@ for fname in (
 GLOBAL_CONTEXT["PTYX_NUM"] = 0
 GLOBAL_CONTEXT["latex"] = sympy2latex
 GLOBAL_CONTEXT["latex_verbatim"] = latex_verbatim
+
+
+@functools.cache
+def context_builtins() -> dict[str, Any]:
+    """Return the builtins of the evaluation contexts: python builtins, and all the values of `GLOBAL_CONTEXT`.
+
+    This dictionary is built only once, so `GLOBAL_CONTEXT` must not be modified after
+    the first evaluation context is created.
+    """
+    context_builtins_ = vars(builtins).copy()
+    context_builtins_.update(GLOBAL_CONTEXT)
+    # `exec()` adds a `__builtins__` entry to `GLOBAL_CONTEXT`.
+    context_builtins_.pop("__builtins__", None)
+    return context_builtins_
+
+
+def new_context() -> dict[str, Any]:
+    """Return a new evaluation context, to be used as globals by `exec()` and `eval()`.
+
+    Values of `GLOBAL_CONTEXT` are not copied (it contains all sympy objects), but
+    are found through the `__builtins__` of the context (see `context_builtins()`).
+    Since the context and its builtins are plain dictionaries, looking up names stays fast.
+
+    Use `lookup()` to read a value which may come from `GLOBAL_CONTEXT`.
+    """
+    return {"__builtins__": context_builtins()}
+
+
+def lookup(context: dict[str, Any], name: str, default: Any = None) -> Any:
+    """Return the value of `name` in `context`, or in `GLOBAL_CONTEXT` if it is not set in `context`."""
+    try:
+        return context[name]
+    except KeyError:
+        return GLOBAL_CONTEXT.get(name, default)
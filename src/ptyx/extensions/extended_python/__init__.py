@@ -22,6 +22,11 @@ An example:
     let a, b in 2..20 with a > 2*b
     ...........................
 
+    With `let ... with <condition>`, values are drawn until the condition is satisfied.
+    If `param["enumerate_conditions"]` is True and the set of possible values is small,
+    all the valid values are listed once and picked directly instead
+    (see `ptyx.randfunc.many_with()`).
+
 
     IMPORTANT!
     This syntax extension does only support one line statements!
@@ -133,18 +138,17 @@ def parse_extended_python_line(original_line: str) -> str:
     joined_args = ", ".join(args)
     function_call = f"many({len(names_list)}, {joined_args})"
     if condition:
-        # Loop while condition is false.
-        # It's better to do it in one line, to not change line numbering when debugging.
-        # Ideally, we should do this:
-        #  line = f"while ((({joined_names}) := {function_call} or True) and not ({condition})): pass"
-        # However, tuple unpacking is not allowed in walrus operator for now:
-        # https://github.com/python/cpython/issues/87309
-        # So, we'll have to create a temporary variable:
-        # let's call it `_tmp_ptyx_var` to avoid name collisions.
-        # Then, we will affect all its values to each variable.
-        affectation = f"_tmp_ptyx_var := {function_call}, "
-        affectation += ", ".join(f"{name} := _tmp_ptyx_var[{i}]" for i, name in enumerate(names_list))
-        line = f"while ((({affectation}) or True) and not ({condition})): pass"
+        # The values are drawn by `many_with()`, which draws values again and again until the condition
+        # is satisfied, or enumerates the valid values if the domain is small enough and enumeration
+        # is enabled (see `ptyx.randfunc.many_with()`).
+        # The condition is passed as a lambda function, to be evaluated in the current scope.
+        # Note that the lambda arguments are named after the variables.
+        names_args = ", ".join(names_list)
+        # The source of the condition is given too, for warnings.
+        line = (
+            f"{joined_names} = many_with(lambda {names_args}: ({condition}), {len(names_list)}, {joined_args},"
+            f" source={condition!r})"
+        )
     else:
         line = f"{joined_names} = {function_call}"
 
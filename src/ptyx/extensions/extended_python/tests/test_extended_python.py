@@ -4,7 +4,11 @@ EXTENDED PYTHON
 """
 
 import pytest
+
+from ptyx import randfunc
+from ptyx.errors import PythonBlockError
 from ptyx.latex_generator import Compiler
+from ptyx.config import param
 
 import ptyx.extensions.extended_python
 from ptyx.extensions.extended_python import main
@@ -62,14 +66,12 @@ f()
 ................................
 Some text too.
 """
-    affect1 = "(_tmp_ptyx_var := many(2, srandint), a := _tmp_ptyx_var[0], b := _tmp_ptyx_var[1])"
-    affect2 = "(_tmp_ptyx_var := many(2, randint, a=2, b=5), c := _tmp_ptyx_var[0], d := _tmp_ptyx_var[1])"
-    text2 = f"""
+    text2 = """
 Some text.
 #PYTHON
 def f():
-    while (({affect1} or True) and not (a*b % 2 == 0)): pass
-    while (({affect2} or True) and not (c > d)): pass
+    a, b, = many_with(lambda a, b: (a*b % 2 == 0), 2, srandint, source='a*b % 2 == 0')
+    c, d, = many_with(lambda c, d: (c > d), 2, randint, a=2, b=5, source='c > d')
 f()
 #END_PYTHON
 Some text too.
@@ -90,6 +92,111 @@ OK
     assert compiler.parse(code=code).strip() == "OK"
 
 
+def test_let_with_default_sampling(compiler):
+    # Values must be the same as when drawing them again and again explicitly.
+    code = """
+#LOAD{extended_python}#SEED{7}
+........
+n = 3
+let a, b in 2..20 with a > n*b
+let c in 1,1,1,2,3 with c != 3
+........
+#a,#b,#c
+"""
+    manual_code = """
+#SEED{7}
+#PYTHON
+n = 3
+while True:
+    a, b = many(2, randint, a=2, b=20)
+    if a > n*b: break
+while True:
+    c, = many(1, randchoice, items=[1,1,1,2,3])
+    if c != 3: break
+#END_PYTHON
+#a,#b,#c
+"""
+    compiler.load(code=code)
+    results = [compiler.get_latex(PTYX_NUM=num) for num in range(1, 11)]
+    manual_compiler = Compiler()
+    manual_compiler.load(code=manual_code)
+    assert results == [manual_compiler.get_latex(PTYX_NUM=num) for num in range(1, 11)]
+    assert compiler.latex_generator.condition_sampling.stats.enumerations == 0
+
+
+def test_let_with_enumeration(compiler, monkeypatch):
+    monkeypatch.setitem(param, "enumerate_conditions", True)
+    code = """
+#LOAD{extended_python}#SEED{7}
+........
+n = 3
+let a, b in 2..20 with a > n*b
+let c, d in -9..9 with c + d == b
+assert a > 3*b and 2 <= a <= 20 and b >= 2
+........
+#a,#b
+"""
+    compiler.load(code=code)
+    results = {compiler.get_latex(PTYX_NUM=num) for num in range(1, 11)}
+    assert len(results) > 1
+    # Valid tuples were enumerated only once for the first condition (`n` never changes),
+    # but again for the second one for each new value of `(a, b)`.
+    stats = compiler.latex_generator.condition_sampling.stats
+    assert stats.cache_hits >= 9
+    assert 2 <= stats.enumerations <= 6
+    # Statistics are not shared between compilers.
+    assert Compiler().latex_generator.condition_sampling.stats.calls == 0
+
+
+@pytest.mark.parametrize("enumerate_conditions", (False, True))
+def test_let_with_unsatisfiable_condition(compiler, monkeypatch, enumerate_conditions):
+    monkeypatch.setitem(param, "enumerate_conditions", enumerate_conditions)
+    monkeypatch.setattr(randfunc, "MAX_REJECTION_ITERATIONS", 10)
+    code = """
+#LOAD{extended_python}
+........
+let a, b in 2..5 with a > 10
+........
+"""
+    with pytest.raises(PythonBlockError) as exc_info:
+        compiler.parse(code=code)
+    assert isinstance(exc_info.value.__cause__, ValueError)
+
+
+def test_let_with_rejection_sampling(compiler, monkeypatch):
+    # The domain of `srandfrac` is not known, so rejection sampling is used.
+    code = """
+#LOAD{extended_python}#SEED{3}
+........
+let a, b / with a < b
+let c in 1..1000000 with c % 7 == 0
+assert a < b and c % 7 == 0
+........
+OK
+"""
+    monkeypatch.setitem(param, "enumerate_conditions", True)
+    assert compiler.parse(code=code).strip() == "OK"
+    stats = compiler.latex_generator.condition_sampling.stats
+    assert stats.draws > 0 and stats.enumerations == 0
+    assert 0 < stats.acceptance_rate <= 1
+    monkeypatch.setattr(randfunc, "MAX_REJECTION_ITERATIONS", 10)
+    with pytest.raises(PythonBlockError):
+        compiler.parse(code=code.replace("c % 7 == 0", "c < 0"))
+
+
+def test_let_with_warning(compiler, monkeypatch, capsys):
+    monkeypatch.setattr(randfunc, "REJECTION_WARNING_THRESHOLD", 0)
+    code = """
+#LOAD{extended_python}#SEED{3}
+........
+let a, b in 1..9 with a + b == 10
+........
+OK
+"""
+    assert compiler.parse(code=code).strip() == "OK"
+    assert "Condition `a + b == 10` satisfied after" in capsys.readouterr().out
+
+
 def test_change_delimiter(monkeypatch):
     assert isinstance(ptyx.extensions.extended_python.PYTHON_DELIMITER, str)
 
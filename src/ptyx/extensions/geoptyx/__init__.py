@@ -32,6 +32,7 @@ It adds the following commands to pTyX:
 
 import random
 
+from ptyx.context import GLOBAL_CONTEXT
 from ptyx.extensions import CompilerExtension
 from wxgeometrie.modules.tablatex import tabval, tabvar, tabsign
 from wxgeometrie.mathlib.parsers import traduire_formule
@@ -54,7 +55,9 @@ class GeoptyxLatexGenerator(LatexGenerator):
         name = args[0] if args else "RESULT"
 
         fonctions = [
-            key for key, val in self.context.items() if isinstance(val, (type(sympy.sqrt), type(sympy.cos)))
+            key
+            for key, val in {**GLOBAL_CONTEXT, **self.context}.items()
+            if isinstance(val, (type(sympy.sqrt), type(sympy.cos)))
         ]
 
         def eval_and_store(txt, name):
@@ -1,6 +1,6 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import Enum, auto
-from typing import TypedDict
+from typing import TypedDict, Any
 
 
 class ParamDict(TypedDict):
@@ -11,6 +11,13 @@ class ParamDict(TypedDict):
     debug: bool
     floating_point: str
     win_print_command: str
+    parallel_includes: bool
+    parse_cache_size: int
+    latex_cache_size: int
+    expression_cache_size: int
+    numeric_mode: bool
+    independent_random_streams: bool
+    enumerate_conditions: bool
 
 
 class CustomParamDict(TypedDict, total=False):
@@ -21,6 +28,13 @@ class CustomParamDict(TypedDict, total=False):
     debug: bool
     floating_point: str
     win_print_command: str
+    parallel_includes: bool
+    parse_cache_size: int
+    latex_cache_size: int
+    expression_cache_size: int
+    numeric_mode: bool
+    independent_random_streams: bool
+    enumerate_conditions: bool
 
 
 class NiceOp(Enum):
@@ -51,4 +65,36 @@ class EvalFlags:
     suppress_next_eval: bool = False
 
 
+@dataclass(frozen=True)
+class EvalStatement:
+    """A python statement of an #EVAL tag, like `a=7` or `a+1` in `#{a=7;a+1}`."""
+
+    # The python expression to evaluate.
+    code: str
+    # The name of the variable where the result must be stored.
+    varname: str = "_"
+    # For an assignment like `mylist[i]=...`, the python code of the item key (`i`).
+    key: str | None = None
+
+
+@dataclass(frozen=True)
+class EvalTagInfo:
+    """The information about an #EVAL tag which doesn't depend on the evaluation context.
+
+    It is computed only once, before the tag is rendered for the first time.
+    """
+
+    # The flags given in the tag options, as {EvalFlags attribute: value}.
+    flags: dict[str, Any] = field(default_factory=dict)
+    # An error message, if an unknown flag was found.
+    error: str | None = None
+    # The label of the python code (see `LatexGenerator._get_python_code_tag()`).
+    label: str = ""
+    # The python code, without the label.
+    code: str = ""
+    # If False, the result must not be displayed (python code ends with `;`).
+    display: bool = True
+    statements: tuple[EvalStatement, ...] = ()
+
+
 PtyxTraceback = list[tuple[str | None, int | None]]
@@ -1,12 +1,33 @@
+import builtins
+import concurrent.futures
+import functools
+import io
 import os.path
 import random
 import re
+import tokenize
 import traceback
 import zlib
+from collections import ChainMap
+from contextlib import contextmanager, nullcontext
 from importlib import import_module, metadata
+from itertools import repeat
 from pathlib import Path
-from types import ModuleType
-from typing import Optional, Union, Callable, Iterable, Dict, Tuple, List, TypedDict, Any
+from types import ModuleType, CodeType, BuiltinFunctionType
+from typing import (
+    Optional,
+    Union,
+    Callable,
+    Iterable,
+    Iterator,
+    Dict,
+    List,
+    TypedDict,
+    Any,
+    Sequence,
+    TextIO,
+    Mapping,
+)
 
 from ptyx.pretty_print import pretty_box, yellow
 
@@ -16,22 +37,42 @@ from ptyx.extensions import CompilerExtension
 import ptyx.randfunc as randfunc
 from ptyx import __version__
 from ptyx.config import param
-from ptyx.context import GLOBAL_CONTEXT
-from ptyx.internal_types import NiceOp, PickItemAction, EvalFlags, PtyxTraceback
-from ptyx.sys_info import SYMPY_AVAILABLE
+from ptyx.context import GLOBAL_CONTEXT, new_context, lookup
+from ptyx.internal_types import NiceOp, PickItemAction, EvalFlags, PtyxTraceback, EvalStatement, EvalTagInfo
+from ptyx.sys_info import SYMPY_AVAILABLE, CPU_PHYSICAL_CORES
 
 from ptyx.syntax_tree import Node, SyntaxTreeGenerator, Tag, TagSyntax
-from ptyx.utilities import advanced_split, numbers_to_floats, _float_me_if_you_can, latex_verbatim
+from ptyx.numeric import compile_numeric_expr, numeric2latex
+from ptyx.render import RenderFunction, compile_tree
+from ptyx.specialize import specializable_names, specialize_tree
+from ptyx.printers import LATEX_CACHE
+from ptyx.preprocessor import Preprocessor, PreprocessedCode, SourceBuffer, clean_generated_code
+from ptyx.utilities import (
+    advanced_split,
+    numbers_to_floats,
+    _numbers_to_floats,
+    latex_verbatim,
+    LRUCache,
+    is_memoizable,
+    memoization_key,
+)
 
 
 class State(TypedDict, total=False):
     syntax_tree: Node
     seed: Optional[int]
-    input: str
+    input: str | SourceBuffer
     path: Optional[Path]
     loaded_extensions: dict[str, ModuleType]
     plain_ptyx_code: str
     after_include: Optional[str]
+    included_trees: list[Node]
+    # The function rendering the syntax tree, and the LaTeX generator it was compiled for.
+    render: tuple["LatexGenerator", RenderFunction]
+    # The names of the context values the syntax tree may be specialized for (see `ptyx.specialize`).
+    specializable_names: tuple[str, ...]
+    # The functions rendering the specialized syntax trees, indexed by the known context values.
+    specialized_renders: tuple["LatexGenerator", LRUCache[tuple, RenderFunction]]
 
 
 class LastEvaluatedExpressionInfo:
@@ -64,6 +105,24 @@ class LastEvaluatedExpressionInfo:
 # =============================================================================
 
 
+_MISSING = object()
+
+
+@functools.cache
+def _sympy_global_dict() -> dict[str, Any]:
+    """Return the globals used by `sympy.sympify()` to evaluate parsed expressions."""
+    import sympy
+
+    global_dict: dict[str, Any] = {}
+    exec("from sympy import *", global_dict)
+    for name, obj in vars(builtins).items():
+        if isinstance(obj, BuiltinFunctionType):
+            global_dict[name] = obj
+    global_dict["max"] = sympy.Max
+    global_dict["min"] = sympy.Min
+    return global_dict
+
+
 # noinspection PyPep8Naming,PyMethodMayBeStatic
 class LatexGenerator:
     """Convert text containing ptyx tags to plain LaTeX."""
@@ -76,6 +135,10 @@ class LatexGenerator:
         "?": "SIGN",
         # "#": "SHARP",
     }
+    # Tags whose output only depends on their content: subtrees made only of text and of those tags
+    # are the same in every version of the document, so they are rendered only once (see `ptyx.render`).
+    # Extensions subclassing LatexGenerator should add their own tags here if they are pure too.
+    pure_tags = frozenset({"ROOT", "ITEM", "ENUM", "VERBATIM", "COMMENT"})
 
     # noinspection RegExpRedundantEscape
     re_varname = re.compile(r"[A-Za-z_]\w*(\[.+\])?$")
@@ -92,6 +155,14 @@ class LatexGenerator:
     backups: list[list[str]]
     # Remember the position of the last text generated by an evaluated expression, like `#{a+7}`.
     last_eval_position: LastEvaluatedExpressionInfo
+    # The list of LaTeX fragments containing the pending `#=` marker, and the marker position in this list.
+    equal_marker: tuple[list[str], int] | None
+    # If set, generated LaTeX code is progressively written to this file-like object (see `flush()`).
+    output: TextIO | None
+    # When an output is set, try to flush generated LaTeX code each time this number of fragments is reached.
+    flush_threshold = 1000
+    # The number of fragments of `context["PTYX_LATEX"]` already scanned by `flush()`.
+    _flush_scanned: int
 
     def __init__(self, compiler=None):
         self.clear()
@@ -106,16 +177,36 @@ class LatexGenerator:
         # Add ability to share values between compilations (needed by some
         # extensions).
         self.cache = {}
+        # Compiled python code, indexed by source code and compilation mode (see `_compile()`).
+        self._compiled_code: dict[tuple[str, str], CodeType] = {}
+        # Python code blocks (#PYTHON...#END_PYTHON) ready to be executed, see `_exec_python_code()`.
+        self._python_blocks: dict[str, tuple[str, str, CodeType]] = {}
+        # Names used by python expressions (see `_expression_names()`).
+        self._expression_names_cache: dict[str, tuple[str, ...]] = {}
+        # The code generated by sympy parser for expressions evaluated by sympy (see `_compile_sympy_expr()`).
+        self._sympy_compiled_code: dict[tuple[str, tuple[int, ...]], tuple[CodeType, dict[str, Any]]] = {}
+        # The results of python expressions, indexed by the values of the names they use
+        # (see `_memoized_eval()`).
+        self.expression_cache: LRUCache[tuple, object] = LRUCache(param["expression_cache_size"])
+        # The LaTeX code of sympy expressions is cached for the whole process (see `ptyx.printers`),
+        # so its size is only updated here, to take into account any change of the configuration.
+        LATEX_CACHE.resize(param["latex_cache_size"])
+        # Statistics of `randfunc.many_with()`, and the tuples satisfying the enumerated conditions.
+        self.condition_sampling = randfunc.ConditionSampling()
 
     def clear(self, main_file: Path | None = None) -> None:
         self.macros = {}
-        self.context = GLOBAL_CONTEXT.copy()
+        # Don't copy GLOBAL_CONTEXT, which is huge: its values are read from the context builtins.
+        self.context = new_context()
         # PTYX_LATEX will contain a list of generated LaTeX code parts, to be eventually concatenated.
         self.context["PTYX_LATEX"]: list[str] = []  # type: ignore
         # This is used to keep a track of included files, to be able to generate a traceback when debugging.
         self.context["PTYX_TRACEBACK"]: PtyxTraceback = [(str(main_file), None)]  # type: ignore
         self.backups = []
         self.last_eval_position = LastEvaluatedExpressionInfo()
+        self.equal_marker = None
+        self.output = None
+        self._flush_scanned = 0
         # When write() is called from inside a #PYTHON ... #END code block,
         # its argument may contain pTyX code needing parsing.
         # Write argument used to be parsed by default, but this was rarely needed
@@ -124,6 +215,10 @@ class LatexGenerator:
         self.context["write"] = self.write
         # Internal flags
         self.flags = EvalFlags(eval_as_float=self.context.get("ALL_FLOATS", False))
+        # The keys of the random streams in use, and the number of streams already used
+        # for each node (see `_node_random_stream()`).
+        self._random_stream_keys: list[tuple[int, ...]] = []
+        self._random_stream_counts: dict[tuple[int, ...], int] = {}
 
     def reset(self):
         """To overwrite."""
@@ -133,19 +228,20 @@ class LatexGenerator:
         """Set a new context of evaluation for code, except for PTYX_* variables."""
         old_context = self.context
         if base_context is None:
-            base_context = GLOBAL_CONTEXT
-        # Use deepcopy instead ?
-        new_context = base_context.copy()
+            context = new_context()
+        else:
+            # Use deepcopy instead ?
+            context = base_context.copy()
         # Copy internal parameters to new context.
         for key in old_context:
             if key.startswith("PTYX_"):
-                new_context[key] = old_context[key]
-        self.context = new_context
+                context[key] = old_context[key]
+        self.context = context
         return old_context
 
     @property
     def NUM(self):
-        return self.context["PTYX_NUM"]
+        return lookup(self.context, "PTYX_NUM")
 
     @property
     def WITH_ANSWERS(self):
@@ -217,15 +313,23 @@ class LatexGenerator:
         Note that `function` can also be a list of functions.
         In that case, the first function of the list is also the first
         to be applied.
-        """
 
+        The content of nested built-in tags (like #IF or #ITEM, see `_expand_node()`)
+        is walked using an explicit stack instead of recursive calls, so that deeply
+        nested syntax trees don't reach python recursion limit.
+        Any other node is parsed using `parse_node()`.
+        """
         if function is not None:
             self._open_temp_context()
-
-        for child in children:
-            if isinstance(child, str):
-                self.write(child)
-            else:
+        expand = self._expand_node if self._node_expanders() else None
+        # For each level of nesting: the remaining children, and the function to apply to the generated code.
+        stack: list[tuple[Iterator[str | Node], Any, dict[str, Any]]] = [(iter(children), function, options)]
+        while stack:
+            remaining, function_, options_ = stack[-1]
+            for child in remaining:
+                if isinstance(child, str):
+                    self.write(child)
+                    continue
                 # All remaining children should be nodes now.
                 assert isinstance(child, Node)
                 # Nodes are either numbered, or have a name.
@@ -235,11 +339,49 @@ class LatexGenerator:
                     f"Argument {child.name!r} should have been processed "
                     "and removed before calling _parse_children() !"
                 )
+                expanded = None if expand is None else expand(child)
+                if expanded is None:
+                    self.parse_node(child)
+                    continue
+                content, content_function = expanded
+                if content_function is not None:
+                    self._open_temp_context()
+                stack.append((iter(content), content_function, {}))
+                break
+            else:
+                stack.pop()
+                if function_ is not None:
+                    self._apply_func_and_close_temp_context(function_, **options_)
 
-                self.parse_node(child)
+    @classmethod
+    @functools.cache
+    def _node_expanders(cls) -> dict[str, Callable[["LatexGenerator", Node], Any]]:
+        """Return the tags which may be expanded by `_expand_node()`, and the corresponding expanders.
 
-        if function is not None:
-            self._apply_func_and_close_temp_context(function, **options)
+        Tags whose method was overridden (by an extension for example) are not expanded, but parsed
+        using their method, and nothing is expanded if the generic parsing methods were overridden.
+        """
+        if cls.parse_node is not LatexGenerator.parse_node:
+            return {}
+        expanders = {
+            tag: expander
+            for tag, expander in _NODE_EXPANDERS.items()
+            if getattr(cls, f"_parse_{tag}_tag") is getattr(LatexGenerator, f"_parse_{tag}_tag")
+        }
+        if not all(tag in expanders for tag in ("IF", "ELIF", "CASE", "ELSE")):
+            expanders.pop("CONDITIONAL_BLOCK", None)
+        return expanders
+
+    def _expand_node(self, node: Node) -> tuple[Sequence[str | Node], Any] | None:
+        """Return the content to parse in place of the node, and the function to apply to the generated code.
+
+        This is equivalent to calling the node method (i.e. `_parse_TAG_tag()`),
+        but without parsing the content.
+
+        Return None if the node can't be expanded, and must be parsed using `parse_node()`.
+        """
+        expander = self._node_expanders().get(node.name) if isinstance(node.name, str) else None
+        return None if expander is None else expander(self, node)
 
     @staticmethod
     def _parse_options(node: Node):
@@ -290,15 +432,62 @@ class LatexGenerator:
         if parse and "#" in text:
             if param["debug"]:
                 print("Parsing %s..." % repr(text))
-            self.parse_node(self.parser.generate_tree(text), function=(latex_verbatim if verbatim else None))
+            self.parse_node(
+                self.parser.generate_cached_tree(text), function=(latex_verbatim if verbatim else None)
+            )
         else:
             if verbatim:
                 text = latex_verbatim(text)
-            self.context["PTYX_LATEX"].append(text)
+            latex = self.context["PTYX_LATEX"]
+            latex.append(text)
+            if self.output is not None and len(latex) >= self.flush_threshold:
+                self.flush()
 
     def read(self) -> str:
+        """Return the generated LaTeX code (except the code already flushed to the output, if any)."""
         return "".join(self.context["PTYX_LATEX"])
 
+    def flush(self, final: bool = False) -> None:
+        """Write the generated LaTeX code to the output, and remove it from `context['PTYX_LATEX']`.
+
+        Only the LaTeX code which can't be modified anymore is flushed.
+        LaTeX code may indeed be modified afterward:
+          - by the next evaluated expression, if there is a pending `#=` marker,
+          - by `#*`, which may rewrite the last evaluated expression (see `last_eval_position`),
+            as long as only blank text follows it,
+          - by any function applied to the LaTeX code generated inside a temporary context
+            (see `_open_temp_context()`), so nothing is flushed then.
+
+        So, LaTeX code accumulates in memory as long as one of these modifications is pending:
+        the memory used is only bounded outside temporary contexts (like the content of a #MACRO,
+        or of a tag whose LaTeX code is post-processed, like #VERBATIM).
+
+        If `final` is True, all the remaining LaTeX code is flushed.
+        """
+        if self.output is None or self.backups:
+            return
+        latex = self.context["PTYX_LATEX"]
+        end = len(latex)
+        last = self.last_eval_position
+        if not final:
+            if self.equal_marker is not None and self.equal_marker[0] is latex:
+                end = self.equal_marker[1]
+            if last.position is not None:
+                # Only scan the LaTeX code generated since the last flush, the previous one being blank.
+                if any(s.strip() for s in latex[max(last.position + 1, self._flush_scanned) :]):
+                    # The last evaluated expression can't be rewritten by `#*` anymore.
+                    last.position = None
+                else:
+                    end = min(end, last.position)
+        self.output.write("".join(latex[:end]))
+        # Modify the list in place, since it may be referenced by several contexts (see #APART).
+        del latex[:end]
+        self._flush_scanned = len(latex)
+        if last.position is not None:
+            last.position = last.position - end if last.position >= end else None
+        if self.equal_marker is not None and self.equal_marker[0] is latex:
+            self.equal_marker = (latex, self.equal_marker[1] - end)
+
     def _parse_APART_tag(self, node: Node):
         """Interpret a piece of code in a sandbox, eliminating side effects."""
         # Backup local variables and reset context.
@@ -407,7 +596,8 @@ class LatexGenerator:
         assert len(node.children) == 1
         python_code = node.children[0]
         assert isinstance(python_code, str), repr(python_code)
-        self._exec_python_code(python_code, self.context)
+        with self._node_random_stream(node):
+            self._exec_python_code(python_code, self.context)
 
     # Remove comments before generating tree ?
     def _parse_COMMENT_tag(self, node: Node):
@@ -422,37 +612,106 @@ class LatexGenerator:
             print("***")
             assert test
 
-    def _parse_EVAL_tag(self, node: Node):
-        if self.flags.suppress_next_eval:
-            self.flags = EvalFlags(eval_as_float=self.context.get("ALL_FLOATS", False))
+    def analyse_tree(self, tree: Node) -> None:
+        """Pre-analyse all the #EVAL nodes of the tree, and set the path of every node.
+
+        Everything not depending on the evaluation context is done once here,
+        so that rendering an #EVAL node only has to evaluate and format the result.
+        """
+        stack: list[tuple[Node, tuple[int, ...]]] = [(tree, ())]
+        while stack:
+            node, path = stack.pop()
+            node.path = path
+            if node.name == "EVAL" and node.analysis is None:
+                try:
+                    node.analysis = self._analyse_EVAL_node(node)
+                except Exception:
+                    # Errors must only be raised if the node is rendered.
+                    pass
+            children = [child for child in node.children if isinstance(child, Node)]
+            stack.extend((child, (*path, i)) for i, child in enumerate(children))
+
+    @contextmanager
+    def _node_random_stream(self, node: Node) -> Iterator[None]:
+        """Generate random values of the node content using a random stream specific to this node.
+
+        This is only done if `param["independent_random_streams"]` is set.
+
+        The stream only depends on the seed, the document number, the node path
+        and the number of times this node was already rendered in this version of the document
+        (a #SHUFFLE inside a #MACRO for example may be rendered several times),
+        so editing some part of the document won't change the random values generated
+        inside the other nodes.
+
+        Nodes generated at runtime don't have a path: their stream depends on the stream
+        of the enclosing node instead (or on their rendering order, if there is none).
+        """
+        if not param["independent_random_streams"]:
+            yield
             return
+        if node.path is not None:
+            site: tuple[int, ...] = (0, *node.path)
+        else:
+            site = (1, *(self._random_stream_keys[-1] if self._random_stream_keys else ()))
+        occurrence = self._random_stream_counts.get(site, 0)
+        self._random_stream_counts[site] = occurrence + 1
+        key = (*site, occurrence)
+        self._random_stream_keys.append(key)
+        try:
+            with randfunc.using_generator(randfunc.derive_generator((self.NUM, *key))):
+                yield
+        finally:
+            self._random_stream_keys.pop()
+
+    def _analyse_EVAL_node(self, node: Node) -> EvalTagInfo:
+        """Extract all the information about an #EVAL node which doesn't depend on the context."""
         args, kw = self._parse_options(node)
+        flags: dict[str, Any] = {}
+        error = None
         for arg in args:
             if arg.isdigit():
-                self.flags.round = int(arg)
+                flags["round"] = int(arg)
             elif arg == ".":
-                self.flags.keep_dot_as_decimal_mark = True
+                flags["keep_dot_as_decimal_mark"] = True
             elif arg == "*":
-                self.flags.is_mul_coeff = True
+                flags["is_mul_coeff"] = True
             elif arg in ("floats", "float"):
-                self.flags.eval_as_float = True
+                flags["eval_as_float"] = True
             elif arg == "str":
-                self.flags.format_as_str = True
+                flags["format_as_str"] = True
             elif arg == "select":
-                self.flags.pick_action = PickItemAction.SELECT_FROM_NUM
+                flags["pick_action"] = PickItemAction.SELECT_FROM_NUM
             elif arg == "rand":
-                self.flags.pick_action = PickItemAction.RAND_CHOICE
+                flags["pick_action"] = PickItemAction.RAND_CHOICE
             else:
-                raise PtyxRuntimeError(f"Unknown flag {arg!r} in `#[{node.options}]{node.arg(0)}`.")
+                # Error will be raised when rendering the node.
+                error = f"Unknown flag {arg!r} in `#[{node.options}]{node.arg(0)}`."
+                break
         code = node.arg(0)
         assert isinstance(code, str), type(code)
-        tag, code = self._get_python_code_tag(code)
+        label, code = self._get_python_code_tag(code)
+        display, statements = self._analyse_python_code(code)
+        return EvalTagInfo(
+            flags=flags, error=error, label=label, code=code, display=display, statements=statements
+        )
+
+    def _parse_EVAL_tag(self, node: Node):
+        if self.flags.suppress_next_eval:
+            self.flags = EvalFlags(eval_as_float=self.context.get("ALL_FLOATS", False))
+            return
+        info: EvalTagInfo | None = node.analysis
+        if info is None:
+            info = node.analysis = self._analyse_EVAL_node(node)
+        if info.error is not None:
+            raise PtyxRuntimeError(info.error)
+        for name, value in info.flags.items():
+            setattr(self.flags, name, value)
         try:
-            txt = self._eval_and_format_python_expr(code)
+            txt = self._eval_and_format_statements(info.statements, info.display)
         except Exception as e:
             # print("ERROR: Can't evaluate this: " + repr(code))
             raise PythonExpressionError(
-                python_code=code, flags=node.options, label=tag, context=self.context
+                python_code=info.code, flags=node.options, label=info.label, context=self.context
             ) from e
         # Tags must be cleared *before* calling .write(txt), since .write(txt)
         # add '+', '-' and '\times ' before txt if corresponding flags are set,
@@ -550,7 +809,8 @@ class LatexGenerator:
         # print('------------\n')
 
     def _parse_SHUFFLE_tag(self, node: Node) -> None:
-        self._shuffle_and_parse_children(node)
+        with self._node_random_stream(node):
+            self._shuffle_and_parse_children(node)
 
     def _parse_ITEM_tag(self, node: Node) -> None:
         self._parse_children(node.children)
@@ -588,7 +848,8 @@ class LatexGenerator:
         # print('------------\n')
 
     def _parse_PICK_tag(self, node: Node) -> None:
-        self._pick_and_parse_children(node)
+        with self._node_random_stream(node):
+            self._pick_and_parse_children(node)
 
     # TODO: Refactor _parse_PICK_tag/_parse_SHUFFLE_tag
 
@@ -602,7 +863,7 @@ class LatexGenerator:
 
     def _parse_TEST_tag(self, node: Node) -> None:
         try:
-            if eval(node.arg(0), self.context):
+            if eval(self._compile(node.arg(0)), self.context):
                 assert isinstance(node.children[1], Node), repr(node)
                 self._parse_children(node.children[1].children)
             else:
@@ -640,6 +901,9 @@ class LatexGenerator:
         # All other operations (#+, #-, #*) occur just before number, but between `=` and
         # the result, some formatting instructions may occur (like '\fbox{' for example).
         # So, `#=` is used as a temporary marker, and will be replaced by '=' or '\approx' later.
+        # Its position is kept, to replace it directly (see `_eval_and_format_statements()`).
+        latex = self.context["PTYX_LATEX"]
+        self.equal_marker = (latex, len(latex))
         self.write("#=")
 
     def _parse_SIGN_tag(self, node: Node) -> None:
@@ -673,14 +937,12 @@ class LatexGenerator:
         # print(node.arg(0))
         assert isinstance(node.children[0], Node), repr(node)
         # Backup PTYX_LATEX (i.e. already generated LaTeX code) and reset context.
-        assert isinstance(self.context["PTYX_LATEX"], list)
-        ptyx_latex_content = self.context["PTYX_LATEX"]
-        self.context["PTYX_LATEX"] = []  # Do not use list.clear(), make a new list instead!
+        self._open_temp_context()
         # Interpret code
         self._parse_children(node.children[0].children)
         print("".join(self.context["PTYX_LATEX"]))
         # Restore PTYX_LATEX.
-        self.context["PTYX_LATEX"] = ptyx_latex_content
+        self.context["PTYX_LATEX"] = self.backups.pop()
 
     def _parse_PRINT_tag(self, node: Node) -> None:
         print(node.arg(0))
@@ -703,8 +965,78 @@ class LatexGenerator:
                 code = code[i + 1 :]
         return tag, code
 
-    def _exec_python_code(self, code: str, context: dict):
-        code = code.replace("\r", "")
+    def _compile(self, code: str, mode: str = "eval") -> CodeType:
+        """Compile python code, reusing the code object if this code was already compiled.
+
+        The same python code is executed for every version of the document, so it is compiled once.
+        Code is compiled using "<string>" as filename, like `exec()` or `eval()` do,
+        so that errors report the same information.
+        """
+        key = (code, mode)
+        compiled = self._compiled_code.get(key)
+        if compiled is None:
+            compiled = self._compiled_code[key] = compile(code, "<string>", mode)
+        return compiled
+
+    def _expression_names(self, code: str) -> tuple[str, ...]:
+        """Return the names used by python expression `code` (keywords and attributes names included).
+
+        Raise `tokenize.TokenError` or `SyntaxError` if the code can't be tokenized.
+        """
+        names = self._expression_names_cache.get(code)
+        if names is None:
+            tokens = tokenize.generate_tokens(io.StringIO(code.strip()).readline)
+            names = tuple({token.string: None for token in tokens if token.type == tokenize.NAME})
+            self._expression_names_cache[code] = names
+        return names
+
+    def _compile_sympy_expr(self, code: str) -> tuple[CodeType, dict[str, Any]]:
+        """Compile python expression like `sympy.sympify(code, locals=self.context)` would do.
+
+        Sympy parser converts the expression into python code (numbers become sympy Integers,
+        `^` becomes `**`, undefined names become Symbols...), which is then evaluated.
+        This is slow, so the generated code is compiled and cached.
+
+        The generated code only depends on which of the names used in the expression
+        are defined in the context, so this is used as cache key too.
+        Note that sympy handles names whose value is an empty string as undefined names.
+
+        Return the code object, and the symbols replacing those names during evaluation.
+        The code object must be evaluated using `_sympy_global_dict()` as globals,
+        and the context (updated with the symbols) as locals.
+
+        Raise `sympy.SympifyError` if sympy can't parse the expression.
+        """
+        import sympy
+        from sympy.parsing.sympy_parser import stringify_expr, standard_transformations, convert_xor, null
+
+        code = code.replace("\n", "")
+        try:
+            names = self._expression_names(code)
+        except (tokenize.TokenError, SyntaxError) as e:
+            raise sympy.SympifyError(f"could not parse {code!r}", e)
+        values = [lookup(self.context, name, _MISSING) for name in names]
+        # For each name: 0 if undefined, 1 if defined, 2 if its value is sympy `null` (i.e. '').
+        state = tuple((value is not _MISSING) + (value is null) for value in values)
+        key = (code, state)
+        compiled = self._sympy_compiled_code.get(key)
+        if compiled is None:
+            # Sympy transformations modify the dict of local variables, so give them a copy.
+            local_dict = {name: value for name, value in zip(names, values) if value is not _MISSING}
+            try:
+                python_code = stringify_expr(
+                    code, local_dict, _sympy_global_dict(), standard_transformations + (convert_xor,)
+                )
+                codeobj = compile(python_code, "<string>", "eval")
+            except (tokenize.TokenError, SyntaxError) as e:
+                raise sympy.SympifyError(f"could not parse {code!r}", e)
+            symbols = {name: local_dict[name] for name, value in zip(names, state) if value == 2}
+            compiled = self._sympy_compiled_code[key] = (codeobj, symbols)
+        return compiled
+
+    def _prepare_python_code(self, raw_code: str) -> tuple[str, str]:
+        """Return the label of the python code block, and the code ready to be executed."""
+        code = raw_code.replace("\r", "")
         code = code.rstrip().lstrip("\n")
         # Python code snippets can be tagged by using a prefix of the form `:label:`.
         # If an error is raised, the label will be added to the CompilationError instance.
@@ -719,17 +1051,29 @@ class LatexGenerator:
         if initial_indent:
             # remove initial indentation
             code = "\n".join(line[initial_indent:] for line in code.split("\n"))
+        return tag, code
+
+    def _exec_python_code(self, code: str, context: dict):
+        raw_code = code
+        block = self._python_blocks.get(raw_code)
+        if block is None:
+            tag, code = self._prepare_python_code(raw_code)
+            try:
+                compiled = compile(code, "<string>", "exec")
+            except Exception as e:  # noqa
+                raise PythonBlockError(python_code=code, label=tag, context=self.context) from e
+            block = self._python_blocks[raw_code] = (tag, code, compiled)
+        tag, code, compiled = block
         try:
-            self._exec(code, context)
+            self._exec(compiled, context)
         except Exception as e:  # noqa
             raise PythonBlockError(python_code=code, label=tag, context=self.context) from e
         return code
 
-    def _eval_python_expr(self, code: str) -> object:
-        context = self.context
+    def _analyse_python_expr(self, code: str) -> EvalStatement:
+        """Find the variable where the result of the python expression must be stored, if any."""
         if not code:
-            return ""
-
+            return EvalStatement(code)
         varname = ""
         i = code.find("=")
         if 0 < i < len(code) - 1 and code[i + 1] != "=":
@@ -745,50 +1089,137 @@ class LatexGenerator:
             varname = "_"
         if " if " in code and " else " not in code:
             code += " else ''"
-        if param["sympy_is_default"]:
-            import sympy
+        key = None
+        i = varname.find("[")
+        # for example, varname == 'mylist[i]' or 'mylist[2]'
+        if i != -1:
+            key = varname[i + 1 : -1]
+            varname = varname[:i].strip()
+        return EvalStatement(code, varname, key)
 
-            try:
-                result = sympy.sympify(code, locals=context)
-                if isinstance(result, str):
-                    result = result.replace("**", "^")
-            except (sympy.SympifyError, AttributeError):
-                # sympy.sympify() can't parse attributes and methods inside
-                # code for now (AttributeError is raised then).
-                result = eval(code, context)
-                print("Warning: sympy can't parse %s. Switching to standard evaluation mode." % repr(code))
-            except Exception:
-                # print sorted(context.keys())
-                print("Uncatched error when evaluating %s" % repr(code))
-                raise
+    def _eval_python_expr(self, code: str) -> object:
+        return self._eval_statement(self._analyse_python_expr(code))
+
+    def _eval_statement(self, statement: EvalStatement) -> object:
+        context = self.context
+        code = statement.code
+        if not code:
+            return ""
+        if param["numeric_mode"]:
+            result = self._memoized_eval(code, "numeric", self._eval_numeric_expr)
+        elif param["sympy_is_default"]:
+            result = self._memoized_eval(code, "sympy", self._eval_sympy_expr)
         else:
-            result = eval(code, context)
+            result = self._memoized_eval(code, "python", lambda code_: eval(self._compile(code_), context))
         result = context["_"] = self._apply_flag(result)
-        i = varname.find("[")
-        # for example, varname == 'mylist[i]' or 'mylist[2]'
         context["LAST"] = result
-        if i == -1:
-            context[varname] = result
+        if statement.key is None:
+            context[statement.varname] = result
         else:
-            key = eval(varname[i + 1 : -1], context)
-            varname = varname[:i].strip()
-            context[varname][key] = result
+            key = eval(self._compile(statement.key), context)
+            context[statement.varname][key] = result
         return result
 
-    def _eval_and_format_python_expr(self, code: str) -> str:
-        flags = self.flags
+    def _memoized_eval(self, code: str, mode: str, evaluate: Callable[[str], object]) -> object:
+        """Evaluate python expression `code` using `evaluate(code)`, reusing a previous result if possible.
+
+        The result of an expression only depends on the values of the names it uses,
+        so it is cached, using those values as key, when they are all immutable values
+        or pure functions (see `is_memoizable()`).
+        Hit rate statistics are available through `self.expression_cache`.
+        """
+        if ":=" in code:
+            # Assignment expression: evaluating it modifies the context.
+            return evaluate(code)
+        try:
+            names = self._expression_names(code)
+        except (tokenize.TokenError, SyntaxError):
+            return evaluate(code)
         context = self.context
-        if not code:
-            return ""
+        values = []
+        for name in names:
+            value = lookup(context, name, _MISSING)
+            if value is _MISSING:
+                value = getattr(builtins, name, _MISSING)
+                if value is _MISSING and mode == "sympy":
+                    value = _sympy_global_dict().get(name, _MISSING)
+            values.append(value)
+        if not all(value is _MISSING or is_memoizable(value) for value in values):
+            return evaluate(code)
+        key = (code, mode, tuple(memoization_key(value) for value in values))
+        result = self.expression_cache.get(key, _MISSING)
+        if result is _MISSING:
+            result = evaluate(code)
+            if is_memoizable(result, functions=False):
+                self.expression_cache[key] = result
+        return result
 
+    def _eval_sympy_expr(self, code: str) -> object:
+        import sympy
+
+        context = self.context
+        try:
+            # Same as `sympy.sympify(code, locals=context)`, but much faster.
+            codeobj, symbols = self._compile_sympy_expr(code)
+            # Values of GLOBAL_CONTEXT take precedence over sympy ones (like `max` and `Max`).
+            result = eval(codeobj, _sympy_global_dict(), ChainMap(symbols, context, GLOBAL_CONTEXT))
+            if isinstance(result, str):
+                result = result.replace("**", "^")
+        except (sympy.SympifyError, AttributeError):
+            # sympy.sympify() can't parse attributes and methods inside
+            # code for now (AttributeError is raised then).
+            result = eval(self._compile(code), context)
+            print("Warning: sympy can't parse %s. Switching to standard evaluation mode." % repr(code))
+        except Exception:
+            # print sorted(context.keys())
+            print("Uncatched error when evaluating %s" % repr(code))
+            raise
+        return result
+
+    def _eval_numeric_expr(self, code: str) -> object:
+        """Evaluate python expression using python numbers instead of sympy ones (see `ptyx.numeric`).
+
+        If some name is undefined, it is probably a symbol, so sympy evaluation is used instead.
+        Sympy is also used for expressions which are not valid python code, like `5!`.
+        """
+        key = (code, "numeric")
+        try:
+            compiled = self._compiled_code.get(key)
+            if compiled is None:
+                compiled = self._compiled_code[key] = compile_numeric_expr(code)
+            return eval(compiled, self.context)
+        except (NameError, SyntaxError):
+            if not param["sympy_is_default"]:
+                raise
+            return self._eval_sympy_expr(code)
+
+    def _analyse_python_code(self, code: str) -> tuple[bool, tuple[EvalStatement, ...]]:
+        """Split python code into statements.
+
+        Return also a boolean, indicating if the result of the last statement must be displayed.
+        """
+        if not code:
+            return False, ()
         display_result = True
         if code.endswith(";"):
             code = code.rstrip(";")
             display_result = False
+        statements = tuple(
+            self._analyse_python_expr(subcode) for subcode in advanced_split(code, ";", brackets=())
+        )
+        return display_result, statements
+
+    def _eval_and_format_python_expr(self, code: str) -> str:
+        display_result, statements = self._analyse_python_code(code)
+        return self._eval_and_format_statements(statements, display_result)
 
+    def _eval_and_format_statements(
+        self, statements: Sequence[EvalStatement], display_result: bool = True
+    ) -> str:
+        flags = self.flags
         result: object = ""
-        for subcode in advanced_split(code, ";", brackets=()):
-            result = self._eval_python_expr(subcode)
+        for statement in statements:
+            result = self._eval_statement(statement)
         # Note that only last result will be displayed.
         # In particular, if code ends with ';', last result will be ''.
         # So, '#{a=5}' and '#{a=5;}' will both affect 5 to `a`,
@@ -808,7 +1239,9 @@ class LatexGenerator:
                 flags.suppress_next_eval = True
                 return ""
 
-        if param["sympy_is_default"] and not flags.format_as_str:
+        if param["numeric_mode"] and not flags.format_as_str:
+            latex = numeric2latex(result, flags)
+        elif param["sympy_is_default"] and not flags.format_as_str:
             from ptyx.printers import sympy2latex
 
             latex = sympy2latex(result, flags)
@@ -852,16 +1285,15 @@ class LatexGenerator:
                 symb = " = "
             else:
                 symb = r" \approx "
-            # Search backward for temporary `#=` marker in list, and replace
-            # by appropriate symbol.
-            for textlist in self.backups + [context["PTYX_LATEX"]]:
-                for i, elt in enumerate(reversed(textlist)):
-                    if elt == "#=":
-                        textlist[len(textlist) - i - 1] = symb
-                        return latex
-            print("Debug warning: `#=` couldn't be found when scanning context !")
-            print("There is most probably a bug in pTyX, entering debugging...")
-            self._parse_DEBUG_tag(None)
+            # Replace temporary `#=` marker by appropriate symbol.
+            marker = self.equal_marker
+            self.equal_marker = None
+            if marker is None or marker[1] >= len(marker[0]) or marker[0][marker[1]] != "#=":
+                raise PtyxRuntimeError(
+                    "`#=` marker not found: it may have been modified by some formatting function."
+                )
+            textlist, position = marker
+            textlist[position] = symb
         return latex
 
     def _apply_flag(self, result):
@@ -888,9 +1320,11 @@ class LatexGenerator:
         if flags.round is not None:
             try:
                 if SYMPY_AVAILABLE:
-                    round_result = numbers_to_floats(result, ndigits=flags.round)
+                    # Rounding tells if the result is exact too.
+                    round_result, flags.result_is_exact = _numbers_to_floats(result, ndigits=flags.round)
                 else:
                     round_result = round(result, flags.round)
+                    flags.result_is_exact = result == round_result
             except ValueError:
                 print("** ERROR while rounding value: **")
                 print(result)
@@ -898,21 +1332,104 @@ class LatexGenerator:
                 print("".join(self.context["PTYX_LATEX"])[-100:])
                 print("-----")
                 raise
-            if SYMPY_AVAILABLE:
-                import sympy
-            # noinspection PyUnboundLocalVariable
-            if SYMPY_AVAILABLE and isinstance(result, sympy.Basic):
-                flags.result_is_exact = {_float_me_if_you_can(elt) for elt in result.atoms()} == {
-                    _float_me_if_you_can(elt) for elt in round_result.atoms()
-                }
-            else:
-                flags.result_is_exact = result == round_result
             result = round_result
         elif self.flags.eval_as_float:
             result = numbers_to_floats(result)
         return result
 
 
+def _expand_content(gen: LatexGenerator, node: Node) -> tuple[Sequence[str | Node], Any]:
+    return node.children, None
+
+
+def _expand_ASK(gen: LatexGenerator, node: Node) -> tuple[Sequence[str | Node], Any]:
+    return node.children, gen.context.get("format_ask")
+
+
+def _expand_ASK_ONLY(gen: LatexGenerator, node: Node) -> tuple[Sequence[str | Node], Any]:
+    if not gen.WITH_ANSWERS:
+        return node.children, gen.context.get("format_ask_only")
+    print("Skipping ASK_ONLY section...")
+    return (), None
+
+
+def _expand_ANS(gen: LatexGenerator, node: Node) -> tuple[Sequence[str | Node], Any]:
+    return (node.children, gen.context.get("format_ans")) if gen.WITH_ANSWERS else ((), None)
+
+
+def _expand_ANSWER(gen: LatexGenerator, node: Node) -> tuple[Sequence[str | Node], Any]:
+    if gen.WITH_ANSWERS:
+        assert isinstance(node.children[0], Node), repr(node)
+        return node.children[0].children, gen.context.get("format_answer")
+    return (), None
+
+
+def _expand_QUESTION(gen: LatexGenerator, node: Node) -> tuple[Sequence[str | Node], Any]:
+    if not gen.WITH_ANSWERS:
+        assert isinstance(node.children[0], Node), repr(node)
+        return node.children[0].children, None
+    return (), None
+
+
+def _expand_IF(gen: LatexGenerator, node: Node) -> tuple[Sequence[str | Node], Any]:
+    return (node.children[1:], None) if node.eval_arg(0, gen.context) else ((), None)
+
+
+def _expand_CASE(gen: LatexGenerator, node: Node) -> tuple[Sequence[str | Node], Any]:
+    return (node.children[1:], None) if node.eval_arg(0, gen.context) == gen.NUM else ((), None)
+
+
+def _expand_IFNUM(gen: LatexGenerator, node: Node) -> tuple[Sequence[str | Node], Any]:
+    if node.eval_arg(0, gen.context) == gen.NUM:
+        assert isinstance(node.children[1], Node), repr(node)
+        return node.children[1].children, None
+    return (), None
+
+
+def _expand_VERBATIM(gen: LatexGenerator, node: Node) -> tuple[Sequence[str | Node], Any]:
+    return node.children, latex_verbatim
+
+
+def _expand_CONDITIONAL_BLOCK(gen: LatexGenerator, node: Node) -> tuple[Sequence[str | Node], Any] | None:
+    branches = node.children
+    for i, branch in enumerate(branches):
+        assert isinstance(branch, Node)
+        if branch.name == "ELSE":
+            # Following branches would be parsed too, so let `_parse_CONDITIONAL_BLOCK_tag()` handle this.
+            return (branch.children, None) if i == len(branches) - 1 else None
+        if branch.name == "CASE":
+            if branch.eval_arg(0, gen.context) == gen.NUM:
+                return branch.children[1:], None
+        elif branch.name in ("IF", "ELIF"):
+            if branch.eval_arg(0, gen.context):
+                return branch.children[1:], None
+        else:
+            return None
+    return (), None
+
+
+# The functions expanding built-in tags, see `LatexGenerator._expand_node()`.
+# Each one returns the same content and function as the corresponding `LatexGenerator._parse_TAG_tag()` method
+# would pass to `LatexGenerator._parse_children()`.
+_NODE_EXPANDERS: dict[str, Callable[[LatexGenerator, Node], Any]] = {
+    "ROOT": _expand_content,
+    "ITEM": _expand_content,
+    "ENUM": _expand_content,
+    "ELSE": _expand_content,
+    "ASK": _expand_ASK,
+    "ASK_ONLY": _expand_ASK_ONLY,
+    "ANS": _expand_ANS,
+    "ANSWER": _expand_ANSWER,
+    "QUESTION": _expand_QUESTION,
+    "IF": _expand_IF,
+    "ELIF": _expand_IF,
+    "CASE": _expand_CASE,
+    "IFNUM": _expand_IFNUM,
+    "VERBATIM": _expand_VERBATIM,
+    "CONDITIONAL_BLOCK": _expand_CONDITIONAL_BLOCK,
+}
+
+
 class Compiler:
     """Compiler is the main object of pTyX.
 
@@ -926,12 +1443,11 @@ class Compiler:
     The following methods are called successively to generate LaTeX code from
     a pTyX file:
         * .read_file(path) will read the content of the file.
-        * ._include_subfiles() will parse #INCLUDE{filename} tags and
-          include coresponding files content.
-        * ._call_extensions() will search for extensions in this content,
-          then call the extensions to convert content into plain pTyX code.
-        * ._read_seed() will search for a #SEED tag, or give a default seed
-          value, used to generate all pseudo-random content later.
+        * .preparse() will remove comments, include files content (#INCLUDE{filename}),
+          and search for extensions (#LOAD{name}) and seed (#SEED{num}) in a single pass
+          (see `ptyx.preprocessor`).
+          Then, it will call the extensions to convert content into plain pTyX code,
+          and set the seed used to generate all pseudo-random content later.
         * .generate_syntax_tree() will convert this code into a syntax tree.
           This should be done only once ofr each document, even if multiple
           versions of this document are needed.
@@ -976,8 +1492,8 @@ class Compiler:
         #      all the files are generated as a side effect.
         path = Path(os.path.abspath(os.path.expanduser(path)))
         self._state["path"] = path
-        with open(path, "r") as input_file:
-            self._state["input"] = input_file.read()
+        # The file will be memory-mapped when preparsing it.
+        self._state["input"] = SourceBuffer(path)
 
     @property
     def dir_path(self) -> Path:
@@ -994,27 +1510,60 @@ class Compiler:
             path = self.dir_path / path
         return path
 
-    def _include_subfiles(self, code: str) -> str:
-        """Parse all #INCLUDE tags, then include corresponding files content."""
+    def _parse_included_files(self, preprocessed: PreprocessedCode) -> list[tuple[Node, list[int]]]:
+        """Preprocess the collected included files and generate their syntax trees, using a pool of processes.
 
-        def include(match: re.Match) -> str:
-            path = self._resolve_input_file_path(match.group(1))
-            with open(path) as file:
-                return f"\n#APART#INCLUDE_START{{{path}}}{{{match.start()}}}\n{file.read()}#END_APART#INCLUDE_END\n"
+        The seeds and the extensions found in the included files are added to `preprocessed`
+        (see `PreprocessedCode.insert_included()`).
 
-        # noinspection RegExpRedundantEscape
-        return re.sub(r"#INCLUDE\{([^}]+)\}", include, code)
+        Return the syntax tree of each included file, and the values of the #SEED tags
+        generated by the extensions.
+        """
+        paths = [included_file.path for included_file in preprocessed.included]
+        main_path = self._state.get("path")
+        executor = (
+            concurrent.futures.ProcessPoolExecutor(max_workers=min(CPU_PHYSICAL_CORES, len(paths)))
+            if len(paths) > 1
+            else None
+        )
+        with executor or nullcontext():
+            map_ = map if executor is None else executor.map
+            included = list(map_(_preprocess_included_file, paths, repeat(main_path)))
+            # Extensions found in included files must be known before applying extensions.
+            preprocessed.insert_included(included)
+            codes = [included_code.code for included_code in included]
+            return list(map_(_generate_included_tree, paths, codes, repeat(preprocessed.extensions)))
 
-    def _call_extensions(self, code: str) -> tuple[str, dict[str, ModuleType]]:
-        """Search for extensions (#LOAD{name} tags), then call them."""
-        # First, we search if some extensions must be load.
+    @staticmethod
+    def _graft_included_trees(tree: Node, included_trees: Sequence[Node]) -> None:
+        """Replace every #INCLUDE_TREE{num} node with the content of the corresponding syntax tree."""
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            children: list[str | Node] = []
+            for child in node.children:
+                if isinstance(child, Node) and child.name == "INCLUDE_TREE":
+                    subtree = included_trees[int(child.arg(0))]
+                    for grafted in subtree.children:
+                        if isinstance(grafted, Node):
+                            grafted.parent = node
+                        children.append(grafted)
+                    tree.tags |= subtree.tags  # type: ignore
+                else:
+                    if isinstance(child, Node):
+                        stack.append(child)
+                    children.append(child)
+            node.children = children
+        tree.tags.discard("INCLUDE_TREE")  # type: ignore
+
+    def _call_extensions(
+        self, code: str, extensions_list: Iterable[str]
+    ) -> tuple[str, dict[str, ModuleType]]:
+        """Load extensions listed in `extensions_list` (see #LOAD{name} tags), then call them."""
         # This must be done at the very beginning, since extensions may
         # define their own specialized language, to be converted to
         # valid pTyX code (and then to LaTeX).
-
-        # Search for #LOAD{} tags and list corresponding extensions.
-        # noinspection RegExpRedundantEscape
-        extensions_list = re.findall(r"#LOAD\{\s*(\w+)\s*\}", code)
+        extensions_list = list(extensions_list)
 
         extensions: Dict[Tag, ModuleType] = {}
         tags_syntax: Dict[Tag, TagSyntax] = {}
@@ -1069,29 +1618,19 @@ class Compiler:
                 code = extensions[name].main(code, self)
         return code, extensions
 
-    def _read_seed(self, code: str) -> Tuple[str, Optional[int]]:
-        """Extract seed value from code, searching for #SEED{num} tag.
+    def _select_seed(self, seeds: Sequence[int]) -> int:
+        """Return the seed value to use, given the values of all the #SEED{num} tags found.
 
-        Return the code without the #SEED{...} tag, and the seed value (if any, `None` else).
+        If no #SEED{num} tag was found, the seed is generated from the pTyX file path.
         """
-        counter = 0
-        value = None
-
-        def seed(match):
-            nonlocal counter, value
-            value = int(match.group(1))
-            counter += 1
-            return ""
-
-        # noinspection RegExpRedundantEscape
-        code = re.sub(r"#SEED\{\s*(\d+)\s*\}", seed, code)
-        if counter == 0:
+        if not seeds:
             path = self._state.get("path")
             value = zlib.adler32(str(path).encode("utf8"))
             print(f"Warning: #SEED not found, using ptyx file path '{path}' to generate seed: {value}.")
-        elif counter > 1:
-            print(f"Warning: multiple #SEED found, only last one will be used: {value}.")
-        return code, value
+            return value
+        if len(seeds) > 1:
+            print(f"Warning: multiple #SEED found, only last one will be used: {seeds[-1]}.")
+        return seeds[-1]
 
     @staticmethod
     def _assert_no_comment(code: str) -> None:
@@ -1102,34 +1641,35 @@ class Compiler:
         assert not comments, "There should be no remaining comment. Maybe a problem with an extension ?"
 
     def preparse(self) -> None:
-        code = self._state.get("input")
-        if code is None:
+        source = self._state.get("input")
+        if source is None:
             raise RuntimeError("Compiler.read_code() or Compiler.read_file() must be run first.")
-        remove_comments = self.syntax_tree_generator.remove_comments
-        # TODO: do not remove comments before resolving imports, since this prevent tracebacks from providing
-        #  accurate positions.
-        #  Instead, self._include_subfiles() should be improved to ignore imports in lines starting with a #.
-        # Remove comments first, so one can comment a file inclusion for example.
-        code = remove_comments(code)
-        assert isinstance(code, str)
-        self._assert_no_comment(code)
-        code = remove_comments(self._include_subfiles(code))
+        # Remove comments, insert included files, list extensions and extract seeds,
+        # all in a single pass. Comments are removed before resolving inclusions,
+        # so one can comment a file inclusion for example.
+        # If included files are parsed in parallel, they will be preprocessed and tokenized separately,
+        # then their syntax trees will be grafted into the main one.
+        preprocessor = Preprocessor(self._resolve_input_file_path, param["parallel_includes"])
+        preprocessed = preprocessor.preprocess(source, self._state.get("path"))
+        included_results = self._parse_included_files(preprocessed) if preprocessed.included else []
+        code = preprocessed.code
         self._state["after_include"] = code
-        assert isinstance(code, str)
-        code, extensions = self._call_extensions(code)
-        code, seed = self._read_seed(code)
-        # Remove any comment that may have been generated by an extension.
-        code = remove_comments(code)
-        assert isinstance(code, str)
+        seeds = preprocessed.seeds
+        code, extensions = self._call_extensions(code, preprocessed.extensions)
+        if extensions:
+            # Remove any comment or #SEED tag that may have been generated by an extension.
+            code, generated_seeds = clean_generated_code(code)
+            seeds.extend(generated_seeds)
+        self._assert_no_comment(code)
+        if included_results:
+            self._state["included_trees"] = [tree for tree, _ in included_results]
+            for _, generated_seeds in included_results:
+                seeds.extend(generated_seeds)
         self._state["plain_ptyx_code"] = code
         self._state["loaded_extensions"] = extensions
         # Set the seed used for pseudo-random numbers generation.
         # (The seed value is set in the ptyx file using special tag #SEED{}).
-        self._state["seed"] = seed
-        self._assert_no_comment(code)
-        assert "#INCLUDE{" not in code
-        # assert "#LOAD{" not in code
-        assert "#SEED{" not in code
+        self._state["seed"] = self._select_seed(seeds)
         # Save pTyX code generated by extensions (this is used for debugging,
         # but if needed extensions can also save some data this way using #COMMENT tag).
         # If input file was /path/to/file/myfile.ptyx,
@@ -1147,23 +1687,77 @@ class Compiler:
         code = self._state.get("plain_ptyx_code")
         if code is None:
             raise RuntimeError("Compiler.preparse() must be run first.")
-        self._state["syntax_tree"] = self.syntax_tree_generator.generate_tree(code)
+        # Comments were already removed by the preprocessor.
+        tree = self.syntax_tree_generator.generate_tree(code, strip_comments=False)
+        if self._state.get("included_trees"):
+            self._graft_included_trees(tree, self._state["included_trees"])
+        self.latex_generator.analyse_tree(tree)
+        self._state["syntax_tree"] = tree
+        self._state.pop("render", None)
+        self._state.pop("specialized_renders", None)
+        self._state.pop("specializable_names", None)
+
+    def _get_render_function(self, context: Mapping[str, Any] | None = None) -> RenderFunction:
+        """Return the function rendering the syntax tree, compiling it if needed.
+
+        If `context` is given, the syntax tree is specialized for the context values
+        known before rendering, when possible (see `ptyx.specialize`).
+        """
+        gen = self.latex_generator
+        tree = self._state["syntax_tree"]
+        if context:
+            names = self._state.get("specializable_names")
+            if names is None:
+                names = self._state["specializable_names"] = specializable_names(tree)
+            known = {name: context[name] for name in names if name in context}
+            if "PTYX_WITH_ANSWERS" in known:
+                known["PTYX_WITH_ANSWERS"] = bool(known["PTYX_WITH_ANSWERS"])
+            if known:
+                renders = self._state.get("specialized_renders")
+                if renders is None or renders[0] is not gen:
+                    renders = self._state["specialized_renders"] = (gen, LRUCache(64))
+                key = tuple(sorted(known.items()))
+                render = renders[1].get(key)
+                if render is None:
+                    render = renders[1][key] = compile_tree(specialize_tree(tree, gen, known), gen)
+                return render
+        cached = self._state.get("render")
+        if cached is None or cached[0] is not gen:
+            # The tree is compiled only once, and the same function is then used for every version.
+            cached = self._state["render"] = (gen, compile_tree(tree, gen))
+        return cached[1]
 
     def get_latex(self, **context) -> str:
         """Compile pTyX code and return LaTeX code.
 
         `Compiler.generate_syntax_tree()` must be run first.
         """
+        return self._render(None, context)
+
+    def write_latex(self, output: TextIO, **context) -> None:
+        """Compile pTyX code and write LaTeX code to `output` (a file or any file-like object).
+
+        LaTeX code is written progressively, so that the whole document
+        is never kept in memory (except for the parts generated inside temporary
+        contexts, see `LatexGenerator.flush()`).
+
+        `Compiler.generate_syntax_tree()` must be run first.
+        """
+        self._render(output, context)
+
+    def _render(self, output: TextIO | None, context: dict[str, Any]) -> str:
         tree = self._state.get("syntax_tree")
         if tree is None:
             raise RuntimeError("`Compiler.generate_syntax_tree()` must be run first.")
         gen = self.latex_generator
         gen.clear(main_file=self._state["path"])
         gen.context.update(context)
+        gen.output = output
         seed = self._state["seed"] + gen.NUM
         randfunc.set_seed(seed)
+        randfunc.set_condition_sampling(gen.condition_sampling)
         try:
-            gen.parse_node(tree)
+            self._get_render_function({**context, "PTYX_NUM": gen.NUM})(gen)
         except Exception as e:
             print("\n*** Error occurred while generating LaTeX code. ***")
             print("This was last generated LaTeX code for debugging purpose:")
@@ -1174,6 +1768,9 @@ class Compiler:
             if hasattr(e, "pretty_report"):
                 print(e.pretty_report)
             raise
+        if output is not None:
+            gen.flush(final=True)
+            gen.output = None
         latex = gen.read()
         # if "API_VERSION" not in gen.context:
         #     print("Warning: no API version specified. This may be an old pTyX file.")
@@ -1241,3 +1838,42 @@ class Compiler:
     @property
     def loaded_extensions(self) -> List[str]:
         return list(self._state["loaded_extensions"].keys())
+
+
+def _preprocess_included_file(path: Path, main_path: Path | None) -> PreprocessedCode:
+    """Preprocess an included file, like if it was inserted in the main file located at `main_path`.
+
+    This function is executed in a separate process (see `Compiler._parse_included_files()`),
+    so it must be defined at module level.
+    """
+    compiler = Compiler()
+    # Paths of the files included by this file are relative to the main file.
+    compiler._state["path"] = main_path
+    return Preprocessor(compiler._resolve_input_file_path).preprocess(
+        SourceBuffer(path), including=(main_path,)
+    )
+
+
+def _generate_included_tree(path: Path, code: str, extensions_list: list[str]) -> tuple[Node, list[int]]:
+    """Apply extensions to the preprocessed content of an included file, then generate its syntax tree.
+
+    Return the syntax tree, and the values of the #SEED tags generated by the extensions.
+
+    This function is executed in a separate process (see `Compiler._parse_included_files()`),
+    so it must be defined at module level.
+    """
+    compiler = Compiler()
+    compiler._state["path"] = path
+    code, extensions = compiler._call_extensions(code, extensions_list)
+    seeds: list[int] = []
+    if extensions:
+        code, seeds = clean_generated_code(code)
+    # The leading new line is the one following the #INCLUDE_START{}{} tag,
+    # when the file content is directly inserted in the main file.
+    code = "\n" + code
+    # In the main file, the content is followed by an #END_APART tag,
+    # and spaces and new line before a closing tag are removed.
+    i = code.rfind("\n")
+    if code[i:].isspace():
+        code = code[:i]
+    return compiler.syntax_tree_generator.generate_tree(code, strip_comments=False), seeds
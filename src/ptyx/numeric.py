@@ -0,0 +1,124 @@
+"""
+Numeric evaluation mode.
+
+When `param["numeric_mode"]` is set, python expressions are evaluated using python
+`int`, `fractions.Fraction` and `float` instead of sympy objects, which is much faster.
+
+Python semantics are adapted to match sympy ones for numbers:
+  - dividing integers or fractions returns a fraction (`1/3` is not `0.333...`),
+  - `^` is the power operator, like `**`,
+  - a fraction whose denominator is 1 is converted to an integer.
+
+Sympy is only used when a symbolic object shows up (like `sqrt(2)` or an undefined name),
+see `LatexGenerator._eval_numeric_expr()`.
+"""
+
+import ast
+import io
+import tokenize
+from fractions import Fraction
+from types import CodeType
+from typing import Any
+
+from ptyx.config import param
+from ptyx.internal_types import EvalFlags
+
+# Name of the helpers in the evaluation context (see `ptyx.context.GLOBAL_CONTEXT`).
+DIV = "__ptyx_div__"
+POW = "__ptyx_pow__"
+
+
+def _is_rational(value: Any) -> bool:
+    # Note that sympy Rationals must be left to sympy.
+    return isinstance(value, (int, Fraction))
+
+
+def _normalize(value: Fraction) -> int | Fraction:
+    return value.numerator if value.denominator == 1 else value
+
+
+def div(a: Any, b: Any) -> Any:
+    """Divide `a` by `b`, returning a fraction if both are integers or fractions."""
+    if _is_rational(a) and _is_rational(b):
+        return _normalize(Fraction(a, b))
+    return a / b
+
+
+def power(a: Any, b: Any) -> Any:
+    """Return `a ** b`, returning a fraction for negative integer powers of integers and fractions."""
+    if _is_rational(a) and isinstance(b, int):
+        return _normalize(Fraction(a) ** b)
+    return a**b
+
+
+def _convert_xor(code: str) -> str:
+    """Replace `^` with `**`, like sympy parser does.
+
+    This must be done before parsing, since `^` and `**` don't have the same precedence.
+    """
+    if "^" not in code:
+        return code
+    tokens = [
+        (tokenize.OP, "**") if (token.type, token.string) == (tokenize.OP, "^") else token[:2]
+        for token in tokenize.generate_tokens(io.StringIO(code).readline)
+    ]
+    return tokenize.untokenize(tokens)
+
+
+class _NumericTransformer(ast.NodeTransformer):
+    """Replace `/` and `**` operators with calls to `div()` and `power()`."""
+
+    def visit_BinOp(self, node: ast.BinOp) -> ast.AST:
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Div):
+            helper = DIV
+        elif isinstance(node.op, ast.Pow):
+            helper = POW
+        else:
+            return node
+        call = ast.Call(func=ast.Name(id=helper, ctx=ast.Load()), args=[node.left, node.right], keywords=[])
+        return ast.copy_location(call, node)
+
+
+def compile_numeric_expr(code: str) -> CodeType:
+    """Compile python expression `code`, to be evaluated in numeric mode.
+
+    Like `eval()`, "<string>" is used as filename, so that errors report the same information.
+    """
+    try:
+        code = _convert_xor(code.strip())
+    except tokenize.TokenError as e:
+        raise SyntaxError(f"Invalid python expression: {code!r}") from e
+    tree = ast.parse(code, "<string>", "eval")
+    tree = ast.fix_missing_locations(_NumericTransformer().visit(tree))
+    return compile(tree, "<string>", "eval")
+
+
+def is_numeric(value: Any) -> bool:
+    """Test if `value` is a python number (i.e. not a sympy object)."""
+    return isinstance(value, (int, Fraction, float)) and not isinstance(value, bool)
+
+
+def numeric2latex(value: Any, flags: EvalFlags | None = None) -> str:
+    """Convert python number to LaTeX code, like `sympy2latex()` does for sympy numbers.
+
+    Any other object is converted using `sympy2latex()`.
+    """
+    if flags is None:
+        flags = EvalFlags()
+    if not is_numeric(value) or flags.format_as_str:
+        from ptyx.printers import sympy2latex
+
+        return sympy2latex(value, flags)
+    if isinstance(value, float) or flags.keep_dot_as_decimal_mark:
+        # See `sympy2latex()`.
+        latex = format(float(value), ".14g")
+        if latex == "-0":
+            latex = "0"
+        if not flags.keep_dot_as_decimal_mark:
+            latex = latex.replace(".", param["floating_point"])
+        return latex
+    if isinstance(value, Fraction) and value.denominator != 1:
+        latex = rf"\frac{{{abs(value.numerator)}}}{{{value.denominator}}}"
+        return "- " + latex if value < 0 else latex
+    return str(int(value))
@@ -0,0 +1,298 @@
+"""
+Preprocessing of pTyX code.
+
+Before generating the syntax tree, pTyX code must be preprocessed:
+  - comments are removed,
+  - included files (#INCLUDE{path} tags) are inserted,
+  - extensions to load (#LOAD{name} tags) are listed,
+  - seed values (#SEED{num} tags) are extracted.
+
+All of this is done while scanning the source code only once.
+
+Since the preprocessed code doesn't match the original files anymore,
+each included file is wrapped in a #INCLUDE_START{path}{position} tag,
+where `position` is the position of the #INCLUDE{} tag in the raw parent file
+(see `wrap_included_code()`), so that tracebacks stay accurate.
+
+Source files are memory-mapped (see `SourceBuffer`), and only the fragments
+of text kept in the preprocessed code are decoded. Note that this doesn't
+lower memory usage significantly: the preprocessed code is still a python
+string (extensions and the syntax tree generator need it), and the syntax tree
+uses much more memory than the source code anyway.
+"""
+
+import mmap
+import os
+import re
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Iterator, Any, NamedTuple, Sequence
+
+from ptyx.errors import PtyxSyntaxError
+
+
+def _preprocessor_regex(line_end: str) -> str:
+    # Don't remove the end of the lines when removing comments, since this would result
+    # in invalid tracebacks, since the line numbers would be changed.
+    # noinspection RegExpRedundantEscape
+    return (
+        rf"(?P<comment> # {line_end}|^# {line_end})"
+        r"|#INCLUDE\{(?P<include>[^}]+)\}"
+        r"|#LOAD\{\s*(?P<load>\w+)\s*\}"
+        r"|#SEED\{\s*(?P<seed>\d+)\s*\}"
+    )
+
+
+RE_PREPROCESSOR = re.compile(_preprocessor_regex(".+"), flags=re.MULTILINE)
+# Memory-mapped files are scanned before new lines are normalized, so "\r" must be left too.
+RE_PREPROCESSOR_BYTES = re.compile(_preprocessor_regex(r"[^\r\n]+").encode(), flags=re.MULTILINE)
+# A comment may only appear once a tag is removed, like in `#SEED{3}# comment`.
+RE_COMMENT_AFTER_TAG = re.compile("# .+")
+RE_COMMENT_AFTER_TAG_BYTES = re.compile(rb"# [^\r\n]+")
+
+# Used to clean the code generated by extensions.
+# noinspection RegExpRedundantEscape
+RE_COMMENT_OR_SEED = re.compile(r"(?P<comment> # .+|^# .+)|#SEED\{\s*(?P<seed>\d+)\s*\}", flags=re.MULTILINE)
+
+
+class IncludedFile(NamedTuple):
+    """A file included by the main file, whose content was collected instead of being inserted.
+
+    `seeds_index` and `extensions_index` are the numbers of seeds and of (distinct) extensions
+    found in the main file before the #INCLUDE{} tag.
+    """
+
+    path: Path
+    seeds_index: int
+    extensions_index: int
+
+
+@dataclass
+class PreprocessedCode:
+    """The result of the preprocessing of some pTyX code."""
+
+    code: str
+    # The names of the extensions to load, in order of appearance (without duplicates).
+    extensions: list[str] = field(default_factory=list)
+    # The values of the #SEED tags, in order of appearance.
+    seeds: list[int] = field(default_factory=list)
+    # When included files are collected instead of being inserted, the included files.
+    included: list[IncludedFile] = field(default_factory=list)
+
+    def insert_included(self, included: Sequence["PreprocessedCode"]) -> None:
+        """Insert the seeds and the extensions of the collected included files.
+
+        `included` is the preprocessed content of each file of `self.included`.
+
+        Seeds and extensions are then listed in the same order as if the content
+        of the included files was inserted in the main file.
+        """
+        seeds: list[int] = []
+        extensions: list[str] = []
+        seeds_index = extensions_index = 0
+        for included_file, included_code in zip(self.included, included, strict=True):
+            seeds += self.seeds[seeds_index : included_file.seeds_index] + included_code.seeds
+            extensions += self.extensions[extensions_index : included_file.extensions_index]
+            extensions += included_code.extensions
+            seeds_index, extensions_index = included_file.seeds_index, included_file.extensions_index
+        self.seeds = seeds + self.seeds[seeds_index:]
+        self.extensions = list(dict.fromkeys(extensions + self.extensions[extensions_index:]))
+
+
+def _decode(data: bytes) -> str:
+    """Decode a fragment of a source file, normalizing new lines like `open()` does in text mode."""
+    return str(data, "utf8").replace("\r\n", "\n").replace("\r", "\n")
+
+
+class SourceBuffer:
+    """A pTyX source file, which is memory-mapped instead of being read when scanned.
+
+    Files are expected to be UTF-8 encoded.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        # Raise an error as soon as possible if the file is missing.
+        path.stat()
+
+    @contextmanager
+    def map(self) -> Iterator[bytes | mmap.mmap]:
+        """Memory-map the source file, and return the mapped data."""
+        with open(self.path, "rb") as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                # An empty file can't be memory-mapped.
+                yield b""
+            else:
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    yield data
+
+    def read(self) -> str:
+        """Return the whole file content."""
+        with self.map() as data:
+            return _decode(data[:])
+
+
+def wrap_included_code(path: Path, position: int, content: str) -> str:
+    """Enclose the content of an included file inside an isolated block.
+
+    `position` is the position (in the raw parent file) where the file was included.
+    """
+    return f"\n#APART#INCLUDE_START{{{path}}}{{{position}}}{content}#END_APART#INCLUDE_END\n"
+
+
+class Preprocessor:
+    """Preprocess pTyX code in a single pass.
+
+    `resolve_path` is used to get the path of an included file from the #INCLUDE{} tag argument.
+
+    If `collect_included_files` is True, included files are not inserted in the main file,
+    but replaced with #INCLUDE_TREE{num} markers, and they are listed in `PreprocessedCode.included`
+    instead, to be preprocessed separately (see `PreprocessedCode.insert_included()`).
+    Files included by an included file are always inserted in it.
+    """
+
+    def __init__(self, resolve_path: Callable[[str], Path], collect_included_files: bool = False):
+        self.resolve_path = resolve_path
+        self.collect_included_files = collect_included_files
+
+    def preprocess(
+        self, code: str | SourceBuffer, path: Path | None = None, including: tuple[Path | None, ...] = ()
+    ) -> PreprocessedCode:
+        """Preprocess `code`, which is the content of the file located at `path`, if any.
+
+        `code` may also be a `SourceBuffer`, in which case `path` is ignored.
+
+        `including` is the paths of the files including this one, if any
+        (used to detect circular inclusions).
+        """
+        result = PreprocessedCode(code="")
+        chunks: list[str] = []
+        self._scan(code, path, chunks, result, including, collect=self.collect_included_files)
+        result.code = "".join(chunks)
+        result.extensions = list(dict.fromkeys(result.extensions))
+        return result
+
+    def _scan(
+        self,
+        source: str | SourceBuffer,
+        path: Path | None,
+        chunks: list[str],
+        result: PreprocessedCode,
+        including: tuple[Path | None, ...],
+        collect: bool = False,
+    ) -> None:
+        """Scan `source`, and append the preprocessed code to `chunks`."""
+        if isinstance(source, SourceBuffer):
+            with source.map() as data:
+                self._scan_data(
+                    data,
+                    (RE_PREPROCESSOR_BYTES, RE_COMMENT_AFTER_TAG_BYTES),
+                    _decode,
+                    source.path,
+                    chunks,
+                    result,
+                    including,
+                    collect,
+                )
+        else:
+            self._scan_data(
+                source, (RE_PREPROCESSOR, RE_COMMENT_AFTER_TAG), str, path, chunks, result, including, collect
+            )
+
+    def _scan_data(
+        self,
+        data: Any,
+        regexes: tuple[re.Pattern, re.Pattern],
+        decode: Callable[[Any], str],
+        path: Path | None,
+        chunks: list[str],
+        result: PreprocessedCode,
+        including: tuple[Path | None, ...],
+        collect: bool,
+    ) -> None:
+        """Scan `data` (either a string, or a bytes-like object to be decoded using `decode`).
+
+        `regexes` are the preprocessor regex, and the regex matching a comment following a removed tag.
+        """
+        regex, comment_regex = regexes
+        # Position in `data`.
+        position = 0
+        # Position in the source file, in characters.
+        offset = 0
+        # Position in `data` where to search for the next match.
+        search_position = 0
+        while (match := regex.search(data, search_position)) is not None:
+            kind = match.lastgroup
+            search_position = match.end()
+            if kind == "load":
+                # #LOAD{} tags are left in the code.
+                result.extensions.append(decode(match.group("load")))
+                continue
+            kept = decode(data[position : match.start()])
+            chunks.append(kept)
+            offset += len(kept)
+            # Position of the tag in the source file.
+            tag_offset = offset
+            offset += len(decode(match.group()))
+            position = match.end()
+            if kind == "seed":
+                result.seeds.append(int(match.group("seed")))
+            elif kind == "include":
+                included_path = self.resolve_path(decode(match.group("include")))
+                if included_path in including or included_path == path:
+                    raise PtyxSyntaxError(f"File '{included_path}' includes itself.")
+                buffer = SourceBuffer(included_path)
+                if collect:
+                    extensions_index = len(dict.fromkeys(result.extensions))
+                    result.included.append(IncludedFile(included_path, len(result.seeds), extensions_index))
+                    wrapper = wrap_included_code(
+                        included_path, tag_offset, f"#INCLUDE_TREE{{{len(result.included) - 1}}}"
+                    )
+                    chunks.append(wrapper)
+                else:
+                    head, tail = wrap_included_code(included_path, tag_offset, "\n\0").split("\0")
+                    chunks.append(head)
+                    self._scan(buffer, included_path, chunks, result, (*including, path))
+                    chunks.append(tail)
+            if kind != "comment":
+                comment = comment_regex.match(data, position)
+                if comment is not None and _remove_comment_start(chunks):
+                    offset += len(decode(comment.group()))
+                    position = search_position = comment.end()
+        chunks.append(decode(data[position:]))
+
+
+def _remove_comment_start(chunks: list[str]) -> bool:
+    """Test if a `# ` following the code already generated starts a comment.
+
+    A comment starts either at the beginning of a line, or after a space, which is then
+    removed too (like when removing comments using `RE_PREPROCESSOR`).
+    """
+    for i in range(len(chunks) - 1, -1, -1):
+        if chunks[i]:
+            if chunks[i].endswith("\n"):
+                return True
+            if chunks[i].endswith(" "):
+                chunks[i] = chunks[i][:-1]
+                return True
+            return False
+    # Beginning of the code.
+    return True
+
+
+def clean_generated_code(code: str) -> tuple[str, list[int]]:
+    """Remove comments and #SEED{num} tags from code.
+
+    This is used to clean the code generated by extensions.
+
+    Return the code without comments nor #SEED{...} tags, and the list of the seeds values.
+    """
+    seeds: list[int] = []
+
+    def replace(match: re.Match) -> str:
+        if match.lastgroup == "seed":
+            seeds.append(int(match.group("seed")))
+        return ""
+
+    return RE_COMMENT_OR_SEED.sub(replace, code), seeds
@@ -22,6 +22,7 @@ from sympy import Basic, Symbol, Integer, Float, I, Mul
 from sympy.printing.latex import LatexPrinter
 
 from ptyx.config import param
+from ptyx.utilities import LRUCache
 
 
 class CustomLatexPrinter(LatexPrinter):
@@ -36,6 +37,16 @@ class CustomLatexPrinter(LatexPrinter):
         }
         self._default_settings.update(defaults)
         LatexPrinter.__init__(self, settings)
+        # The name of the best fitting printing method for each class of objects (see `_print()`),
+        # or None if the printer has no method for this class.
+        self._dispatch: dict[type, str | None] = {}
+
+    def _find_print_method(self, cls: type) -> str | None:
+        for parent in cls.__mro__:
+            printmethod = "_print_" + parent.__name__
+            if hasattr(self, printmethod):
+                return printmethod
+        return None
 
     def _print(self, expr, *args, **kwargs):
         """Change sympy printing algorithm.
@@ -53,10 +64,13 @@ class CustomLatexPrinter(LatexPrinter):
         try:
             # See if the class of expr is known, or if one of its super
             # classes is known, and use that print function
-            for cls in type(expr).__mro__:
-                printmethod = "_print_" + cls.__name__
-                if hasattr(self, printmethod):
-                    return getattr(self, printmethod)(expr, *args, **kwargs)
+            cls = type(expr)
+            try:
+                printmethod = self._dispatch[cls]
+            except KeyError:
+                printmethod = self._dispatch[cls] = self._find_print_method(cls)
+            if printmethod is not None:
+                return getattr(self, printmethod)(expr, *args, **kwargs)
 
             # If the printer defines a name for a printing method
             # (Printer.printmethod) and the object knows for itself how it
@@ -155,18 +169,63 @@ class CustomLatexPrinter(LatexPrinter):
         return tex.replace(r"\operatorname{", r"\mathrm{")
 
 
+# Printers are reused, since creating a new one is slow.
+_PRINTERS: dict[tuple, CustomLatexPrinter] = {}
+
+# LaTeX code of the recently printed expressions (see `sympy2latex()`).
+# It is resized each time a new LatexGenerator is created, using `param["latex_cache_size"]`.
+LATEX_CACHE: LRUCache[tuple, str] = LRUCache(param["latex_cache_size"])
+
+
+def get_printer(**settings) -> CustomLatexPrinter:
+    """Return a printer using the given settings."""
+    try:
+        key = tuple(sorted(settings.items()))
+        printer = _PRINTERS.get(key)
+    except TypeError:
+        # Unhashable setting value.
+        return CustomLatexPrinter(settings)
+    if printer is None:
+        printer = _PRINTERS[key] = CustomLatexPrinter(settings)
+    return printer
+
+
 def custom_latex(expr, **settings):
     """Convert expression to LaTeX code."""
     if sympy is None:
         return str(expr)
-    return CustomLatexPrinter(settings).doprint(expr)
+    return get_printer(**settings).doprint(expr)
 
 
 def sympy2latex(expr, flags: EvalFlags = None, **sympy_flags) -> str:
-    """Convert a sympy expression to LaTeX code."""
+    """Convert a sympy expression to LaTeX code.
+
+    The LaTeX code of sympy expressions is cached, since the same values
+    are often printed again and again (in every version of the document).
+    """
     if flags is None:
         flags = EvalFlags()
+    if not isinstance(expr, Basic):
+        return _sympy2latex(expr, flags, sympy_flags)
+    try:
+        key = (
+            type(expr),
+            expr,
+            flags.format_as_str,
+            flags.keep_dot_as_decimal_mark,
+            param["floating_point"],
+            tuple(sorted(sympy_flags.items())),
+        )
+        latex = LATEX_CACHE.get(key)
+    except TypeError:
+        # Unhashable expression or setting value.
+        return _sympy2latex(expr, flags, sympy_flags)
+    if latex is None:
+        latex = LATEX_CACHE[key] = _sympy2latex(expr, flags, sympy_flags)
+    return latex
+
 
+def _sympy2latex(expr, flags: EvalFlags, sympy_flags: dict) -> str:
     if flags.format_as_str:
         latex = str(expr)
     elif isinstance(expr, float) or (sympy and isinstance(expr, Float)) or flags.keep_dot_as_decimal_mark:
@@ -1,13 +1,24 @@
+import builtins
+import inspect
+import itertools
+import numbers
 import random
-import functools
-from collections import namedtuple
-from math import gcd
-from typing import Iterable, Sequence, TypeVar
-
+from collections import Counter, namedtuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from fractions import Fraction
+from math import gcd, perm, lcm
+from types import CodeType
+from typing import Iterable, Iterator, Sequence, TypeVar, Callable, Any
+
+import numpy
 from numpy import array
 from ptyx.sys_info import SYMPY_AVAILABLE
 
 from ptyx.config import param
+from ptyx.pretty_print import print_warning
+from ptyx.utilities import LRUCache, is_memoizable, memoization_key
 
 
 if SYMPY_AVAILABLE:
@@ -23,12 +34,13 @@ else:
     INTEGERS_TYPES = (int,)
 
 
-# Important note: all the following functions are sandboxed.
-# By this, I mean that any external call to random won't affect random state for
-# the following functions.
-
-_RANDOM_STATE = random.getstate()
-_SANDBOXED_MODE = False
+# Important note: all the following functions use their own random generator,
+# so that any external call to `random` won't affect them (and vice versa).
+# Each version of the document gets a new generator (see `set_seed()`).
+# It is stored in a context variable, so that versions may be generated concurrently.
+_GENERATOR: ContextVar[random.Random] = ContextVar("ptyx_random_generator")
+# The seed of the current version of the document.
+_SEED: ContextVar[int] = ContextVar("ptyx_seed", default=0)
 _T = TypeVar("_T")
 
 
@@ -49,50 +61,77 @@ class Point(namedtuple("Point", ["x", "y"])):
 def _print_state():
     """For debuging purpose."""
     print(29 * "*")
-    print("randfunc._RANDOM_STATE value:")
-    print(hash(_RANDOM_STATE))
+    print("randfunc random generator state:")
+    print(hash(get_generator().getstate()))
     print(29 * "*")
 
 
-def sandboxed(func):
-    @functools.wraps(func)
-    def wrapper(*args, **kw):
-        global _RANDOM_STATE, _SANDBOXED_MODE
-        if not _SANDBOXED_MODE:
-            old_state = random.getstate()
-            random.setstate(_RANDOM_STATE)
-            _SANDBOXED_MODE = True
-            try:
-                val = func(*args, **kw)
-            finally:
-                _RANDOM_STATE = random.getstate()
-                random.setstate(old_state)
-                _SANDBOXED_MODE = False
-        else:
-            val = func(*args, **kw)
-        return val
+def get_generator() -> random.Random:
+    """Return the random generator used by all the functions of this module."""
+    try:
+        return _GENERATOR.get()
+    except LookupError:
+        generator = random.Random()
+        _GENERATOR.set(generator)
+        return generator
+
+
+def _default_number_type(val):
+    """Convert python number to a sympy number, unless sympy is disabled or numeric mode is on."""
+    if param["sympy_is_default"] and not param["numeric_mode"]:
+        return S(val)
+    return val
 
-    return wrapper
 
+def set_seed(value) -> None:
+    """Set a new random generator, using seed `value`, for the functions of this module.
 
-def set_seed(value):
-    global _RANDOM_STATE
+    Python `random` module is seeded too, for the python code of the document using it directly.
+    """
     random.seed(value)
-    _RANDOM_STATE = random.getstate()
+    _SEED.set(value)
+    _GENERATOR.set(random.Random(value))
 
 
-@sandboxed
-def randint(a: int = None, b: int = None, exclude: Iterable = ()) -> int:
-    """Generate a random integer between `a` and `b`.
+def derive_generator(key: Sequence[int]) -> random.Random:
+    """Return a new random generator, derived from the current seed and `key` (a tuple of integers).
 
-    Forbidden values may be specified using `exclude` argument.
+    The generator only depends on the seed and on `key`, not on the values generated before.
+    Generators derived from different keys are statistically independent, since they are seeded
+    using `numpy.random.SeedSequence`, which hashes the seed and the key together.
     """
+    from numpy.random import SeedSequence
+
+    state = SeedSequence(_SEED.get(), spawn_key=tuple(key)).generate_state(4)
+    return random.Random(int.from_bytes(state.tobytes(), "little"))
+
+
+@contextmanager
+def using_generator(generator: random.Random) -> Iterator[random.Random]:
+    """Use `generator` instead of the current random generator inside a `with` block."""
+    token = _GENERATOR.set(generator)
+    try:
+        yield generator
+    finally:
+        _GENERATOR.reset(token)
+
+
+def _randint_bounds(a: int | None, b: int | None) -> tuple[int, int]:
     if a is None and b is not None:
         a, b = b, a
     if b is None:
         b = 9 if a is None else a
         a = 2
     assert a is not None and b is not None
+    return a, b
+
+
+def randint(a: int = None, b: int = None, exclude: Iterable = ()) -> int:
+    """Generate a random integer between `a` and `b`.
+
+    Forbidden values may be specified using `exclude` argument.
+    """
+    a, b = _randint_bounds(a, b)
     while a in exclude:
         a += 1
         if a > b:
@@ -102,21 +141,13 @@ def randint(a: int = None, b: int = None, exclude: Iterable = ()) -> int:
         if a > b:
             raise ValueError("Can't statisfy constraints !")
     while True:
-        val = random.randint(a, b)
+        val = get_generator().randint(a, b)
         if val not in exclude:
             break
-    if param["sympy_is_default"]:
-        val = S(val)
-    return val
-
+    return _default_number_type(val)
 
-@sandboxed
-def srandint(a: int = None, b: int = None, exclude: Iterable = ()) -> int:
-    """Generate a random integer between `a` and `b` or between `-b` and `-a`.
 
-    `a` and `b` should be positive integers.
-    Forbidden values may be specified using `exclude` argument.
-    """
+def _srandint_bounds(a: int | None, b: int | None) -> tuple[int, int]:
     if a is None and b is None:
         a, b = 2, 9
     elif a is None:
@@ -124,6 +155,16 @@ def srandint(a: int = None, b: int = None, exclude: Iterable = ()) -> int:
     elif b is None:
         a, b = 2, a
     assert a is not None and b is not None
+    return a, b
+
+
+def srandint(a: int = None, b: int = None, exclude: Iterable = ()) -> int:
+    """Generate a random integer between `a` and `b` or between `-b` and `-a`.
+
+    `a` and `b` should be positive integers.
+    Forbidden values may be specified using `exclude` argument.
+    """
+    a, b = _srandint_bounds(a, b)
     # pylint: disable=invalid-unary-operand-type
     while a in exclude and -a in exclude:
         a += 1
@@ -134,25 +175,20 @@ def srandint(a: int = None, b: int = None, exclude: Iterable = ()) -> int:
         if a > b:
             raise ValueError("Can't statisfy constraints !")
     while True:
-        val = (-1) ** random.randint(0, 1) * randint(a, b)
+        val = (-1) ** get_generator().randint(0, 1) * randint(a, b)
         if val not in exclude:
             return val
 
 
-@sandboxed
 def randsign():
-    val = (-1) ** random.randint(0, 1)
-    if param["sympy_is_default"]:
-        val = S(val)
-    return val
+    val = (-1) ** get_generator().randint(0, 1)
+    return _default_number_type(val)
 
 
-@sandboxed
 def randbool():
     return bool(randint(0, 1))
 
 
-@sandboxed
 def randpoint(a=None, b=None, exclude=()):
     while True:
         x = randint(a, b)
@@ -161,7 +197,6 @@ def randpoint(a=None, b=None, exclude=()):
             return Point(x, y)
 
 
-@sandboxed
 def srandpoint(a=None, b=None, exclude=()):
     while True:
         x = srandint(a, b)
@@ -187,7 +222,6 @@ def is_mult_2_5(val: int | Iterable[int]) -> bool:
     return val in (1, -1)
 
 
-@sandboxed
 def randfrac(a=None, b=None, exclude=(), not_decimal=False, den=None):
     """Return a random positive fraction which is never an integer.
 
@@ -216,20 +250,22 @@ def randfrac(a=None, b=None, exclude=(), not_decimal=False, den=None):
         else:
             n = randint(a, b)
             if hasattr(den, "__iter__"):
-                d = random.choice(den)
+                d = get_generator().choice(den)
             else:
                 d = den
             if gcd(d, n) not in (-1, 1):
                 # XXX this may lead to infinite loop if wrong arguments are passed
                 continue
-        val = S(n) / S(d)
-        if not_decimal and is_mult_2_5(val.q):
+        if param["numeric_mode"]:
+            val = Fraction(int(n), int(d))
+        else:
+            val = S(n) / S(d)
+        if not_decimal and is_mult_2_5(val.denominator):
             continue
-        if not val.is_integer and val not in exclude:
+        if val.denominator != 1 and val not in exclude:
             return val
 
 
-@sandboxed
 def srandfrac(a=None, b=None, exclude=(), not_decimal=False, den=None):
     """Return a random signed fraction which is never an integer.
 
@@ -242,7 +278,6 @@ def srandfrac(a=None, b=None, exclude=(), not_decimal=False, den=None):
             return val
 
 
-@sandboxed
 def randchoice(items, *others, **kw):
     """Select randomly an item.
 
@@ -256,28 +291,26 @@ def randchoice(items, *others, **kw):
     if "exclude" in kw:
         items = [val for val in items if val not in kw["exclude"]]
     try:
-        val = random.choice(items)
+        val = get_generator().choice(items)
     except KeyError:
         raise ValueError(
             f"Invalid argument type: {type(items).__name__}. Hint: try to convert argument to list"
         )
-    if isinstance(val, (int, float, complex)):
+    if isinstance(val, (int, float, complex)) and not param["numeric_mode"]:
         val = S(val)
     return val
 
 
-@sandboxed
 def randsample(items: Sequence[_T], k: int) -> list[_T]:
     """Return a random list of k unique elements from `items`.
 
     Raise `ValueError` if `items` does not contain enough elements."""
-    return random.sample(items, k)
+    return get_generator().sample(items, k)
 
 
-@sandboxed
 def randpop(list_or_set):
     """Randomely remove an item from list or set and return it."""
-    i = random.randint(0, len(list_or_set) - 1)
+    i = get_generator().randint(0, len(list_or_set) - 1)
     if isinstance(list_or_set, list):
         return list_or_set.pop(i)
     elif isinstance(list_or_set, set):
@@ -289,29 +322,25 @@ def randpop(list_or_set):
         raise NotImplementedError
 
 
-@sandboxed
 def srandchoice(*items, **kw):
     kw["signed"] = True
     return randchoice(*items, **kw)
 
 
-@sandboxed
 def shuffle(items: list) -> None:
-    random.shuffle(items)
+    get_generator().shuffle(items)
 
 
-@sandboxed
-def randmaketrans(string, _random=None):
+def randmaketrans(string):
     """Shuffle string letters and return a random translation table usable for str.translate()."""
     letters = list(string)
     if len(letters) != len(set(letters)):
         raise ValueError(f"Same letter appears twice in {string!r}.")
-    random.shuffle(letters, _random)
+    get_generator().shuffle(letters)
     shuffled_string = "".join(letters)
     return str.maketrans(string, shuffled_string)
 
 
-@sandboxed
 def randfloat(a, b, d=5, exclude=()):
     k = 10**d
     exclude = {int(round(v * k)) for v in exclude}
@@ -321,12 +350,67 @@ def randfloat(a, b, d=5, exclude=()):
             return float(n / k)
 
 
-@sandboxed
 def srandfloat(a, b, d=5, exclude=()):
     return float(randsign()) * randfloat(a, b, d, exclude)
 
 
-@sandboxed
+def _integer_rank(rows: list[list[int]]) -> int:
+    """Return the rank of an integer matrix.
+
+    Fraction-free gaussian elimination (Bareiss algorithm) is used,
+    so that all the computations are done using python integers.
+
+    >>> _integer_rank([[1, 2, 3], [2, 4, 6], [1, 0, 1]])
+    2
+    """
+    rows = [list(row) for row in rows]
+    rank = 0
+    previous_pivot = 1
+    columns = len(rows[0]) if rows else 0
+    for j in range(columns):
+        if rank == len(rows):
+            break
+        i = next((i for i in range(rank, len(rows)) if rows[i][j] != 0), None)
+        if i is None:
+            continue
+        rows[rank], rows[i] = rows[i], rows[rank]
+        pivot_row = rows[rank]
+        pivot = pivot_row[j]
+        for row in rows[rank + 1 :]:
+            coefficient = row[j]
+            for k in range(j + 1, columns):
+                # Division is always exact.
+                row[k] = (pivot * row[k] - coefficient * pivot_row[k]) // previous_pivot
+            row[j] = 0
+        previous_pivot = pivot
+        rank += 1
+    return rank
+
+
+def _rank(rows: list[list]) -> int:
+    """Return the rank of the matrix.
+
+    Matrices of rational numbers are handled using python integers only (see `_integer_rank()`),
+    which is much faster than sympy.
+    """
+    integer_rows = []
+    for row in rows:
+        if not all(isinstance(val, numbers.Rational) for val in row):
+            from sympy import Matrix
+
+            return Matrix(rows).rank()
+        # Multiplying a row by a non-null number doesn't change the rank.
+        k = lcm(*(int(val.denominator) for val in row))
+        integer_rows.append([int(val.numerator) * (k // int(val.denominator)) for val in row])
+    return _integer_rank(integer_rows)
+
+
+def _add_dependent_rows(matrix: list[list], lines: int) -> None:
+    """Append random linear combinations of the rows of the matrix, until it has `lines` rows."""
+    while len(matrix) < lines:
+        matrix.append(list(sum(srandint() * array(line) for line in matrix)))  # type: ignore[arg-type]
+
+
 def randmatrix(size=(3, 3), rank=None, unique=False, func=srandint, **kw):
     """Return a matrix of dimensions `size` (number of lines, number of columns).
 
@@ -350,19 +434,54 @@ def randmatrix(size=(3, 3), rank=None, unique=False, func=srandint, **kw):
         while True:
             # noinspection PyUnusedLocal
             matrix = [[func(**kw) for j in range(size[1])] for i in range(rank)]
-            if Matrix(matrix).rank() == rank:
+            if _rank(matrix) == rank:
                 break
-        while len(matrix) < size[0]:
-            matrix.append(list(sum(srandint() * array(line) for line in matrix)))
+        _add_dependent_rows(matrix, size[0])
     return Matrix(matrix)
 
 
-def many(n=2, func=srandint, unique=True, **kw):
+def randmatrices(n: int, size=(3, 3), rank=None, func=srandint, **kw) -> list:
+    """Return `n` matrices of dimensions `size`, like `randmatrix()`.
+
+    If `func` has a batch version (like `randint()`, see `many()`), all the coefficients are drawn at once.
+    Note that matrices are not the same as the ones generated by `randmatrix()` then.
+    """
+    from sympy import Matrix
+
+    if rank is not None and rank > min(size):
+        raise ValueError("Matrix rank can't exceed lines nor columns number.")
+    lines, columns = size
+    # Only independent rows are drawn, the other ones are linear combinations of them.
+    drawn_lines = lines if rank is None else rank
+    matrices: list[list[list]] = []
+    while len(matrices) < n:
+        missing = n - len(matrices)
+        if func in _BATCH_FUNCTIONS:
+            values = _BATCH_FUNCTIONS[func](missing * drawn_lines * columns, **kw)
+        else:
+            values = [func(**kw) for _ in range(missing * drawn_lines * columns)]
+        for start in range(0, len(values), drawn_lines * columns):
+            matrix = [values[i : i + columns] for i in range(start, start + drawn_lines * columns, columns)]
+            if rank is None or _rank(matrix) == rank:
+                _add_dependent_rows(matrix, lines)
+                matrices.append(matrix)
+    return [Matrix(matrix) for matrix in matrices]
+
+
+def many(n=2, func=srandint, unique=True, batch=False, **kw):
     """Return several numbers at once.
 
     By default, every number is unique.
     Note this can lead to infinite recursion if n is too large and
-    `unique` is set to True (default value)."""
+    `unique` is set to True (default value).
+
+    If `batch` is True and `func` is `randint`, `srandint`, `randfrac` or `randfloat`,
+    all the numbers are drawn at once using the corresponding batch function (see `randints()`),
+    which is much faster for large `n`.
+    Note that the generated numbers are not the same then.
+    """
+    if batch and func in _BATCH_FUNCTIONS:
+        return _BATCH_FUNCTIONS[func](n, unique=unique, **kw)
     values = []
     kw.setdefault("exclude", [])
     # Make a copy of `exclude`, to not modify the given list.
@@ -375,6 +494,400 @@ def many(n=2, func=srandint, unique=True, **kw):
     return values
 
 
+# -----------------------------------------------------------------------------
+# Batch functions, drawing many values at once using NumPy.
+#
+# They are much faster than calling the corresponding functions in a loop,
+# but they don't generate the same values.
+
+# Maximal number of batches drawn before giving up, when values are drawn using rejection sampling.
+_MAX_BATCHES = 100
+# Integer ranges larger than this are sampled using rejection sampling,
+# instead of listing all the allowed values.
+_MAX_LISTED_VALUES = 10**6
+
+
+def numpy_generator() -> numpy.random.Generator:
+    """Return a NumPy random generator, seeded using the current random generator.
+
+    So, the values it generates only depend on the seed, like for any other function of this module.
+    """
+    return numpy.random.Generator(numpy.random.Philox(get_generator().getrandbits(128)))
+
+
+def _collect(draw: Callable[[int], Iterable[_T]], n: int, exclude: Iterable, unique: bool) -> list[_T]:
+    """Collect `n` values, drawn by batches using `draw(size)`.
+
+    Excluded values (and duplicates if `unique` is True) are rejected.
+    """
+    values: list[_T] = []
+    seen = set(exclude)
+    for _ in range(_MAX_BATCHES):
+        missing = n - len(values)
+        if missing <= 0:
+            break
+        for val in draw(2 * missing + 8):
+            if val in seen:
+                continue
+            if unique:
+                seen.add(val)
+            values.append(val)
+            if len(values) == n:
+                return values
+    if len(values) < n:
+        raise ValueError("Can't statisfy constraints !")
+    return values
+
+
+def _sample_integers(
+    n: int, intervals: Sequence[tuple[int, int]], exclude: Iterable[Any], unique: bool
+) -> list[int]:
+    """Draw `n` integers uniformly from the union of `intervals` (bounds included)."""
+    generator = numpy_generator()
+    # Only integers may be excluded (`exclude` may contain anything else, like for `randint()`).
+    excluded = set(map(int, filter(lambda v: isinstance(v, INTEGERS_TYPES), exclude)))
+    if sum(high - low + 1 for low, high in intervals) <= _MAX_LISTED_VALUES:
+        allowed = numpy.unique(numpy.concatenate([numpy.arange(low, high + 1) for low, high in intervals]))
+        allowed = allowed[~numpy.isin(allowed, list(excluded))]
+        if len(allowed) == 0 or (unique and len(allowed) < n):
+            raise ValueError("Can't statisfy constraints !")
+        return [int(v) for v in generator.choice(allowed, n, replace=not unique)]
+    lows = numpy.array([low for low, _ in intervals])
+    highs = numpy.array([high for _, high in intervals])
+    weights = (highs - lows + 1) / (highs - lows + 1).sum()
+
+    def draw(size: int) -> list[int]:
+        i = generator.choice(len(intervals), size, p=weights)
+        return generator.integers(lows[i], highs[i], endpoint=True).tolist()
+
+    return _collect(draw, n, excluded, unique)
+
+
+def randints(n: int, a: int = None, b: int = None, exclude: Iterable = (), unique: bool = False) -> list:
+    """Generate `n` random integers between `a` and `b`, like `randint()`."""
+    a, b = _randint_bounds(a, b)
+    return [_default_number_type(v) for v in _sample_integers(n, [(a, b)], exclude, unique)]
+
+
+def srandints(n: int, a: int = None, b: int = None, exclude: Iterable = (), unique: bool = False) -> list:
+    """Generate `n` random integers between `a` and `b` or between `-b` and `-a`, like `srandint()`."""
+    a, b = _srandint_bounds(a, b)
+    values = _sample_integers(n, [(-b, -a), (a, b)], exclude, unique)
+    return [_default_number_type(v) for v in values]
+
+
+def randfloats(n: int, a, b, d=5, exclude=(), unique: bool = False) -> list[float]:
+    """Generate `n` random floats between `a` and `b` (bounds excluded), with `d` digits, like `randfloat()`."""
+    k = 10**d
+    excluded = {int(round(v * k)) for v in exclude}
+    values = _sample_integers(n, [(int(round(a * k)) + 1, int(round(b * k)) - 1)], excluded, unique)
+    return [float(v / k) for v in values]
+
+
+def _is_mult_2_5_array(values: numpy.ndarray) -> numpy.ndarray:
+    """Vectorized version of `is_mult_2_5()`."""
+    values = numpy.abs(values)
+    for p in (2, 5):
+        while (mask := (values % p == 0) & (values != 0)).any():
+            values = numpy.where(mask, values // p, values)
+    return values == 1
+
+
+def randfracs(n: int, a=None, b=None, exclude=(), not_decimal=False, den=None, unique: bool = False) -> list:
+    """Generate `n` random positive fractions which are never integers, like `randfrac()`."""
+    if b is None:
+        b = 9 if a is None else a
+        a = 2
+    if hasattr(den, "__iter__"):
+        den = list(den)
+    if (den is None and a in (-1, 0, 1) and b in (-1, 0, 1)) or a == b:
+        raise ValueError("(%s, %s) are not valid parameters." % (a, b))
+    if not_decimal and is_mult_2_5(den):
+        raise ValueError("chosen denominator is not compatible with `not_decimal` option.")
+    generator = numpy_generator()
+    # Fractions are represented as (numerator, denominator) pairs until the end.
+    excluded = {(int(v.numerator), int(v.denominator)) for v in exclude if hasattr(v, "denominator")}
+
+    def draw(size: int) -> Iterable[tuple[int, int]]:
+        nums = generator.integers(a, b, size, endpoint=True)
+        if den is None:
+            dens = generator.integers(a, b, size, endpoint=True)
+            keep = (dens != 0) & (dens != 1)
+        else:
+            dens = generator.choice(den if isinstance(den, list) else [den], size)
+            keep = numpy.abs(numpy.gcd(nums, dens)) == 1
+        # Dividing by gcd would fail for a null denominator, so use 1 then (the value is rejected anyway).
+        gcds = numpy.where(keep, numpy.gcd(nums, dens), 1)
+        signs = numpy.where(dens < 0, -1, 1)
+        nums, dens = signs * nums // gcds, signs * dens // gcds
+        keep &= dens != 1
+        if not_decimal:
+            keep &= ~_is_mult_2_5_array(dens)
+        return zip(nums[keep].tolist(), dens[keep].tolist())
+
+    values = _collect(draw, n, excluded, unique)
+    if param["numeric_mode"]:
+        return [Fraction(p, q) for p, q in values]
+    return [S(p) / S(q) for p, q in values]
+
+
+_BATCH_FUNCTIONS: dict[Callable, Callable[..., list]] = {
+    randint: randints,
+    srandint: srandints,
+    randfrac: randfracs,
+    randfloat: randfloats,
+}
+
+
+# -----------------------------------------------------------------------------
+# Sampling values satisfying a condition (see `let ... with <condition>` syntax
+# of the `extended_python` extension).
+
+# Finite domains with at most this number of tuples are enumerated once, and the tuples
+# satisfying the condition are then sampled directly (instead of using rejection sampling),
+# if `param["enumerate_conditions"]` is True.
+MAX_ENUMERATED_TUPLES = 10_000
+# Rejection sampling gives up after this number of draws.
+MAX_REJECTION_ITERATIONS = 100_000
+# A warning is printed when a rejection sampling needs more draws than this.
+REJECTION_WARNING_THRESHOLD = 1000
+
+
+@dataclass
+class SamplingStats:
+    """Statistics about `many_with()` calls."""
+
+    calls: int = 0
+    # Number of domains enumerated, and total number of tuples tested while enumerating them.
+    enumerations: int = 0
+    enumerated_tuples: int = 0
+    # Number of calls for which the satisfying tuples were already known.
+    cache_hits: int = 0
+    # Number of draws done by rejection sampling, and number of accepted ones.
+    draws: int = 0
+    accepted: int = 0
+
+    @property
+    def acceptance_rate(self) -> float:
+        """The proportion of accepted draws, when using rejection sampling."""
+        return self.accepted / self.draws if self.draws else 1.0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.calls} call(s): {self.enumerations} domain(s) enumerated ({self.enumerated_tuples} tuples),"
+            f" {self.cache_hits} cache hit(s), {self.draws} draw(s) by rejection sampling"
+            f" (acceptance rate: {self.acceptance_rate:.1%})."
+        )
+
+
+@dataclass
+class ConditionSampling:
+    """The state of `many_with()`: its statistics, and the tuples satisfying each enumerated condition.
+
+    Each compiler has its own instance (see `LatexGenerator.condition_sampling`).
+    """
+
+    stats: SamplingStats = field(default_factory=SamplingStats)
+    # The tuples satisfying a condition, and their weights (or None if they are equally likely),
+    # for each enumerated domain.
+    solutions: LRUCache[tuple, tuple[list[tuple], list[float] | None]] = field(
+        default_factory=lambda: LRUCache(256)
+    )
+
+
+_CONDITION_SAMPLING: ContextVar[ConditionSampling] = ContextVar("ptyx_condition_sampling")
+_MISSING = object()
+
+
+def get_condition_sampling() -> ConditionSampling:
+    """Return the state used by `many_with()`."""
+    try:
+        return _CONDITION_SAMPLING.get()
+    except LookupError:
+        sampling = ConditionSampling()
+        _CONDITION_SAMPLING.set(sampling)
+        return sampling
+
+
+def set_condition_sampling(sampling: ConditionSampling) -> None:
+    """Set the state used by `many_with()`."""
+    _CONDITION_SAMPLING.set(sampling)
+
+
+def _finite_domain(func: Callable, kw: dict[str, Any]) -> dict[Any, int] | None:
+    """Return all the values `func(**kw)` may return, with their multiplicities, or None if unknown.
+
+    The probability of each value is proportional to its multiplicity.
+    """
+    exclude = kw.get("exclude", ())
+    values: list
+    if func in (randint, srandint) and set(kw) <= {"a", "b", "exclude"}:
+        if func is randint:
+            a, b = _randint_bounds(kw.get("a"), kw.get("b"))
+            values = [range(a, b + 1)]
+        else:
+            a, b = _srandint_bounds(kw.get("a"), kw.get("b"))
+            values = [range(-b, -a + 1), range(a, b + 1)]
+        if sum(len(r) for r in values) > MAX_ENUMERATED_TUPLES:
+            # Don't waste time generating the values.
+            return None
+        values = [_default_number_type(v) for v in itertools.chain(*values)]
+    elif func is randchoice and set(kw) <= {"items", "signed", "exclude"} and "items" in kw:
+        values = list(kw["items"])
+        if kw.get("signed"):
+            values += [-1 * item for item in values]
+        if not param["numeric_mode"]:
+            values = [S(v) if isinstance(v, (int, float, complex)) else v for v in values]
+    else:
+        return None
+    try:
+        values = [v for v in values if v not in exclude]
+        multiplicities = Counter(values)
+        # Values comparing equal but of different types (like `1` and `1.0`) can't be merged.
+        if len(multiplicities) != len({memoization_key(v) for v in values}):
+            return None
+    except TypeError:
+        # Unhashable values.
+        return None
+    return dict(multiplicities)
+
+
+def _condition_key(condition: Callable[..., bool]) -> tuple | None:
+    """Return a key identifying the condition and the values of the variables it depends on.
+
+    Return None if the result of the condition may change even if those values don't,
+    i.e. if it uses a value which is not immutable, or a function which may not be pure
+    (like a random function, or any user-defined function).
+    """
+    code = getattr(condition, "__code__", None)
+    if code is None:
+        return None
+    # Collect the names used by the condition, including inside nested functions or comprehensions.
+    names: set[str] = set()
+    codes = [code]
+    while codes:
+        code_ = codes.pop()
+        names.update(code_.co_names)
+        codes.extend(const for const in code_.co_consts if isinstance(const, CodeType))
+    namespace = getattr(condition, "__globals__", {})
+    builtins_dict = namespace.get("__builtins__", builtins)
+    if not isinstance(builtins_dict, dict):
+        builtins_dict = vars(builtins_dict)
+    # Attributes names are collected too, which is harmless (they are usually missing from the namespace).
+    values = [namespace.get(name, builtins_dict.get(name, _MISSING)) for name in sorted(names)]
+    try:
+        values += [cell.cell_contents for cell in getattr(condition, "__closure__", None) or ()]
+    except ValueError:
+        # Empty cell.
+        return None
+    if not all(value is _MISSING or is_memoizable(value) for value in values):
+        return None
+    return code, tuple(memoization_key(value) for value in values)
+
+
+def _satisfying_tuples(
+    condition: Callable[..., bool], n: int, func: Callable, unique: bool, kw: dict[str, Any]
+) -> tuple[list[tuple], list[float] | None] | None:
+    """Return all the tuples of `n` values generated by `func(**kw)` satisfying the condition.
+
+    The weight of each tuple (its probability to be generated by `many(n, func, unique, **kw)`,
+    up to a constant factor) is returned too, or None if all the tuples are equally likely.
+
+    Return None if they can't be enumerated, because the domain is unknown or too large.
+    """
+    condition_key = _condition_key(condition)
+    if condition_key is None:
+        return None
+    domain = _finite_domain(func, kw)
+    if domain is None:
+        return None
+    size = perm(len(domain), n) if unique else len(domain) ** n
+    if size > MAX_ENUMERATED_TUPLES:
+        return None
+    sampling = get_condition_sampling()
+    key = (condition_key, tuple((memoization_key(v), m) for v, m in domain.items()), n, unique)
+    cached = sampling.solutions.get(key)
+    if cached is not None:
+        sampling.stats.cache_hits += 1
+        return cached
+    sampling.stats.enumerations += 1
+    sampling.stats.enumerated_tuples += size
+    tuples = itertools.permutations(domain, n) if unique else itertools.product(domain, repeat=n)
+    solutions = [values for values in tuples if condition(*values)]
+    weights: list[float] | None = None
+    if any(m != 1 for m in domain.values()):
+        total = sum(domain.values())
+        weights = []
+        for values in solutions:
+            weight = 1.0
+            remaining = total
+            for value in values:
+                weight *= domain[value] / remaining
+                if unique:
+                    # `many()` excludes all the occurrences of the values already generated.
+                    remaining -= domain[value]
+            weights.append(weight)
+    cached = sampling.solutions[key] = (solutions, weights)
+    return cached
+
+
+def many_with(
+    condition: Callable[..., bool], n=2, func=srandint, unique=True, *, source: str | None = None, **kw
+) -> list:
+    """Return `n` numbers generated like `many(n, func, unique, **kw)`, such that `condition(*numbers)` is True.
+
+    Numbers are drawn again until the condition is satisfied (rejection sampling).
+
+    If `param["enumerate_conditions"]` is True and the domain of `func(**kw)` is small
+    (`randint`, `srandint` or `randchoice` only), all the tuples satisfying the condition
+    are enumerated once instead, and one of them is picked, with the same probability
+    as with rejection sampling. The satisfying tuples are cached, as long as the values
+    of the variables used by the condition don't change (conditions using functions
+    which may not be pure are never enumerated).
+
+    `source` is the source code of the condition, used in warnings.
+
+    `ValueError` is raised if the condition can't be satisfied.
+    Statistics are collected in `get_condition_sampling().stats`.
+    """
+    stats = get_condition_sampling().stats
+    stats.calls += 1
+    if param["enumerate_conditions"]:
+        enumerated = _satisfying_tuples(condition, n, func, unique, kw)
+        if enumerated is not None:
+            solutions, weights = enumerated
+            if not solutions:
+                raise ValueError("Can't satisfy condition: no valid values.")
+            if weights is None:
+                return list(get_generator().choice(solutions))
+            return list(get_generator().choices(solutions, weights)[0])
+    for i in range(1, MAX_REJECTION_ITERATIONS + 1):
+        values = many(n, func, unique, **kw)
+        if condition(*values):
+            stats.draws += i
+            stats.accepted += 1
+            if i > REJECTION_WARNING_THRESHOLD:
+                print_warning(
+                    f"Condition `{_condition_source(condition, source)}` satisfied after {i} draws."
+                )
+            return values
+    stats.draws += MAX_REJECTION_ITERATIONS
+    raise ValueError(
+        f"Can't satisfy condition `{_condition_source(condition, source)}`"
+        f" after {MAX_REJECTION_ITERATIONS} draws."
+    )
+
+
+def _condition_source(condition: Callable[..., bool], source: str | None) -> str:
+    """Return the source code of the condition, if available, or else its name."""
+    if source is None:
+        try:
+            source = inspect.getsource(condition).strip()
+        except (OSError, TypeError):
+            source = getattr(condition, "__name__", repr(condition))
+    return source
+
+
 def distinct(*vals):
     """Test that all values are distinct.
 
@@ -0,0 +1,250 @@
+"""
+Compile a pTyX syntax tree into a python function.
+
+`LatexGenerator.parse_node()` resolves each node at runtime, which is repeated
+for every node, for every version of the document.
+
+Instead, `compile_tree()` generates the source code of a python function rendering
+the whole tree once, and compile it using `compile()`:
+  - static text is directly written,
+  - subtrees which are the same in every version (containing only text and pure tags,
+    see `LatexGenerator.pure_tags`) are rendered once, and the resulting text is directly written,
+  - the content of ROOT, ITEM, ELSE and ENUM nodes is inlined,
+  - #IF/#ELIF/#ELSE and #CASE blocks become python `if` statements,
+  - any other tag results in a direct call to the corresponding `_parse_TAG_tag()` method.
+
+Tags whose methods were overridden (by an extension for example) are never inlined.
+"""
+
+from typing import Any, Callable, TYPE_CHECKING, Sequence
+
+from ptyx.config import param
+from ptyx.internal_types import NiceOp
+from ptyx.syntax_tree import Node
+
+if TYPE_CHECKING:
+    from ptyx.latex_generator import LatexGenerator
+
+RenderFunction = Callable[["LatexGenerator"], None]
+
+# Nodes nested deeper are rendered using `LatexGenerator.parse_node()`,
+# to stay far from python compiler limits.
+MAX_INLINED_DEPTH = 40
+
+# The content of those tags is simply parsed by default.
+INLINED_TAGS = ("ROOT", "ITEM", "ELSE", "ENUM")
+# Tags allowed inside a CONDITIONAL_BLOCK.
+CONDITIONAL_TAGS = ("IF", "ELIF", "ELSE", "CASE")
+
+
+class _RenderFunctionBuilder:
+    """Generate the source code of the function rendering a syntax tree."""
+
+    def __init__(self, generator: "LatexGenerator"):
+        from ptyx.latex_generator import LatexGenerator
+
+        self.generator = generator
+        # The nodes used by the generated code, accessible through `N[i]`.
+        self.nodes: list[Node] = []
+        # The methods used by the generated code, as {method name: local variable}.
+        self.methods: dict[str, str] = {}
+        self.lines: list[str] = []
+        generator_class = type(generator)
+        # Inlining is only possible if the generic parsing machinery was not customized.
+        self.can_inline = all(
+            getattr(generator_class, name) is getattr(LatexGenerator, name)
+            for name in ("parse_node", "_parse_children", "_parse_CONDITIONAL_BLOCK_tag")
+        )
+        self.default_methods = {
+            tag: getattr(generator_class, self.method_name(tag))
+            is getattr(LatexGenerator, self.method_name(tag))
+            for tag in INLINED_TAGS + CONDITIONAL_TAGS
+        }
+        # Tags of LatexGenerator are not pure anymore if their methods were overridden.
+        self.pure_tags = {
+            tag
+            for tag in generator.pure_tags
+            if tag not in LatexGenerator.pure_tags
+            or getattr(generator_class, self.method_name(tag))
+            is getattr(LatexGenerator, self.method_name(tag))
+        }
+        self._static: dict[int, bool] = {}
+        # The number of characters of text of the syntax tree which are rendered only once.
+        self.static_length = 0
+
+    def method_name(self, tag: str) -> str:
+        return f"_parse_{self.generator.convert_tags.get(tag, tag)}_tag"
+
+    def is_inlinable(self, tag: str) -> bool:
+        return self.can_inline and self.default_methods.get(tag, False)
+
+    def node_ref(self, node: Node) -> str:
+        self.nodes.append(node)
+        return f"N[{len(self.nodes) - 1}]"
+
+    def emit(self, depth: int, line: str) -> None:
+        self.lines.append(4 * (depth + 1) * " " + line)
+
+    def build(self, tree: Node) -> str:
+        self.add_node(tree, 0)
+        head = ["def render(gen):", "    write = gen.write", "    parse_node = gen.parse_node"]
+        for name, variable in self.methods.items():
+            head.append(f"    {variable} = getattr(gen, {name!r})")
+        return "\n".join(head + self.lines + ["    return"])
+
+    def add_children(self, children: list[str | Node], depth: int) -> None:
+        i = 0
+        while i < len(children):
+            # Find the next group of static children.
+            j = i
+            while j < len(children) and self.is_static(children[j]):
+                j += 1
+            if j > i:
+                self.add_static_children(children[i:j], depth)
+                i = j
+            else:
+                child = children[i]
+                assert isinstance(child, Node)
+                self.add_node(child, depth)
+                i += 1
+
+    def is_static(self, child: str | Node) -> bool:
+        """Test if the child is rendered the same way in every version of the document."""
+        if isinstance(child, str):
+            return True
+        static = self._static.get(id(child))
+        if static is None:
+            # Visit the subtree without recursion (nodes are visited after their children).
+            stack: list[tuple[Node, bool]] = [(child, False)]
+            while stack:
+                node, children_visited = stack.pop()
+                subnodes = [subnode for subnode in node.children if isinstance(subnode, Node)]
+                if not children_visited:
+                    stack.append((node, True))
+                    stack.extend((subnode, False) for subnode in subnodes if id(subnode) not in self._static)
+                    continue
+                self._static[id(node)] = (
+                    self.can_inline
+                    and isinstance(node.name, str)
+                    and node.name in self.pure_tags
+                    and hasattr(self.generator, self.method_name(node.name))
+                    and all(self._static[id(subnode)] for subnode in subnodes)
+                )
+            static = self._static[id(child)]
+        return static
+
+    def add_static_children(self, children: Sequence[str | Node], depth: int) -> None:
+        """Render static children once, and write the resulting text directly."""
+        self.static_length += sum(_text_length(child) for child in children)
+        # A pending `#+`, `#-` or `#*` operator is inserted by `LatexGenerator.write()` before
+        # the first non-blank text: so, start the group with a non-blank string.
+        i = 0
+        for child in children:
+            if isinstance(child, str):
+                if child.strip():
+                    break
+                self.emit(depth, f"write({child!r})")
+            else:
+                self.add_node(child, depth)
+            i += 1
+        if i < len(children):
+            self.emit(depth, f"write({self.prerender(children[i:])!r})")
+
+    def prerender(self, children: Sequence[str | Node]) -> str:
+        """Return the LaTeX code generated by the children."""
+        if all(isinstance(child, str) for child in children):
+            return "".join(children)  # type: ignore[arg-type]
+        gen = self.generator
+        flags = gen.flags
+        previous_nice_op, flags.previous_nice_op = flags.previous_nice_op, NiceOp.NONE
+        gen._open_temp_context()
+        try:
+            gen._parse_children(children)
+        finally:
+            latex = gen.context["PTYX_LATEX"]
+            gen.context["PTYX_LATEX"] = gen.backups.pop()
+            flags.previous_nice_op = previous_nice_op
+        return "".join(latex)
+
+    def add_node(self, node: Node, depth: int) -> None:
+        tag = node.name
+        assert isinstance(tag, str), repr(node)
+        if depth < MAX_INLINED_DEPTH:
+            if tag in INLINED_TAGS and self.is_inlinable(tag):
+                self.add_children(node.children, depth)
+                return
+            if tag == "CONDITIONAL_BLOCK" and self.add_conditional_block(node, depth):
+                return
+        name = self.method_name(tag)
+        if depth >= MAX_INLINED_DEPTH or not hasattr(self.generator, name):
+            # Let `LatexGenerator.parse_node()` report the missing method at runtime.
+            self.emit(depth, f"parse_node({self.node_ref(node)})")
+            return
+        variable = self.methods.setdefault(name, f"m{len(self.methods)}")
+        self.emit(depth, f"{variable}({self.node_ref(node)})")
+
+    def add_conditional_block(self, node: Node, depth: int) -> bool:
+        """Convert #IF/#ELIF/#ELSE or #CASE blocks into python `if` statements.
+
+        Return False if the block can't be converted.
+        """
+        children = node.children
+        for i, child in enumerate(children):
+            if not (
+                isinstance(child, Node) and child.name in CONDITIONAL_TAGS and self.is_inlinable(child.name)
+            ):
+                return False
+            if child.name == "ELSE" and not (0 < i == len(children) - 1):
+                return False
+        for i, child in enumerate(children):
+            assert isinstance(child, Node)
+            if child.name == "ELSE":
+                self.emit(depth, "else:")
+                body = child.children
+            else:
+                test = f"{self.node_ref(child)}.eval_arg(0, gen.context)"
+                if child.name == "CASE":
+                    test += " == gen.NUM"
+                self.emit(depth, f"{'if' if i == 0 else 'elif'} {test}:")
+                body = child.children[1:]
+            lines_number = len(self.lines)
+            self.add_children(body, depth + 1)
+            if len(self.lines) == lines_number:
+                self.emit(depth + 1, "pass")
+        return True
+
+
+def _text_length(child: str | Node) -> int:
+    """Return the number of characters of text in the child."""
+    if isinstance(child, str):
+        return len(child)
+    length = 0
+    stack = [child]
+    while stack:
+        for grandchild in stack.pop().children:
+            if isinstance(grandchild, str):
+                length += len(grandchild)
+            else:
+                stack.append(grandchild)
+    return length
+
+
+def compile_tree(tree: Node, generator: "LatexGenerator") -> RenderFunction:
+    """Compile the syntax tree into a function rendering it, for the given LaTeX generator.
+
+    Calling the returned function with the LaTeX generator as argument is equivalent
+    to calling `generator.parse_node(tree)`.
+    """
+    builder = _RenderFunctionBuilder(generator)
+    source = builder.build(tree)
+    namespace: dict[str, Any] = {"N": tuple(builder.nodes)}
+    exec(compile(source, "<ptyx-render>", "exec"), namespace)
+    render = namespace["render"]
+    # Keep generated source code for debugging purpose.
+    render.source = source
+    # The proportion of the text of the document rendered only once.
+    total_length = _text_length(tree)
+    render.static_ratio = builder.static_length / total_length if total_length else 1.0
+    if param["debug"]:
+        print(f"Static content: {render.static_ratio:.0%} of the document.")
+    return render
@@ -0,0 +1,223 @@
+"""
+Partial evaluation of a syntax tree, for known context values.
+
+Some tags only depend on values known before rendering:
+  - #ANS, #ANSWER, #ASK_ONLY and #QUESTION depend on `PTYX_WITH_ANSWERS`,
+  - #IFNUM and #CASE depend on `PTYX_NUM` (the document number),
+    when their argument is a literal integer.
+
+`specialize_tree()` returns a smaller syntax tree, where the branches which can't
+be rendered for the given values are removed, so that they are not tested again
+for every version of the document.
+
+The original tree is never modified: only the nodes whose content changed are copied,
+the other ones are shared by both trees.
+"""
+
+import ast
+import copy
+import re
+import textwrap
+from typing import Any, Mapping, TYPE_CHECKING
+
+from ptyx.syntax_tree import Node
+
+if TYPE_CHECKING:
+    from ptyx.latex_generator import LatexGenerator
+
+# The context values a syntax tree may be specialized for.
+KNOWN_NAMES = ("PTYX_WITH_ANSWERS", "PTYX_NUM")
+
+# A syntax tree is only specialized for each document number if it contains at least this number
+# of #IFNUM and #CASE tags, since a new tree must then be generated for each version.
+MIN_NUM_TESTS = 10
+
+# Dead nodes are only removed from the content of those tags, since removing nodes
+# from any other tag (like #SHUFFLE or #PICK) may change its behaviour.
+CONTENT_TAGS = ("ROOT", "ITEM", "ELSE", "IF", "ELIF", "CASE", "ASK", "ANS", "ASK_ONLY")
+# The argument of those tags which is parsed like content, as {tag: argument number}.
+CONTENT_ARGUMENTS = {"ANSWER": 0, "QUESTION": 0, "IFNUM": 1}
+# Tags which may be removed, depending on `PTYX_WITH_ANSWERS` value.
+ANSWERS_TAGS = ("ANS", "ANSWER", "ASK_ONLY", "QUESTION")
+
+RE_KNOWN_NAME = re.compile(rf"\b({'|'.join(KNOWN_NAMES)})\b")
+
+
+def _literal_int(node: Node, i: int) -> int | None:
+    """Return the value of argument `i` of the node if it is a literal integer, else None."""
+    if i >= len(node.children):
+        return None
+    child = node.children[i]
+    if not (isinstance(child, Node) and child.name == i and len(child.children) == 1):
+        return None
+    text = child.children[0]
+    if not isinstance(text, str):
+        return None
+    try:
+        value = ast.literal_eval(text.strip())
+    except (ValueError, SyntaxError):
+        return None
+    return value if isinstance(value, int) and not isinstance(value, bool) else None
+
+
+def _modified_names(code: str) -> set[str]:
+    """Return the names of `KNOWN_NAMES` which may be modified by python code `code`.
+
+    Only plain reads of those names (like `PTYX_NUM + 1`) are considered safe: any other use,
+    like an assignment, a subscript (`globals()["PTYX_NUM"] = 3`) or a string containing the name,
+    may modify them. If `code` is not valid python code, every name found is returned.
+    """
+    found = set(RE_KNOWN_NAME.findall(code))
+    try:
+        tree = ast.parse(textwrap.dedent(code).strip())
+    except (SyntaxError, ValueError):
+        return found
+    modified: set[str] = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id in found and not isinstance(node.ctx, ast.Load):
+            modified.add(node.id)
+        elif isinstance(node, ast.Attribute) and node.attr in found:
+            modified.add(node.attr)
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            modified.update(found.intersection(node.names))
+        elif isinstance(node, ast.Constant) and isinstance(node.value, str):
+            modified.update(RE_KNOWN_NAME.findall(node.value))
+    return modified
+
+
+def _analyse(tree: Node) -> tuple[int, set[str]]:
+    """Return the number of #IFNUM and #CASE tags with a literal integer as argument,
+    and the names of `KNOWN_NAMES` which may be modified by the pTyX code."""
+    count = 0
+    assigned: set[str] = set()
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if node.name in ("IFNUM", "CASE") and _literal_int(node, 0) is not None:
+            count += 1
+        for child in node.children:
+            if isinstance(child, Node):
+                stack.append(child)
+            elif RE_KNOWN_NAME.search(child):
+                assigned.update(_modified_names(child))
+    return count, assigned
+
+
+def specializable_names(tree: Node) -> tuple[str, ...]:
+    """Return the names of the context values the tree may be specialized for.
+
+    If the pTyX code modifies any of those values, the tree can't be specialized for it.
+    """
+    num_tests, assigned = _analyse(tree)
+    names = [name for name in KNOWN_NAMES if name not in assigned]
+    if "PTYX_NUM" in names and num_tests < MIN_NUM_TESTS:
+        names.remove("PTYX_NUM")
+    return tuple(names)
+
+
+class _TreeSpecializer:
+    def __init__(self, generator: "LatexGenerator", known: Mapping[str, Any]):
+        from ptyx.latex_generator import LatexGenerator
+
+        self.with_answers = bool(known["PTYX_WITH_ANSWERS"]) if "PTYX_WITH_ANSWERS" in known else None
+        self.num = known.get("PTYX_NUM")
+        generator_class = type(generator)
+
+        def is_default(name: str) -> bool:
+            return getattr(generator_class, name, None) is getattr(LatexGenerator, name, None)
+
+        # Like for `ptyx.render.compile_tree()`, tags whose methods were overridden
+        # (by an extension for example) are left unchanged.
+        tags = CONTENT_TAGS + tuple(CONTENT_ARGUMENTS) + ANSWERS_TAGS + ("CONDITIONAL_BLOCK",)
+        self.default_methods = {
+            tag: is_default(f"_parse_{generator.convert_tags.get(tag, tag)}_tag") for tag in tags
+        }
+        self.enabled = is_default("parse_node") and is_default("_parse_children")
+
+    def is_dead(self, node: Node) -> bool:
+        """Test if the node will never generate anything."""
+        tag = node.name
+        if not isinstance(tag, str) or not self.default_methods.get(tag, False):
+            return False
+        if tag in ANSWERS_TAGS and self.with_answers is not None:
+            return self.with_answers == (tag in ("ASK_ONLY", "QUESTION"))
+        if tag == "IFNUM" and self.num is not None:
+            value = _literal_int(node, 0)
+            return value is not None and value != self.num
+        return False
+
+    def removes_dead_children(self, node: Node) -> bool:
+        """Test if dead nodes may be removed from the children of this node."""
+        if isinstance(node.name, int):
+            parent = node.parent
+            return (
+                parent is not None
+                and parent.name in CONTENT_ARGUMENTS
+                and node.name == CONTENT_ARGUMENTS[parent.name]
+                and self.default_methods[parent.name]
+            )
+        return node.name in CONTENT_TAGS and self.default_methods[node.name]
+
+    def specialize(self, tree: Node) -> Node:
+        """Return the specialized version of the tree (or the tree itself if unchanged)."""
+        # The specialized version of each node, indexed by node id.
+        # Nodes are visited after their children, using an explicit stack instead of recursion,
+        # since syntax trees may be deeply nested.
+        specialized: dict[int, Node] = {}
+        stack: list[tuple[Node, bool]] = [(tree, False)]
+        while stack:
+            node, children_visited = stack.pop()
+            if not children_visited:
+                stack.append((node, True))
+                stack.extend((child, False) for child in node.children if isinstance(child, Node))
+                continue
+            if node.name == "CONDITIONAL_BLOCK" and self.default_methods["CONDITIONAL_BLOCK"]:
+                children = [
+                    branch if isinstance(branch, str) else specialized[id(branch)]
+                    for branch in self.specialize_conditional_block(node.children)
+                ]
+            else:
+                remove_dead = self.removes_dead_children(node)
+                children = [
+                    child if isinstance(child, str) else specialized[id(child)]
+                    for child in node.children
+                    if not (remove_dead and isinstance(child, Node) and self.is_dead(child))
+                ]
+            if len(children) == len(node.children) and all(c is c_ for c, c_ in zip(children, node.children)):
+                specialized[id(node)] = node
+            else:
+                specialized[id(node)] = copy.copy(node)
+                specialized[id(node)].children = children
+        return specialized[id(tree)]
+
+    def specialize_conditional_block(self, branches: list[str | Node]) -> list[str | Node]:
+        """Remove #CASE branches which can't be selected."""
+        if self.num is None or not self.default_methods["CASE"]:
+            return branches
+        result: list[str | Node] = []
+        for branch in branches:
+            if isinstance(branch, Node) and branch.name == "CASE":
+                value = _literal_int(branch, 0)
+                if value is not None and value != self.num:
+                    continue
+                result.append(branch)
+                if value == self.num:
+                    # This branch is always selected, so the following ones never are.
+                    break
+            else:
+                result.append(branch)
+        return result
+
+
+def specialize_tree(tree: Node, generator: "LatexGenerator", known: Mapping[str, Any]) -> Node:
+    """Return a syntax tree, where the branches never rendered for the `known` context values are removed.
+
+    `known` maps some of the names of `KNOWN_NAMES` to their values.
+
+    Rendering the returned tree with the given LaTeX generator is equivalent to rendering
+    the original one, provided that the context values match the `known` ones.
+    """
+    specializer = _TreeSpecializer(generator, known)
+    if not specializer.enabled:
+        return tree
+    return specializer.specialize(tree)
@@ -7,10 +7,12 @@ Created on Sat Oct 23 15:09:44 2021
 """
 
 import re
+from types import CodeType
 from typing import Tuple, Optional, List, Dict, Union, TypeVar, Iterable, Set, Any
 
+from ptyx.config import param
 from ptyx.errors import PtyxSyntaxError, PythonExpressionError
-from ptyx.utilities import find_closing_bracket
+from ptyx.utilities import find_closing_bracket, LRUCache
 from ptyx.pretty_print import term_color, TermColors
 
 Tag = str
@@ -32,6 +34,15 @@ class Node:
         self.name = name
         self.options: Optional[str] = None
         self.children: List[NodeChild] = []
+        # Compiled python code of the arguments, see `eval_arg()`.
+        self._compiled_args: Dict[int, CodeType] = {}
+        # Information extracted once from the node content, to speed up rendering
+        # (see `LatexGenerator.analyse_tree()`).
+        self.analysis: Any = None
+        # The position of the node in the syntax tree of the document, as a tuple of indices
+        # (the i-th index is the position of the ancestor of level i among its sibling nodes).
+        # It is set by `LatexGenerator.analyse_tree()`, and it is None for trees generated at runtime.
+        self.path: Optional[tuple[int, ...]] = None
 
     def __repr__(self):
         return f"<Node {self.name} at {hex(id(self))}>"
@@ -122,7 +133,12 @@ class Node:
         """
         python_code = self.arg(i)
         try:
-            return eval(python_code, context)
+            # Compile argument only once, since the same tree is used for every version of the document.
+            # (Use "<string>" as filename, like `eval()` does, for errors to report the same information.)
+            code = self._compiled_args.get(i)
+            if code is None:
+                code = self._compiled_args[i] = compile(python_code, "<string>", "eval")
+            return eval(code, context)
         except Exception as e:
             raise PythonExpressionError(
                 python_code=python_code, ptyx_tag=str(self.name), context=context
@@ -182,6 +198,10 @@ class SyntaxTreeGenerator:
         "INCLUDE": (0, 1, None),
         "INCLUDE_START": (2, 0, None),
         "INCLUDE_END": (0, 0, None),
+        # INCLUDE_TREE isn't a real tag, but marks the place where the syntax tree
+        # of an included file must be grafted, when included files are parsed
+        # separately (see `Compiler.preparse()`).
+        "INCLUDE_TREE": (1, 0, None),
         "CALL": (0, 1, None),
         "MACRO": (0, 1, ["@END", "@END_MACRO"]),
         "PICK": (0, 0, ["@END", "@END_PICK"]),
@@ -217,11 +237,15 @@ class SyntaxTreeGenerator:
         # It is used by extensions to define new closing tags,
         # by calling `Compiler.add_new_tag()`.
         self._found_tags: Set[Tag] = set()
+        # The number of text fragments removed when normalizing the last generated syntax tree.
+        self.removed_fragments = 0
         self.reset()
 
     def reset(self) -> None:
         """Full reset."""
         self.tags = dict(self.tags)
+        # Syntax trees generated by `generate_cached_tree()`, indexed by the pTyX code.
+        self.cache: LRUCache[str, Node] = LRUCache(param["parse_cache_size"])
         self.update_tags()
         self.syntax_tree: Node | None = None
 
@@ -248,6 +272,8 @@ class SyntaxTreeGenerator:
         # Tags sorted by length (longer first).
         # This is used for matching tests.
         self.sorted_tags = sorted(self.tags, key=len, reverse=True)
+        # Cached syntax trees may be invalid now.
+        self.cache.clear()
 
     @staticmethod
     def remove_comments(text: str) -> str:
@@ -256,11 +282,13 @@ class SyntaxTreeGenerator:
         text = re.sub("( # .+)|(^# .+)", "", text, flags=re.MULTILINE)
         return text
 
-    def generate_tree(self, text: str) -> Node:
+    def generate_tree(self, text: str, strip_comments: bool = True) -> Node:
         """Pre-parse pTyX code and generate a syntax tree.
 
         :param text: some pTyX code.
         :type text: string
+        :param strip_comments: if False, assume comments were already removed.
+        :type strip_comments: bool
 
         .. note:: To access generated syntax tree, use `.syntax_tree` attribute.
         """
@@ -268,11 +296,68 @@ class SyntaxTreeGenerator:
         self._found_tags = set()
         self.syntax_tree = Node("ROOT")
         # Remove all comments from text.
-        text = self.remove_comments(text)
+        if strip_comments:
+            text = self.remove_comments(text)
         self._generate_tree(self.syntax_tree, text)
         self.syntax_tree.tags = self._found_tags  # type: ignore
+        self.removed_fragments = self.normalize_tree(self.syntax_tree)
+        if param["debug"]:
+            print(f"{self.removed_fragments} text fragments removed from syntax tree.")
         return self.syntax_tree
 
+    @staticmethod
+    def normalize_tree(tree: Node) -> int:
+        """Merge adjacent text fragments, remove empty ones, and share identical ones.
+
+        This reduces the number of `LatexGenerator.write()` calls when generating LaTeX code.
+
+        Return the number of text fragments removed.
+        """
+        # Don't use `sys.intern()`, since interned strings are never freed.
+        fragments: dict[str, str] = {}
+        removed = 0
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            children: list[NodeChild] = []
+            for child in node.children:
+                if isinstance(child, Node):
+                    stack.append(child)
+                elif not child:
+                    removed += 1
+                    continue
+                elif (
+                    children
+                    and isinstance(previous := children[-1], str)
+                    and (not previous.isspace() or child.isspace())
+                ):
+                    # Note that blank text followed by non-blank text must not be merged,
+                    # since `LatexGenerator.write()` applies the pending operator (see `NiceOp`)
+                    # to the first non-blank text.
+                    children[-1] = previous + child
+                    removed += 1
+                    continue
+                children.append(child)
+            node.children = [
+                fragments.setdefault(child, child) if isinstance(child, str) else child for child in children
+            ]
+        return removed
+
+    def generate_cached_tree(self, text: str) -> Node:
+        """Same as `generate_tree()`, but reuse the syntax tree if this code was already parsed.
+
+        This is used to parse pTyX code generated at runtime, which is often
+        the same piece of code again and again (inside a loop for example).
+
+        .. note:: The returned tree is shared, so it must not be modified.
+        """
+        tree = self.cache.get(text)
+        if tree is None:
+            tree = self.generate_tree(text)
+            self.cache[text] = tree
+        self.syntax_tree = tree
+        return tree
+
     def _generate_tree(self, node, text):
         """Parse `text`, then add corresponding content to `node`."""
         position = 0
@@ -297,8 +382,9 @@ class SyntaxTreeGenerator:
                 break
             position += 1
             # Is this a known tag ?
+            # (Don't use `text[position:]`, which would copy the whole end of the text for each tag.)
             for tag in self.sorted_tags:
-                if text[position:].startswith(tag):
+                if text.startswith(tag, position):
                     # Mmm, this begins like a known tag...
                     # In fact, it will really match a known tag if one of the following occurs:
                     # - next character is not alphanumeric ('#IF{' for example).
@@ -1,11 +1,18 @@
+import numbers
 import re
+from collections import OrderedDict
 from math import ceil, floor, isnan, isinf
 from pathlib import Path
-from typing import Sequence, Any
+from typing import Sequence, Any, Generic, Hashable, TypeVar
+
+from ptyx.sys_info import SYMPY_AVAILABLE
 
 
 RE_VERBATIM_BLOCK = r"#VERBATIM\W.*?#END(?:_VERBATIM)?"
 
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
 
 def round_away_from_zero(val, ndigits=0) -> float:
     """Round using round-away-from-zero strategy for halfway cases.
@@ -45,8 +52,9 @@ def find_closing_bracket(text: str, start: int = 0, brackets: str = "{}", detect
     2
     """
     text_beginning = text[start : start + 30]
-    # for debugging
-    index = 0
+    # Text is scanned using offsets, without slicing it, since slicing would copy the text
+    # each time (which is very expensive for large texts).
+    position = start
     balance = 1
     # None if we're not presently in a string
     # Else, string_type may be ', ''', ", or """
@@ -65,16 +73,14 @@ def find_closing_bracket(text: str, start: int = 0, brackets: str = "{}", detect
     )
     reg = re.compile(reg_str)
 
-    if start:
-        text = text[start:]
     while balance:
-        m = re.search(reg, text)
+        m = reg.search(text, position)
         if m is None:
             break
 
         result = m.group()
         i = m.start()
-        if i > 0:
+        if i > position:
             escape_string_char = False
 
         if result == open_bracket:
@@ -88,7 +94,7 @@ def find_closing_bracket(text: str, start: int = 0, brackets: str = "{}", detect
         # (Note: we have to take care of the `\` escape character, see below).
         elif result in ("'", '"') and not escape_string_char:
             if string_type is None:
-                if text[i:].startswith(3 * result):
+                if text.startswith(3 * result, i):
                     string_type = 3 * result
                     i += 2
                 else:
@@ -96,7 +102,7 @@ def find_closing_bracket(text: str, start: int = 0, brackets: str = "{}", detect
             elif string_type == result:
                 string_type = None
             elif string_type == 3 * result:
-                if text[i:].startswith(3 * result):
+                if text.startswith(3 * result, i):
                     string_type = None
                     i += 2
 
@@ -106,12 +112,10 @@ def find_closing_bracket(text: str, start: int = 0, brackets: str = "{}", detect
             escape_string_char = not escape_string_char
         else:
             escape_string_char = False
-        i += 1  # counting the current character as already scanned text
-        index += i
-        text = text[i:]
+        position = i + 1  # counting the current character as already scanned text
 
     else:
-        return start + index - 1  # last character is the searched bracket :-)
+        return position - 1  # last character is the searched bracket :-)
 
     raise ValueError("ERROR: unbalanced brackets (%s) while scanning %s..." % (balance, repr(text_beginning)))
 
@@ -171,23 +175,58 @@ def _float_me_if_you_can(expr):
 
 def numbers_to_floats(expr: Any, integers: bool = False, ndigits: int = None) -> float:
     """Convert all numbers (except integers) to floats inside a sympy expression."""
+    return _numbers_to_floats(expr, integers, ndigits)[0]
+
+
+def _numbers_to_floats(expr: Any, integers: bool = False, ndigits: int = None) -> tuple[Any, bool]:
+    """Convert all numbers (except integers) to floats inside a sympy expression.
+
+    Every largest sub-expression without symbols is converted (`2*sqrt(2)` becomes `2.83`,
+    not `2*1.41`), and the whole expression is rebuilt only once.
+
+    Return the new expression, and a boolean indicating if the converted values are equal
+    to the original ones (i.e. if no precision was lost when rounding).
+    """
     import sympy
 
     if not isinstance(expr, sympy.Basic):
         if isinstance(expr, int) and not integers:
-            return expr
+            return expr, True
         elif ndigits is not None:
-            return round_away_from_zero(expr, ndigits)
+            new = round_away_from_zero(expr, ndigits)
+            return new, _float_me_if_you_can(expr) == new
         else:
-            return float(expr)
-    for sub in sympy.preorder_traversal(expr):
-        sub = sympy.sympify(sub)
-        if not sub.has(sympy.Symbol) and (integers or not sub.is_Integer):
-            new = sub.evalf()
-            if ndigits is not None:
-                new = round_away_from_zero(new, ndigits)
-            expr = expr.subs(sub, new)
-    return expr
+            return float(expr), True
+
+    replacements: dict[sympy.Basic, sympy.Basic] = {}
+    exact = True
+
+    def convert(sub: sympy.Basic) -> None:
+        nonlocal exact
+        if integers or not sub.is_Integer:
+            value = sub.evalf()
+            if ndigits is None:
+                replacements[sub] = value
+            else:
+                new = round_away_from_zero(value, ndigits)
+                exact = exact and _float_me_if_you_can(value) == new
+                replacements[sub] = sympy.Float(new)
+
+    def has_symbol(sub: sympy.Basic) -> bool:
+        """Test if `sub` contains a symbol, converting its largest sub-expressions without symbols."""
+        if isinstance(sub, sympy.Symbol):
+            return True
+        args_with_symbols = [(arg, has_symbol(arg)) for arg in sub.args]
+        if any(found for _, found in args_with_symbols):
+            for arg, found in args_with_symbols:
+                if not found:
+                    convert(arg)
+            return True
+        return False
+
+    if not has_symbol(expr):
+        convert(expr)
+    return expr.xreplace(replacements), exact
 
 
 def latex_verbatim(s: str) -> str:
@@ -244,3 +283,138 @@ def force_hardlink_to(link: Path, target: Path) -> None:
     """Create a hardlink `link` to target `target`, even if `link` already exist."""
     link.unlink(missing_ok=True)
     link.hardlink_to(target)
+
+
+class LRUCache(Generic[K, V]):
+    """A cache keeping only the `maxsize` most recently used values.
+
+    If `maxsize` is 0, nothing is cached.
+
+    >>> from ptyx.utilities import LRUCache
+    >>> cache = LRUCache(maxsize=2)
+    >>> cache["a"] = 1
+    >>> cache["b"] = 2
+    >>> cache.get("a")
+    1
+    >>> cache["c"] = 3
+    >>> cache.get("b") is None
+    True
+    >>> cache.hits, cache.misses
+    (1, 1)
+    """
+
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self._data: OrderedDict[K, V] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: K, default: V | None = None) -> V | None:
+        """Return the value associated with `key`, or `default` if `key` is not in cache."""
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key: K, value: V) -> None:
+        if self.maxsize <= 0:
+            return
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def clear(self) -> None:
+        """Remove all the cached values (hits and misses counters are kept)."""
+        self._data.clear()
+
+    def resize(self, maxsize: int) -> None:
+        """Change the maximal number of cached values, removing the least recently used ones if needed."""
+        self.maxsize = maxsize
+        while len(self._data) > max(maxsize, 0):
+            self._data.popitem(last=False)
+
+
+# Builtins functions without side effects.
+_PURE_BUILTINS = frozenset(
+    {
+        abs,
+        all,
+        any,
+        bool,
+        complex,
+        divmod,
+        float,
+        int,
+        len,
+        max,
+        min,
+        pow,
+        range,
+        round,
+        sorted,
+        str,
+        sum,
+        tuple,
+    }
+)
+# Functions of sympy with side effects, or generating random values.
+_IMPURE_SYMPY_FUNCTIONS = frozenset({"var", "init_printing", "init_session", "pprint", "preview"})
+
+
+def is_memoizable(value: Any, functions: bool = True) -> bool:
+    """Test if `value` is immutable (i.e. a number, a string, a sympy object or a tuple of those).
+
+    If `functions` is True, pure functions (like sympy ones or `abs()`) are accepted too.
+    """
+    if value is None or isinstance(value, (bool, int, float, str, numbers.Rational)):
+        return True
+    if isinstance(value, tuple):
+        return all(is_memoizable(item, functions) for item in value)
+    if SYMPY_AVAILABLE:
+        import sympy
+
+        if isinstance(value, sympy.Basic):
+            return True
+        if functions and isinstance(value, type) and issubclass(value, sympy.Basic):
+            # Sympy functions like `sin`, or classes like `Rational`.
+            return True
+    if functions and callable(value):
+        try:
+            if value in _PURE_BUILTINS:
+                return True
+        except TypeError:
+            return False
+        name = getattr(value, "__name__", "")
+        return (
+            (getattr(value, "__module__", None) or "").startswith("sympy.")
+            and "rand" not in name
+            and name not in _IMPURE_SYMPY_FUNCTIONS
+        )
+    return False
+
+
+def memoization_key(value: Any) -> Any:
+    """Return a key identifying a memoizable value (see `is_memoizable()`).
+
+    Values which compare equal but have different types (like `1`, `1.0`, `True`
+    or `sympy.Integer(1)`) must not share the same key, since they may be rendered differently.
+    """
+    if isinstance(value, tuple):
+        return tuple, tuple(memoization_key(item) for item in value)
+    if SYMPY_AVAILABLE:
+        import sympy
+
+        if isinstance(value, sympy.Basic) and value.args:
+            return type(value), tuple(memoization_key(arg) for arg in value.args)
+    return type(value), value
@@ -1,3 +1,8 @@
+import pytest
+import sympy
+
+from ptyx.config import param
+from ptyx.context import GLOBAL_CONTEXT, new_context, lookup
 from tests import parse
 
 
@@ -45,3 +50,108 @@ a = 7
 def test_tagged_eval():
     code = """#{:17:a=3}"""
     assert parse(code) == "3"
+
+
+def test_new_context():
+    context = new_context()
+    assert type(context) is dict and lookup(context, "sqrt") is sympy.sqrt
+    exec("def f(n):\n    return sqrt(n) + randint(1, 1)\na = f(4)", context)
+    assert context["a"] == 3
+    assert eval("f(9)", context) == 4
+    # Values are stored in the context, not in GLOBAL_CONTEXT.
+    assert "a" not in GLOBAL_CONTEXT and "a" in context
+    assert sympy.sympify("a*x", locals=context) == 3 * sympy.Symbol("x")
+    assert set(context) == {"a", "f", "__builtins__"}
+    # The builtins are shared by all the contexts.
+    assert new_context()["__builtins__"] is context["__builtins__"]
+    assert lookup(context, "undefined", 7) == 7
+
+
+def test_APART_context():
+    code = "#{a=1}#APART #{a=2}#a #END#a"
+    assert parse(code) == "1 22 1"
+
+
+def test_sympy_parse_cache():
+    from ptyx.latex_generator import LatexGenerator, _sympy_global_dict
+
+    gen = LatexGenerator()
+    gen.context.update(a=sympy.Integer(3), f=sympy.Function("f"), e="", l=[1, 2])
+    for code in ("1/2 + a", "x^2 + f(a)", "e + 1", "max(2, a)", "l[0]/4", "Rational(a, 4)"):
+        expected = sympy.sympify(code, locals={**GLOBAL_CONTEXT, **gen.context})
+        codeobj, symbols = gen._compile_sympy_expr(code)
+        assert eval(codeobj, _sympy_global_dict(), {**GLOBAL_CONTEXT, **gen.context, **symbols}) == expected
+    assert len(gen._sympy_compiled_code) == 6
+    gen._compile_sympy_expr("1/2 + a")
+    assert len(gen._sympy_compiled_code) == 6
+    # Generated code depends on which names are defined in the context.
+    del gen.context["a"]
+    codeobj, _ = gen._compile_sympy_expr("1/2 + a")
+    assert len(gen._sympy_compiled_code) == 7
+    assert eval(codeobj, _sympy_global_dict(), gen.context) == sympy.S(1) / 2 + sympy.Symbol("a")
+    with pytest.raises(sympy.SympifyError):
+        gen._compile_sympy_expr("1 +* (")
+
+
+def test_expression_memoization(monkeypatch):
+    from ptyx.latex_generator import Compiler
+
+    code = "#SEED{4}#PYTHON\nl=[1]\n#END_PYTHON"
+    code += "#{a=randint(2, 3)}#{b=randint(2, 3)}#{c=a*b/7} #{c^2} #{randint(1, 1000)} #{(d:=a)}#d #{l[0]}"
+    compiler = Compiler(code=code)
+    results = [compiler.get_latex(PTYX_NUM=num) for num in range(20)]
+    cache = compiler.latex_generator.expression_cache
+    # `randint(...)`, `(d:=a)` and `l[0]` are never cached.
+    assert cache.hits > 0 and cache.misses < 4 * 5
+    # Same results without cache.
+    monkeypatch.setitem(param, "expression_cache_size", 0)
+    uncached_compiler = Compiler(code=code)
+    assert [uncached_compiler.get_latex(PTYX_NUM=num) for num in range(20)] == results
+    assert uncached_compiler.latex_generator.expression_cache.hits == 0
+    assert len({result.split()[2] for result in results}) > 10
+
+
+def test_is_memoizable():
+    from ptyx.utilities import is_memoizable
+
+    for value in (
+        1,
+        sympy.S(1) / 3,
+        sympy.sqrt(2) + sympy.Symbol("x"),
+        "a",
+        (1, sympy.pi),
+        sympy.sin,
+        abs,
+        sympy.factor,
+    ):
+        assert is_memoizable(value)
+    for value in ([1], {1: 2}, sympy.Matrix([1]), print, sympy.var, sympy.randprime, lambda: 1, (1, [])):
+        assert not is_memoizable(value)
+    assert not is_memoizable(sympy.sin, functions=False)
+
+
+def test_sympy_evaluation():
+    assert parse("#{a=1/3}#{a^2}#{a.p}#{b=''}#{b+1}") == r"\frac{1}{3}\frac{1}{9}1b + 1"
+
+
+def test_expression_memoization_types(monkeypatch):
+    from ptyx.latex_generator import Compiler
+    from ptyx.utilities import memoization_key
+
+    code = "#{a=[1, 1.0, True, sympy.S(1), (1,), (1.0,)][PTYX_NUM]}#{a} #{a == 1}"
+    compiler = Compiler()
+    compiler.load(code=code)
+    versions = (0, 1, 2, 3, 4, 5, 0, 1, 2)
+    results = [compiler.get_latex(PTYX_NUM=num) for num in versions]
+    with monkeypatch.context() as patch:
+        patch.setitem(param, "expression_cache_size", 0)
+        uncached_compiler = Compiler()
+        uncached_compiler.load(code=code)
+        assert results == [uncached_compiler.get_latex(PTYX_NUM=num) for num in versions]
+    assert results[0] != results[1]
+    compiler.load(code="#{a=[1, 1.0][PTYX_NUM - 1];}#{a/2}")
+    assert [compiler.get_latex(PTYX_NUM=num) for num in (1, 2, 1)] == [r"\frac{1}{2}", "0,5", r"\frac{1}{2}"]
+    assert len({memoization_key(value) for value in (1, 1.0, True, sympy.S(1), sympy.Float(1))}) == 5
+    assert memoization_key(sympy.S(1) + sympy.Symbol("x")) != memoization_key(
+        sympy.Float(1) + sympy.Symbol("x")
+    )
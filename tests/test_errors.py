@@ -145,3 +145,20 @@ def test_PythonBlockError_pickling():
         assert isinstance(pickled_err, PythonBlockError)
         assert e.info.message == "'(' was never closed"
         assert pickled_err.info.message == "'(' was never closed"
+
+
+def test_compiled_code_error_information():
+    """Errors must report the same information when python code is compiled once and reused."""
+    code = "#PYTHON\n  a = 5\n  b = 1/(a - 5 - PTYX_NUM)\n#END_PYTHON#IF{1/(PTYX_NUM - 1)}#END"
+    compiler = Compiler()
+    compiler.load(code=code)
+    for num in (0, 0):
+        with pytest.raises(PythonBlockError) as exc_info:
+            compiler.get_latex(PTYX_NUM=num)
+        assert exc_info.value.info == ErrorInformation("ZeroDivisionError", "division by zero", 2, 2, 4, 24)
+    # The python code block was compiled only once.
+    assert len(compiler.latex_generator._python_blocks) == 1
+    for num in (1, 1):
+        with pytest.raises(PythonExpressionError) as exc_info2:
+            compiler.get_latex(PTYX_NUM=num)
+        assert exc_info2.value.info == ErrorInformation("ZeroDivisionError", "division by zero", 1, 1, 0, 16)
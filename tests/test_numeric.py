@@ -0,0 +1,56 @@
+from fractions import Fraction
+
+import pytest
+import sympy
+
+from ptyx.config import param
+from ptyx.internal_types import EvalFlags
+from ptyx.numeric import compile_numeric_expr, div, numeric2latex, power
+from tests import parse
+
+
+@pytest.fixture
+def numeric_mode(monkeypatch):
+    monkeypatch.setitem(param, "numeric_mode", True)
+
+
+def test_numeric_helpers():
+    assert div(1, 3) == Fraction(1, 3)
+    assert type(div(4, 2)) is int
+    assert div(1.0, 4) == 0.25
+    assert power(2, -2) == Fraction(1, 4)
+    assert type(power(Fraction(2, 3), 2)) is Fraction
+    assert power(4, 0.5) == 2.0
+    assert isinstance(div(sympy.Integer(1), 3), sympy.Rational)
+    context = {"__ptyx_div__": div, "__ptyx_pow__": power, "a": 3}
+    assert eval(compile_numeric_expr("1/a + 2^a - a**-1"), context) == 8
+
+
+def test_numeric2latex(monkeypatch):
+    monkeypatch.setitem(param, "floating_point", ",")
+    assert numeric2latex(Fraction(-1, 3)) == r"- \frac{1}{3}"
+    assert numeric2latex(Fraction(7, 2)) == r"\frac{7}{2}"
+    assert numeric2latex(-4) == "-4"
+    assert numeric2latex(2.5) == "2,5"
+    assert numeric2latex(-0.0) == "0"
+    assert numeric2latex(Fraction(1, 4), EvalFlags(keep_dot_as_decimal_mark=True)) == "0.25"
+    assert numeric2latex(sympy.sqrt(2)) == r"\sqrt{2}"
+
+
+def test_numeric_mode(numeric_mode):
+    code = "#SEED{7}#{a=randint(2, 9);b=randfrac();}#{type(a).__name__} #{type(b).__name__} #{1/4} #{2^-1}"
+    assert parse(code) == r"int Fraction \frac{1}{4} \frac{1}{2}"
+    # Nice operators and flags.
+    assert (
+        parse("#{a=3;}x #+#{-1/a} #*#{-a} #-#{a/2}") == r"x - \frac{1}{3} \times \left(-3\right) -\frac{3}{2}"
+    )
+    assert parse("#[2]{1/3} #{1/4} #=#[1]{1/4}") == r"0,33 \frac{1}{4}  \approx 0,3"
+    # Sympy is used for symbolic objects.
+    assert parse("#{sqrt(2)/2} #{x^2} #{3!}") == r"\frac{\sqrt{2}}{2} x^{2} 6"
+
+
+def test_numeric_mode_same_output(numeric_mode):
+    code = "#SEED{3}#{a=randint(2, 9)}#{b=srandint(2, 9)}#{a/b} #{a^2/(b+1)} #{randchoice(1, 2, 3)}"
+    output = parse(code)
+    param["numeric_mode"] = False
+    assert parse(code) == output
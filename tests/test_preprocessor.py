@@ -0,0 +1,98 @@
+from pathlib import Path
+
+import pytest
+
+from ptyx.errors import PtyxSyntaxError
+from ptyx.preprocessor import Preprocessor, SourceBuffer, clean_generated_code
+
+TEST_DIR = Path(__file__).parent
+
+
+def resolve(path: str) -> Path:
+    return TEST_DIR / path.strip()
+
+
+def test_preprocess():
+    code = "#SEED{5}#LOAD{questions} Hello # a comment\n# Another one\n#SEED{ 7 }world #LOAD{ questions }!"
+    result = Preprocessor(resolve).preprocess(code)
+    assert result.code == "#LOAD{questions} Hello\n\nworld #LOAD{ questions }!"
+    assert result.seeds == [5, 7]
+    assert result.extensions == ["questions"]
+
+
+def test_include_position():
+    code = "#SEED{5}A # comment\nB#INCLUDE{include_example.txt}Z"
+    result = Preprocessor(resolve).preprocess(code)
+    assert result.code.startswith("A\nB\n#APART")
+    # Position of the #INCLUDE tag in the main file.
+    assert f"#INCLUDE_START{{{TEST_DIR / 'include_example.txt'}}}{{{code.index('#INCLUDE')}}}" in result.code
+
+
+def test_comment_after_removed_tag(tmp_path):
+    (tmp_path / "sub.txt").write_text("A\n#SEED{9}# after seed\nB")
+    preprocessor = Preprocessor(lambda path: tmp_path / path)
+    assert preprocessor.preprocess("#SEED{3}# foo\nbar").code == "\nbar"
+    assert preprocessor.preprocess("x #SEED{3}# foo").code == "x"
+    assert preprocessor.preprocess("x#SEED{3}# foo").code == "x# foo"
+    code = preprocessor.preprocess("#INCLUDE{sub.txt}").code
+    assert "after seed" not in code and "\nB#END_APART" in code
+    assert preprocessor.preprocess(SourceBuffer(tmp_path / "sub.txt")).code == "A\n\nB"
+
+
+def test_commented_include():
+    code = "A\n# #INCLUDE{include_example.txt}\nB"
+    assert Preprocessor(resolve).preprocess(code).code == "A\n\nB"
+
+
+def test_collect_included_files(tmp_path):
+    (tmp_path / "a.txt").write_text("#SEED{2}#LOAD{ext2}A #LOAD{ext1}#INCLUDE{b.txt}")
+    (tmp_path / "b.txt").write_text("#SEED{3}#LOAD{ext3}B")
+    code = "#SEED{1}#LOAD{ext1}#INCLUDE{a.txt}#SEED{4}#LOAD{ext2}#INCLUDE{b.txt}#SEED{5}"
+    expected = Preprocessor(lambda path: tmp_path / path).preprocess(code)
+    result = Preprocessor(lambda path: tmp_path / path, collect_included_files=True).preprocess(code)
+    assert "#INCLUDE_TREE{0}" in result.code and "#INCLUDE_TREE{1}" in result.code
+    assert [included_file.path for included_file in result.included] == [
+        tmp_path / "a.txt",
+        tmp_path / "b.txt",
+    ]
+    assert result.seeds == [1, 4, 5]
+    included = [
+        Preprocessor(lambda path: tmp_path / path).preprocess(SourceBuffer(path))
+        for path, *_ in result.included
+    ]
+    # Files included by an included file are inserted.
+    assert "#LOAD{ext3}B#END_APART" in included[0].code
+    # Same seeds and extensions order as when included files are inserted.
+    result.insert_included(included)
+    assert result.seeds == expected.seeds == [1, 2, 3, 4, 3, 5]
+    assert result.extensions == expected.extensions == ["ext1", "ext2", "ext3"]
+
+
+def test_self_inclusion(tmp_path):
+    (tmp_path / "a.txt").write_text("#INCLUDE{b.txt}")
+    (tmp_path / "b.txt").write_text("#INCLUDE{a.txt}")
+    with pytest.raises(PtyxSyntaxError, match="includes itself"):
+        Preprocessor(lambda path: tmp_path / path).preprocess("#INCLUDE{a.txt}")
+
+
+def test_clean_generated_code():
+    assert clean_generated_code("A # comment\n#SEED{3}B") == ("A\nB", [3])
+
+
+def test_source_buffer(tmp_path):
+    main = tmp_path / "main.ptyx"
+    main.write_bytes("#SEED{3}Héhé # comment\r\nA#INCLUDE{empty.txt}#INCLUDE{sub.txt}B\r\n".encode("utf8"))
+    (tmp_path / "empty.txt").write_bytes(b"")
+    (tmp_path / "sub.txt").write_bytes("# comment\r\nZ # é\r\n".encode("utf8"))
+    result = Preprocessor(lambda path: tmp_path / path).preprocess(SourceBuffer(main))
+    assert result.seeds == [3]
+    assert "\r" not in result.code
+    assert result.code.startswith("Héhé\nA\n#APART#INCLUDE_START")
+    assert "\n\nZ\n#END_APART" in result.code
+    text = main.read_text()
+    assert f"{{{tmp_path / 'sub.txt'}}}{{{text.index('#INCLUDE{sub.txt}')}}}" in result.code
+
+
+def test_missing_source_file(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        SourceBuffer(tmp_path / "missing.ptyx")
@@ -1,4 +1,13 @@
+import random
+from fractions import Fraction
+
+import pytest
+from sympy import S
+
+from ptyx import randfunc
+from ptyx.config import param
 from ptyx.randfunc import randchoice, srandchoice, randfrac
+from tests import parse
 
 
 def test_randchoice():
@@ -12,3 +21,193 @@ def test_randchoice():
 def test_randfrac():
     for i in range(1000):
         assert randfrac(2, 7, den=6).q == 6
+
+
+def test_random_sequences_compatibility():
+    """Random values generated for a given seed must never change, or documents would change."""
+    r = randfunc
+    r.set_seed(2024)
+    values = [
+        r.randint(),
+        r.randint(-5, 5, exclude=[0]),
+        r.srandint(2, 9),
+        r.randsign(),
+        r.randbool(),
+        r.randfrac(2, 9),
+        r.srandfrac(2, 7, not_decimal=True),
+        r.randchoice([1, 2, 3], signed=True),
+        r.randsample(list(range(10)), 3),
+        r.randfloat(0, 1, 3),
+        r.srandfloat(1, 2, 2),
+        tuple(r.randpoint(0, 5)),
+        r.many(4),
+        r.randmatrix((2, 3)).tolist(),
+        r.randmatrix((3, 3), rank=2).tolist(),
+    ]
+    items = list(range(8))
+    r.shuffle(items)
+    values.append(items)
+    assert str(values) == (
+        "[9, -3, -5, -1, True, 9/5, -6/7, 2, [4, 8, 5], 0.532, 1.94, (1, 5), [-4, 8, 7, -9],"
+        " [[4, -8, -7], [7, -8, -5]], [[-5, 2, 2], [-7, -3, -5], [-17, 30, 38]], [0, 6, 5, 1, 4, 7, 2, 3]]"
+    )
+    # Python `random` module is seeded too, but it doesn't share its state with `randfunc` functions.
+    assert random.random() == 0.47009071843107064
+    code = "#SEED{5}#{randint(1,100)} #SHUFFLE #ITEM a #ITEM b #ITEM c #END #PICK #ITEM x #ITEM y #END #[rand]{[1,2,3]}"
+    assert parse(code, PTYX_NUM=2) == "42   c  b  a    x  1"
+
+
+def test_generator_isolation():
+    randfunc.set_seed(7)
+    first = randfunc.get_generator()
+    value = randfunc.randint(1, 1000)
+    random.seed(1)
+    randfunc.set_seed(7)
+    assert randfunc.get_generator() is not first
+    assert randfunc.randint(1, 1000) == value
+    assert sorted(randfunc.randmaketrans("abcd").values()) == [ord(c) for c in "abcd"]
+
+
+def test_independent_random_streams(monkeypatch):
+    question = "#PICK #ITEM a#{randint(1, 1000)} #ITEM b#{randint(1, 1000)} #ITEM c#{randint(1, 1000)} #END"
+    template = "#SEED{3}#PYTHON\nx = randint(1, 1000)\n#END_PYTHON #x Q1 | Q2 | Q3 #{randint(1, 1000)}"
+    code = template.replace("Q1", question).replace("Q2", question).replace("Q3", question)
+    edited = code.replace("#PICK", "#PICK #{randint(1, 9)}", 1)
+    monkeypatch.setitem(param, "independent_random_streams", True)
+    for num in range(1, 4):
+        original = parse(code, PTYX_NUM=num).split("|")
+        modified = parse(edited, PTYX_NUM=num).split("|")
+        # Only the first question changed.
+        assert original[0] != modified[0]
+        assert original[1:] == modified[1:]
+        # Same questions don't get the same values.
+        assert original[1].strip() != original[2].strip()
+    assert parse(code, PTYX_NUM=1) != parse(code, PTYX_NUM=2)
+
+
+def test_independent_random_streams_repeated_nodes(monkeypatch):
+    items = "".join(f"#ITEM {c}" for c in "abcdefgh")
+    monkeypatch.setitem(param, "independent_random_streams", True)
+    # A macro is rendered several times.
+    code = f"#SEED{{3}}#MACRO{{m}}#SHUFFLE {items}#END#END_MACRO #CALL{{m}}|#CALL{{m}}|#CALL{{m}}"
+    for num in range(1, 4):
+        calls = parse(code, PTYX_NUM=num).split("|")
+        assert len({call.strip() for call in calls}) == 3
+    # Nodes generated at runtime depend on the enclosing stream.
+    python = f'#PYTHON\nwrite("#SHUFFLE {items}#END", parse=True)\n#END_PYTHON'
+    code = f"#SEED{{3}}{python}|{python}|#{{randint(1, 1000)}}"
+    edited = code.replace("#PYTHON\n", "#PYTHON\nrandint(1, 9)\n", 1)
+    for num in range(1, 4):
+        original = parse(code, PTYX_NUM=num).split("|")
+        assert original[0].strip() != original[1].strip()
+        assert parse(edited, PTYX_NUM=num).split("|")[1:] == original[1:]
+
+
+def test_derive_generator():
+    randfunc.set_seed(5)
+    first = randfunc.derive_generator((1, 2)).random()
+    randfunc.randint()
+    assert randfunc.derive_generator((1, 2)).random() == first
+    assert randfunc.derive_generator((2, 1)).random() != first
+    generator = randfunc.get_generator()
+    with randfunc.using_generator(randfunc.derive_generator((0,))):
+        assert randfunc.get_generator() is not generator
+    assert randfunc.get_generator() is generator
+
+
+def test_batch_functions():
+    randfunc.set_seed(11)
+    values = randfunc.randints(1000, 2, 9, exclude=[3, 4])
+    assert len(values) == 1000
+    assert set(values) == {2, 5, 6, 7, 8, 9}
+    values = randfunc.srandints(12, 1, 6, unique=True)
+    assert sorted(values) == [-6, -5, -4, -3, -2, -1, 1, 2, 3, 4, 5, 6]
+    values = randfunc.randints(100, -(10**9), 10**9, exclude=[0], unique=True)
+    assert len(set(values)) == 100 and all(-(10**9) <= v <= 10**9 for v in values)
+    fractions = randfunc.randfracs(500, 2, 9, exclude=[S(1) / 2], not_decimal=True)
+    assert len(fractions) == 500
+    assert all(f.q != 1 and f != S(1) / 2 and not randfunc.is_mult_2_5(f.q) for f in fractions)
+    assert all(f.q in (3, 7) for f in randfunc.randfracs(50, den=[3, 7]))
+    floats = randfunc.randfloats(99, 0, 1, d=2, unique=True)
+    assert len(set(floats)) == 99 and all(0 < f < 1 and round(f, 2) == f for f in floats)
+    with pytest.raises(ValueError):
+        randfunc.randints(3, 1, 2, unique=True)
+
+
+def test_many_batch(monkeypatch):
+    randfunc.set_seed(4)
+    first = randfunc.many(50, randfunc.randint, batch=True, a=-30, b=30)
+    assert len(set(first)) == 50
+    randfunc.set_seed(4)
+    assert randfunc.many(50, randfunc.randint, batch=True, a=-30, b=30) == first
+    # Functions without batch implementation.
+    assert len(set(randfunc.many(5, randfunc.randchoice, batch=True, items=list(range(5))))) == 5
+    # Unhashable values.
+    assert len(randfunc.many(3, randfunc.randchoice, items=[[1], [2], [3]])) == 3
+    # Numeric mode.
+    monkeypatch.setitem(param, "numeric_mode", True)
+    assert all(type(f) is Fraction for f in randfunc.randfracs(10))
+    assert all(type(v) is int for v in randfunc.srandints(10))
+
+
+def test_many_with_multiplicities(monkeypatch):
+    monkeypatch.setitem(param, "enumerate_conditions", True)
+    randfunc.set_condition_sampling(randfunc.ConditionSampling())
+    randfunc.set_seed(2)
+    draws = [
+        tuple(randfunc.many_with(lambda a, b: a != 3, 2, randfunc.randchoice, items=[1, 1, 2, 3]))
+        for _ in range(3000)
+    ]
+    assert randfunc.get_condition_sampling().stats.enumerations == 1
+    # Like `many()`: P(1, 2) = 1/2 * 1/2, P(2, 1) = 1/4 * 2/3, P(1, 3) = 1/2 * 1/2, P(2, 3) = 1/4 * 1/3.
+    assert set(draws) == {(1, 2), (2, 1), (1, 3), (2, 3)}
+    assert draws.count((1, 2)) / len(draws) == pytest.approx(0.25 / (0.25 + 1 / 6 + 0.25 + 1 / 12), abs=0.03)
+    assert draws.count((2, 1)) / len(draws) == pytest.approx(1 / 6 / (0.25 + 1 / 6 + 0.25 + 1 / 12), abs=0.03)
+
+
+def test_many_with_impure_conditions(monkeypatch):
+    monkeypatch.setitem(param, "enumerate_conditions", True)
+
+    def user_function(a):
+        return a > 2
+
+    n = 3
+    assert randfunc._condition_key(lambda a, b: a > n * b and abs(a) < 10) is not None
+    assert randfunc._condition_key(lambda a: a > randfunc.randint(1, 5)) is None
+    assert randfunc._condition_key(lambda a: a > random.randint(1, 5)) is None
+    assert randfunc._condition_key(lambda a: user_function(a)) is None
+    assert randfunc._condition_key(lambda a: print(a)) is None
+    # Such conditions are evaluated again for each draw.
+    randfunc.set_condition_sampling(randfunc.ConditionSampling())
+    randfunc.set_seed(6)
+    values = {
+        randfunc.many_with(lambda a: a > random.randint(1, 5), 1, randfunc.randint)[0] for _ in range(100)
+    }
+    assert min(values) == 2
+    assert randfunc.get_condition_sampling().stats.enumerations == 0
+
+
+def test_rank():
+    from sympy import Matrix
+
+    randfunc.set_seed(8)
+    for _ in range(300):
+        size = (randfunc.randint(1, 5), randfunc.randint(1, 5))
+        matrix = randfunc.randmatrix(size, func=randfunc.randint, a=-2, b=2).tolist()
+        if randfunc.randbool():
+            # Add linearly dependent rows.
+            matrix.append([2 * v - w for v, w in zip(matrix[0], matrix[-1])])
+        assert randfunc._rank(matrix) == Matrix(matrix).rank()
+    matrix = [[S(1) / 2, Fraction(1, 3)], [3, 2]]
+    assert randfunc._rank(matrix) == 1
+    assert randfunc._rank([[S(1) / 2, 1.5], [1, 3]]) == 1
+
+
+def test_randmatrices():
+    randfunc.set_seed(2)
+    matrices = randfunc.randmatrices(20, (5, 4), rank=3)
+    assert len(matrices) == 20
+    assert all(matrix.shape == (5, 4) and matrix.rank() == 3 for matrix in matrices)
+    matrices = randfunc.randmatrices(5, (2, 2), rank=2, func=randfunc.randchoice, items=[0, 1])
+    assert all(matrix.rank() == 2 for matrix in matrices)
+    assert all(matrix.shape == (3, 2) for matrix in randfunc.randmatrices(3, (3, 2)))
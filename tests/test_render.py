@@ -0,0 +1,161 @@
+import io
+import time
+
+from ptyx.latex_generator import Compiler, LatexGenerator
+from ptyx.render import compile_tree, MAX_INLINED_DEPTH
+
+CODE = """#SEED{1}
+a #IF{1>2}x#ELIF{True}y#ELSE z#END
+#CASE{0}c0#CASE{1}c1#ELSE ce#END
+#CASE{2}c2#END
+#SHUFFLE #ITEM i1 #ITEM i2 #END
+#PICK #ITEM p1 #ITEM p2 #END
+#{a=2}#+#a #-#{-a} #*#a
+"""
+
+
+def test_compiled_tree():
+    compiler = Compiler()
+    compiler.load(code=CODE)
+    render = compile_tree(compiler.syntax_tree, compiler.latex_generator)
+    assert "if " in render.source
+    gen = compiler.latex_generator
+    for num in range(4):
+        expected = compiler.get_latex(PTYX_NUM=num)
+        # Render the tree without the compiled function, with the same seed.
+        compiler._state["render"] = (gen, lambda gen_: gen_.parse_node(compiler.syntax_tree))
+        assert compiler.get_latex(PTYX_NUM=num) == expected
+        compiler._state.pop("render")
+
+
+def test_overridden_methods():
+    class CustomLatexGenerator(LatexGenerator):
+        def _parse_ITEM_tag(self, node):
+            self.write("[")
+            super()._parse_ITEM_tag(node)
+            self.write("]")
+
+        def _parse_IF_tag(self, node):
+            self.write("IF")
+            return super()._parse_IF_tag(node)
+
+    compiler = Compiler()
+    compiler.latex_generator = CustomLatexGenerator(compiler)
+    latex = compiler.parse(code="#SEED{1}#PICK#ITEM a#END #IF{True}b#END")
+    assert latex == "[ a] IFb"
+    render = compiler._state["render"][1]
+    assert "if " not in render.source
+    assert "_parse_CONDITIONAL_BLOCK_tag" in render.source
+
+
+def test_deeply_nested_tree():
+    depth = MAX_INLINED_DEPTH + 10
+    code = depth * "#IF{True}" + "deep" + depth * "#END"
+    compiler = Compiler()
+    assert compiler.parse(code=code) == "deep"
+    assert "parse_node(N[" in compiler._state["render"][1].source
+
+
+def test_write_latex(monkeypatch):
+    code = "#SEED{2}" + 50 * (
+        "#{a=randint(2,9)} #+#{b=-randint(2,9)}x #*#{1}y #{a**0}#*#{a} #=#[2]{a/7} #=#{a} #APART#{c=a}#c#END_APART #PRINT_EVAL{#a}\n"
+    )
+    compiler = Compiler()
+    compiler.load(code=code)
+    expected = compiler.get_latex(PTYX_NUM=3)
+    monkeypatch.setattr(LatexGenerator, "flush_threshold", 5)
+    gen = compiler.latex_generator
+    sizes = []
+    flush = gen.flush
+
+    def spy(final=False):
+        flush(final)
+        sizes.append(len(gen.context["PTYX_LATEX"]))
+
+    monkeypatch.setattr(gen, "flush", spy)
+    output = io.StringIO()
+    compiler.write_latex(output, PTYX_NUM=3)
+    assert output.getvalue() == expected
+    # Generated code never accumulated.
+    assert len(sizes) > 50
+    assert max(sizes) < 20
+    assert compiler.latex_generator.output is None
+
+
+def test_write_latex_pending_expression(monkeypatch):
+    # Blank text following an evaluated expression is kept until it is known whether
+    # `#*` modifies the expression, but it must be scanned only once (not at each flush).
+    code = (
+        "#{a=1}#PYTHON\nfor i in range(20000):\n    write(' ')\n#END_PYTHON#*#{b=2} text"
+        "#PYTHON\nfor i in range(3000):\n    write('x')\n#END_PYTHON end"
+    )
+    compiler = Compiler()
+    compiler.load(code=code)
+    expected = compiler.get_latex()
+    assert expected.endswith(" 2 text" + 3000 * "x" + " end")
+    monkeypatch.setattr(LatexGenerator, "flush_threshold", 5)
+    gen = compiler.latex_generator
+    durations = []
+    flush = gen.flush
+
+    def spy(final=False):
+        start = time.perf_counter()
+        flush(final)
+        durations.append(time.perf_counter() - start)
+
+    monkeypatch.setattr(gen, "flush", spy)
+    output = io.StringIO()
+    compiler.write_latex(output)
+    assert output.getvalue() == expected
+    assert len(durations) > 20000
+    # Scanning the whole pending text at each flush would take several seconds.
+    assert sum(durations) < 1
+
+
+def test_static_subtrees():
+    code = "#SEED{3}Start #VERBATIM$x_1$ & #END #ENUM a #COMMENT b #END c#END #{a=randint(2,9)}#+ #ENUM d#END end"
+    compiler = Compiler()
+    compiler.load(code=code)
+    gen = compiler.latex_generator
+    latex = compiler.get_latex(PTYX_NUM=1)
+    render = compiler._state["render"][1]
+    # Static subtrees were rendered only once.
+    assert "_parse_VERBATIM_tag" not in render.source and "_parse_ENUM_tag" not in render.source
+    assert 0.5 < render.static_ratio < 1
+    compiler._state["render"] = (gen, lambda gen_: gen_.parse_node(compiler.syntax_tree))
+    assert compiler.get_latex(PTYX_NUM=1) == latex
+    assert latex.endswith(" 5 + d end")
+
+
+def test_pure_tags():
+    class CustomLatexGenerator(LatexGenerator):
+        pure_tags = LatexGenerator.pure_tags | {"STAR"}
+
+        def _parse_STAR_tag(self, node):
+            self.write("*")
+
+        def _parse_ENUM_tag(self, node):
+            self.write(str(self.NUM))
+
+    compiler = Compiler()
+    compiler.latex_generator = CustomLatexGenerator(compiler)
+    compiler.add_new_tags(("STAR", (0, 0, None)), ("ENUM", (0, 0, ["@END"])))
+    compiler.load(code="a #STAR b #ENUM#END")
+    assert compiler.get_latex(PTYX_NUM=2) == "a * b 2"
+    assert compiler.get_latex(PTYX_NUM=3) == "a * b 3"
+    source = compiler._state["render"][1].source
+    assert "_parse_STAR_tag" not in source and "_parse_ENUM_tag" in source
+
+
+def test_iterative_tree_walk():
+    depth = 3000
+    code = "#SEED{1}" + depth * "#IF{True}#ASK #ENUM " + "#{1+1}#ANS ans#END" + depth * "#END#END#END"
+    compiler = Compiler()
+    compiler.load(code=code)
+    for answers in (False, True):
+        latex = compiler.get_latex(PTYX_WITH_ANSWERS=answers).strip()
+        assert latex == ("2 ans" if answers else "2")
+    gen = compiler.latex_generator
+    gen.clear()
+    gen.parse_node(compiler.syntax_tree)
+    assert gen.read().strip() == "2"
@@ -0,0 +1,108 @@
+from ptyx.latex_generator import Compiler, LatexGenerator
+from ptyx.specialize import specialize_tree, specializable_names, MIN_NUM_TESTS
+from ptyx.syntax_tree import Node
+
+CODE = """#SEED{5}
+#ASK Question #{a=randint(2, 9)}#a? #END
+#ASK_ONLY Only for students. #END
+#ANS Answer: #{2*a}. #END
+#SHUFFLE
+#ITEM first #ANS (a) #END
+#ITEM second #ANS (b) #END
+#END
+#CASE{0}zero#CASE{1}one#CASE{a}a#ELSE other#END
+#IFNUM{2}{two}#IFNUM{3}{three}
+"""
+
+
+def _tags(node: Node) -> list[str]:
+    tags = []
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node.name, str):
+            tags.append(node.name)
+        stack.extend(child for child in node.children if isinstance(child, Node))
+    return sorted(tags)
+
+
+def test_specialize_tree():
+    compiler = Compiler()
+    compiler.load(code=CODE)
+    tree = compiler.syntax_tree
+    gen = compiler.latex_generator
+    original_tags = _tags(tree)
+    specialized = specialize_tree(tree, gen, {"PTYX_WITH_ANSWERS": False, "PTYX_NUM": 1})
+    tags = _tags(specialized)
+    assert "ANS" not in tags and "ASK_ONLY" in tags
+    assert tags.count("CASE") == 1 and "ELSE" not in tags
+    assert "IFNUM" not in tags
+    # The original tree is unchanged.
+    assert _tags(tree) == original_tags
+    tags = _tags(specialize_tree(tree, gen, {"PTYX_WITH_ANSWERS": True, "PTYX_NUM": 2}))
+    assert "ASK_ONLY" not in tags and tags.count("ANS") == 3
+    # `#CASE{a}` can't be evaluated, so the following branches are kept.
+    assert tags.count("CASE") == 1 and "ELSE" in tags
+    assert tags.count("IFNUM") == 1
+    # Nothing to remove.
+    assert specialize_tree(tree, gen, {}) is tree
+
+
+def test_specialized_rendering():
+    code = CODE + MIN_NUM_TESTS * "#CASE{4}four#END"
+    for answers in (False, True):
+        for num in range(5):
+            compiler = Compiler()
+            compiler.load(code=code)
+            assert specializable_names(compiler.syntax_tree) == ("PTYX_WITH_ANSWERS", "PTYX_NUM")
+            latex = compiler.get_latex(PTYX_NUM=num, PTYX_WITH_ANSWERS=answers)
+            # Render the whole tree.
+            compiler._state["specializable_names"] = ()
+            assert compiler.get_latex(PTYX_NUM=num, PTYX_WITH_ANSWERS=answers) == latex
+            assert ("Answer" in latex) == answers and ("Only for students" in latex) != answers
+            assert ("four" in latex) == (num == 4)
+
+
+def test_modified_context_values():
+    compiler = Compiler()
+    compiler.load(code="#{PTYX_WITH_ANSWERS = True}#ANS ok#END")
+    assert specializable_names(compiler.syntax_tree) == ()
+    assert compiler.get_latex(PTYX_WITH_ANSWERS=False).endswith("ok")
+
+
+def test_content_arguments():
+    compiler = Compiler()
+    compiler.load(code="#IFNUM{2}{a #ANS b#END #ASK_ONLY c#END}#ANSWER{#ASK_ONLY d#END}")
+    tags = _tags(specialize_tree(compiler.syntax_tree, compiler.latex_generator, {"PTYX_WITH_ANSWERS": True}))
+    assert tags == ["ANS", "ANSWER", "IFNUM", "ROOT"]
+
+
+def test_overridden_case_tag():
+    class CustomLatexGenerator(LatexGenerator):
+        def _parse_CASE_tag(self, node):
+            self.write("CASE")
+            return super()._parse_CASE_tag(node)
+
+    compiler = Compiler()
+    compiler.latex_generator = CustomLatexGenerator(compiler)
+    compiler.load(code="#CASE{0}zero#CASE{1}one#ELSE other#END")
+    tree = compiler.syntax_tree
+    tags = _tags(specialize_tree(tree, compiler.latex_generator, {"PTYX_NUM": 1}))
+    assert tags.count("CASE") == 2 and "ELSE" in tags
+
+
+def test_modified_names():
+    for code in (
+        "#PYTHON\nPTYX_NUM += 1\n#END_PYTHON",
+        '#PYTHON\ncontext["PTYX_NUM"] = 3\n#END_PYTHON',
+        '#{globals()["PTYX_NUM"] = 1}',
+        "#PYTHON\nif True:\n    PTYX_NUM = 2\n#END_PYTHON",
+        "#ASSERT{(PTYX_NUM := 1)}",
+    ):
+        compiler = Compiler()
+        compiler.load(code=code + MIN_NUM_TESTS * "#CASE{1}one#END")
+        assert "PTYX_NUM" not in specializable_names(compiler.syntax_tree), code
+    compiler = Compiler()
+    compiler.load(code="#{PTYX_NUM + 1} #IF{PTYX_WITH_ANSWERS}a#END" + MIN_NUM_TESTS * "#CASE{1}one#END")
+    assert specializable_names(compiler.syntax_tree) == ("PTYX_WITH_ANSWERS", "PTYX_NUM")
+    assert compiler.get_latex(PTYX_NUM=1, PTYX_WITH_ANSWERS=True).startswith("2 a")
@@ -6,6 +6,7 @@ import pytest
 
 import ptyx
 from ptyx.latex_generator import SyntaxTreeGenerator  # , parse
+from ptyx.syntax_tree import Node
 from tests import parse, Compiler
 
 
@@ -133,6 +134,40 @@ write("#a", parse=True)
     assert parse(test) == "$\\#$ #a 5\n"
 
 
+def test_normalize_tree():
+    tree = Node("ROOT")
+    tree.children = [" ", "a", "", "b", "\n"]
+    for _ in range(2):
+        node = Node("IF")
+        node.children = ["x", "y"]
+        tree.children.append(node)
+    tree.children += [" ", " "]
+    assert SyntaxTreeGenerator.normalize_tree(tree) == 6
+    # Blank text followed by non-blank text must not be merged, since a pending operator
+    # (like in `#+#a`) must be applied to the first non-blank text.
+    assert tree.children[:3] == [" ", "ab\n", tree.children[2]]
+    assert tree.children[-1] == "  "
+    node1, node2 = tree.children[2:4]
+    assert node1.children == node2.children == ["xy"]
+    # Identical fragments are shared.
+    assert node1.children[0] is node2.children[0]
+
+
+def test_write_parse_cache(compiler):
+    test = r"""
+#PYTHON
+for a in range(3):
+    write("#a, ", parse=True)
+#END_PYTHON
+"""
+    assert compiler.parse(code=test) == "0, 1, 2, \n"
+    cache = compiler.latex_generator.parser.cache
+    assert (cache.misses, cache.hits) == (1, 2)
+    # Cache must be invalidated when new tags are defined.
+    compiler.add_new_tags(("NEW_TAG", (0, 0, None)))
+    assert len(cache) == 0
+
+
 def test_write_verbatim():
     test = r"""
 #PYTHON
@@ -3,6 +3,9 @@ import re
 
 import pytest
 
+from ptyx.config import param
+from ptyx.errors import PtyxRuntimeError
+from ptyx.internal_types import NiceOp
 from ptyx.latex_generator import Compiler
 from tests import TEST_DIR, parse
 
@@ -209,6 +212,29 @@ def test_EVAL_rounding():
     assert parse(r"#[2,.]{2/3}") == r"0.67"
 
 
+def test_EVAL_analysis(compiler):
+    code = "#{l=[1,2];i=0}#{l[i]=5;}#[2,.]{:label:a=l[0]/3 if l[0] > 1}#{b=2 if l[1] < 0}#{b}#IF{False}#[unknown]{a}#END"
+    compiler.load(code=code)
+    nodes = [node for node in compiler.syntax_tree.children if getattr(node, "name", None) == "EVAL"]
+    info = nodes[2].analysis
+    assert info.flags == {"round": 2, "keep_dot_as_decimal_mark": True}
+    assert info.label == "label"
+    assert info.display
+    assert [(s.varname, s.key, s.code) for s in info.statements] == [
+        ("a", None, "l[0]/3 if l[0] > 1 else ''")
+    ]
+    assert [(s.varname, s.key) for s in nodes[1].analysis.statements] == [("l", "i")]
+    assert not nodes[1].analysis.display
+    # Unknown flag error is only raised if the tag is rendered.
+    for num in range(2):
+        assert compiler.get_latex(PTYX_NUM=num) == "01.67b"
+
+
+def test_EVAL_unknown_flag():
+    with pytest.raises(PtyxRuntimeError, match="Unknown flag 'unknown'"):
+        parse("#[unknown]{a}")
+
+
 def test_ADD():
     code = r"""#PYTHON
 a, b = 2, 3
@@ -285,6 +311,65 @@ Last, $a=7$ still."""
     assert parse(code) == result
 
 
+def test_comment_after_SEED(tmp_path):
+    (tmp_path / "sub.ptyx").write_text("#SEED{9}# after seed\nsub")
+    assert parse("#SEED{3}# foo\nbar") == "\nbar"
+    assert parse("x #SEED{3}# foo") == "x"
+    main = tmp_path / "main.ptyx"
+    main.write_text("main #INCLUDE{sub.ptyx}")
+    compiler = Compiler()
+    compiler.load(path=main)
+    latex = compiler.get_latex()
+    assert "#" not in latex and "sub" in latex
+
+
+def test_INCLUDE_parallel(monkeypatch):
+    os.chdir(TEST_DIR)
+    code = """#SEED{99}
+First, $a=#{a=7}$
+#INCLUDE{include_example.txt}
+#IF{a == 7}#INCLUDE{include_example.txt}#END
+Last, $a=#a$ still."""
+    expected = Compiler()
+    expected.load(code=code)
+    monkeypatch.setitem(param, "parallel_includes", True)
+    compiler = Compiler()
+    compiler.load(code=code)
+    assert compiler.syntax_tree.display(color=False) == expected.syntax_tree.display(color=False)
+    assert compiler.get_latex() == expected.get_latex()
+    assert compiler.syntax_tree.tags == expected.syntax_tree.tags
+
+
+def test_INCLUDE_parallel_seeds_and_extensions(monkeypatch, tmp_path):
+    from ptyx.extensions import extended_python
+
+    (tmp_path / "sub.ptyx").write_text("#SEED{2}#LOAD{extended_python}\n...\nb = 3\n...\n#b")
+    code = "#SEED{1}\n...\na = 2\n...\n#INCLUDE{sub.ptyx} #a"
+    main = tmp_path / "main.ptyx"
+    main.write_text(code)
+    expected = Compiler()
+    expected.load(path=main)
+    received = []
+    extension_main = extended_python.main
+
+    def spy(code_, compiler=None):
+        received.append(code_)
+        return extension_main(code_, compiler)
+
+    monkeypatch.setattr(extended_python, "main", spy)
+    monkeypatch.setitem(param, "parallel_includes", True)
+    compiler = Compiler()
+    compiler.load(path=main)
+    # Like with inline inclusion, the last #SEED wins, and extensions of included files are loaded.
+    assert compiler._state["seed"] == expected._state["seed"] == 2
+    assert compiler.get_latex() == expected.get_latex()
+    # Extensions receive the main file code, where included files are replaced with markers,
+    # and the code of each included file separately.
+    [included, main_code] = received
+    assert "#INCLUDE_TREE{0}" in main_code and "b = 3" not in main_code
+    assert "b = 3" in included
+
+
 def test_VERBATIM_tag():
     # VERBATIM test 1 (python code)
     code = r"""
@@ -404,3 +489,18 @@ Bye!
 """
     compiler.reset()
     assert parse(code=code, PTYX_WITH_ANSWERS=True) == result
+
+
+def test_EQUAL_tag():
+    assert parse(r"#{a=1/3;}$a#=\fbox{#[2]{a}}$ $2a#=#[2]{2*a+1/3}$") == r"$a \approx \fbox{0,33}$ $2a = 1$"
+    assert parse(r"#=#COMMENT x#END\emph{#[1]{1/4}}") == r" \approx \emph{0,3}"
+
+
+def test_EQUAL_tag_missing_marker():
+    compiler = Compiler()
+    compiler.load(code="#{a=1}")
+    gen = compiler.latex_generator
+    gen.clear()
+    gen.flags.previous_nice_op = NiceOp.EQ
+    with pytest.raises(PtyxRuntimeError, match="`#=` marker not found"):
+        gen._eval_and_format_python_expr("1/3")
@@ -1,5 +1,7 @@
 import pytest
 
+from ptyx.config import param
+
 from ptyx.pretty_print import TermColors, term_color
 from ptyx.printers import sympy2latex
 from ptyx.utilities import (
@@ -8,6 +10,8 @@ from ptyx.utilities import (
     extract_verbatim_tag_content,
     restore_verbatim_tag_content,
     latex_verbatim,
+    numbers_to_floats,
+    _numbers_to_floats,
 )
 
 
@@ -72,6 +76,33 @@ def test_sympy2latex():
     assert sympy2latex("hello") == "hello"
 
 
+def test_sympy2latex_cache(monkeypatch):
+    import sympy
+
+    from ptyx.internal_types import EvalFlags
+    from ptyx.printers import LATEX_CACHE, get_printer
+
+    monkeypatch.setitem(param, "floating_point", ",")
+    LATEX_CACHE.clear()
+    expr = sympy.Rational(5, 2) * sympy.Symbol("x") + sympy.Float(1.5)
+    latex = sympy2latex(expr)
+    hits = LATEX_CACHE.hits
+    assert sympy2latex(expr) == latex
+    assert LATEX_CACHE.hits == hits + 1
+    # Flags and decimal mark are part of the cache key.
+    assert sympy2latex(expr, EvalFlags(format_as_str=True)) == str(expr).replace(".", ",")
+    assert sympy2latex(sympy.Float(1.5), EvalFlags(keep_dot_as_decimal_mark=True)) == "1.5"
+    monkeypatch.setitem(param, "floating_point", ".")
+    assert sympy2latex(sympy.Float(1.5)) == "1.5"
+    monkeypatch.setitem(param, "floating_point", ",")
+    assert sympy2latex(sympy.Float(1.5)) == "1,5"
+    # Mutable matrices are not cached.
+    assert sympy2latex(sympy.Matrix([[1, 2]])) == r"\begin{pmatrix}1 & 2\end{pmatrix}"
+    # Printers are reused.
+    assert get_printer(mode="plain") is get_printer(mode="plain")
+    assert get_printer(mode="plain") is not get_printer(mode="inline")
+
+
 def test_extract_verbatim_tag_content():
     code = (
         "hello\n#VERBATIM\ndef f(x):\n  return x+1\n#END\nguten Tag\n#VERBATIM\na = 5\n#END_VERBATIM\nbonjour"
@@ -102,3 +133,46 @@ def test_term_color():
         )
         == "\x1b[1;3;4;7;41m hello \x1b[0m"
     )
+
+
+def test_latex_cache_size(monkeypatch):
+    from ptyx.latex_generator import Compiler
+    from ptyx.printers import LATEX_CACHE
+
+    monkeypatch.setattr(LATEX_CACHE, "maxsize", LATEX_CACHE.maxsize)
+    monkeypatch.setitem(param, "latex_cache_size", 3)
+    compiler = Compiler()
+    assert LATEX_CACHE.maxsize == 3
+    compiler.parse(code="#{a=S(1)/7}#{a}#{a/2}#{a/3}#{a/4}#{a/5}")
+    assert len(LATEX_CACHE) <= 3
+    monkeypatch.setitem(param, "latex_cache_size", 0)
+    Compiler()
+    assert LATEX_CACHE.maxsize == 0 and len(LATEX_CACHE) == 0
+
+
+def test_numbers_to_floats():
+    import sympy
+    from sympy import sqrt, Rational, Symbol, Matrix, exp
+
+    x = Symbol("x")
+    assert numbers_to_floats(x / 3 + sympy.pi, ndigits=2) == sympy.Float(0.33) * x + sympy.Float(3.14)
+    # Largest sub-expressions without symbols are converted as a whole.
+    assert numbers_to_floats(sqrt(x) + 2 * sqrt(2), ndigits=2) == x ** sympy.Float(0.5) + sympy.Float(2.83)
+    assert numbers_to_floats(3 * x**2 - Rational(7, 4) * x + 1) == 3 * x**2 - sympy.Float(1.75) * x + 1
+    assert numbers_to_floats(exp(x / 7), ndigits=1) == exp(sympy.Float(0.1) * x)
+    matrix = Matrix([[1, Rational(1, 3)], [x, 2]]).as_immutable()
+    assert numbers_to_floats(matrix, ndigits=2) == Matrix([[1, sympy.Float(0.33)], [x, 2]])
+    assert numbers_to_floats(7) == 7
+    assert numbers_to_floats(sympy.Integer(5), integers=True) == 5.0
+
+
+def test_numbers_to_floats_exactness():
+    import sympy
+    from sympy import Rational, Symbol
+
+    x = Symbol("x")
+    assert _numbers_to_floats(Rational(1, 4) * x + Rational(3, 2), ndigits=2) == (0.25 * x + 1.5, True)
+    assert _numbers_to_floats(Rational(1, 3) * x + Rational(3, 2), ndigits=2)[1] is False
+    assert _numbers_to_floats(sympy.sqrt(2), ndigits=3) == (sympy.Float(1.414), False)
+    assert _numbers_to_floats(2.5, ndigits=0) == (3.0, False)
+    assert _numbers_to_floats(2.5, ndigits=1) == (2.5, True)